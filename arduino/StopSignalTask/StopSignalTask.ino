@@ -101,6 +101,191 @@ void writeData(const char str[], unsigned long t){
   Serial.write(END_MARKER);
 }
 
+// Stop trial schedule streamed by the PC (stage 4 and 5, when scheduleLength > 0).
+// The kinds of upcoming trials are kept in a ring buffer indexed by trial number;
+// more are requested with "SQ" (first trial missing) when less than SCHEDULE_LOW are left.
+#define SCHEDULE_SIZE 64
+#define SCHEDULE_LOW 32
+#define SCHEDULE_RETRY 512   // ticks before an unanswered request is repeated
+#define KIND_GO 0
+#define KIND_STOP 1
+#define KIND_NOISE 2
+byte scheduleBuf[SCHEDULE_SIZE];
+int scheduleLength = 0;    // 0: the board draws the stop trials itself
+int scheduleNext = 1;      // next trial to be received
+int scheduleRequested = 0;
+unsigned long scheduleRequestTime = 0;
+String lineFromPC = "";    // unframed line, i.e. the initial SSD
+long ssdFromPC = 0;
+bool ssdReceived = false;
+bool pollFromPC = false;   // read the PC with pollSerial (binary commands or streamed schedule)
+
+void storeSchedule(int first, const byte kinds[], int n){
+  if(first != scheduleNext)
+    return;   // repeated answer
+  for(int i=0; i<n; i++){
+    scheduleBuf[scheduleNext % SCHEDULE_SIZE] = kinds[i];
+    scheduleNext++;
+  }
+}
+
+// text command "Q<first trial>:<kinds>", one digit per trial
+void receiveSchedule(String chunk){
+  int colon = chunk.indexOf(':');
+  if(colon < 0)
+    return;
+  byte kinds[SCHEDULE_SIZE];
+  int n = 0;
+  for(unsigned int i=colon+1; i<chunk.length() && n<SCHEDULE_SIZE; i++)
+    kinds[n++] = chunk[i] - '0';
+  storeSchedule(chunk.substring(1, colon).toInt(), kinds, n);
+}
+
+// Binary command frames from the PC:
+//   0xAA 0x55 length seq type payload[length] crc(low) crc(high)
+// crc is CRC-16/CCITT-FALSE over length..payload. A valid frame is acknowledged
+// with an "AK" event carrying seq, a corrupt one with "NK"; a repeated seq (the
+// ACK was lost) is acknowledged again but not applied twice.
+#define SYNC1 0xAA
+#define SYNC2 0x55
+#define MSG_PARAMS 1
+#define MSG_SSD 2
+#define MSG_TEST 3
+#define MSG_RESTART 4
+#define MSG_SCHEDULE 5
+#define MAX_PAYLOAD 40
+bool binaryCommands = false;
+byte frameBuf[MAX_PAYLOAD+5];   // length seq type payload crc
+int framePos = -2;              // -2: waiting for SYNC1, -1: waiting for SYNC2
+int lastSeq = -1;
+
+unsigned int crc16(const byte data[], int n){
+  unsigned int crc = 0xFFFF;
+  for(int i=0; i<n; i++){
+    crc ^= (unsigned int)data[i] << 8;
+    for(int b=0; b<8; b++)
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+  }
+  return crc & 0xFFFF;
+}
+
+unsigned int readU16(const byte p[]){
+  return p[0] | ((unsigned int)p[1] << 8);
+}
+
+void handleFrame(byte type, const byte p[], int n){
+  if(type == MSG_PARAMS){
+    setParamsFromFrame(p);
+  }else if(type == MSG_SSD){
+    ssdFromPC = readU16(p);
+    ssdReceived = true;
+  }else if(type == MSG_TEST){
+    complete_command = String((char)p[0]);
+  }else if(type == MSG_RESTART){
+    Serial.flush();   // let the ACK out first
+    soft_restart();
+  }else if(type == MSG_SCHEDULE){
+    storeSchedule(readU16(p), p+2, n-2);
+  }
+}
+
+void frameByte(byte rb){
+  if(framePos == -2){
+    if(rb == SYNC1)
+      framePos = -1;
+    return;
+  }
+  if(framePos == -1){
+    framePos = rb == SYNC2 ? 0 : (rb == SYNC1 ? -1 : -2);
+    return;
+  }
+  if(framePos == 0 && rb > MAX_PAYLOAD){   // not a length, resynchronise
+    framePos = -2;
+    return;
+  }
+  frameBuf[framePos++] = rb;
+  int n = frameBuf[0];
+  if(framePos < n+5)
+    return;
+  framePos = -2;
+  byte seq = frameBuf[1];
+  if(crc16(frameBuf, n+3) != readU16(frameBuf+n+3)){
+    writeData("NK", seq);
+    // a lost byte pulled in the start of the next frame: parse again from there
+    byte rest[MAX_PAYLOAD+5];
+    memcpy(rest, frameBuf, n+5);
+    for(int i=0; i<n+5; i++)
+      frameByte(rest[i]);
+    return;
+  }
+  writeData("AK", seq);
+  if(seq == lastSeq)
+    return;
+  lastSeq = seq;
+  handleFrame(frameBuf[2], frameBuf+3, n);
+}
+
+// read everything the PC sent: binary frames, or framed text commands,
+// 'r' and the initial SSD line
+void pollSerial(){
+  while (Serial.available() > 0) {
+    char rb = Serial.read();
+    if (binaryCommands) {
+      frameByte(rb);
+    } else if (recv_in_progress) {
+      if (rb != END_MARKER) {
+        command_from_pc += rb;
+      } else {
+        recv_in_progress = false;
+        if (command_from_pc[0] == 'Q')
+          receiveSchedule(command_from_pc);
+        else if (command_from_pc[0] == 'r')
+          soft_restart();   // <r> at session end, in every stage that polls
+        else
+          complete_command = command_from_pc;
+        command_from_pc = "";
+      }
+    } else if (rb == START_MARKER) {
+      recv_in_progress = true;
+    } else if (rb == 'r') {
+      soft_restart();
+    } else if (rb == '\n') {
+      ssdFromPC = lineFromPC.toInt();
+      ssdReceived = true;
+      lineFromPC = "";
+    } else {
+      lineFromPC += rb;
+    }
+  }
+}
+
+void requestSchedule(int trialNum, unsigned long t){
+  if(scheduleNext > scheduleLength || scheduleNext - trialNum > SCHEDULE_LOW)
+    return;
+  if(scheduleRequested != scheduleNext || t - scheduleRequestTime > SCHEDULE_RETRY){
+    writeData("SQ", scheduleNext);
+    scheduleRequested = scheduleNext;
+    scheduleRequestTime = t;
+  }
+}
+
+int scheduledKind(int trialNum){
+  if(trialNum > scheduleLength)
+    return KIND_GO;
+  if(trialNum >= scheduleNext){   // not received in time
+    writeData("SU", trialNum);
+    return KIND_GO;
+  }
+  return scheduleBuf[trialNum % SCHEDULE_SIZE];
+}
+
+// a skipped stop trial is tried again on the next trial
+void scheduleRetry(int trialNum){
+  int next = trialNum + 1;
+  if(next < scheduleNext && next <= scheduleLength && scheduleBuf[next % SCHEDULE_SIZE] == KIND_GO)
+    scheduleBuf[next % SCHEDULE_SIZE] = KIND_STOP;
+}
+
 void writeCorrectStop(char side='l'){
   if(side=='l'){
     writeData("IL",0);
@@ -434,10 +619,14 @@ class Stage1:public ExperimentalProcedure
     if (t - reward.getRewardStartTime() >= reward.getRewardVolume())
       reward.off();
     }
-    while(Serial.available()){
-      char c = Serial.read();
-      if(c=='r'){
-        soft_restart();
+    if(pollFromPC){
+      pollSerial();
+    }else{
+      while(Serial.available()){
+        char c = Serial.read();
+        if(c=='r'){
+          soft_restart();
+        }
       }
     }
     if (delayOn)
@@ -508,10 +697,14 @@ class Stage2:public ExperimentalProcedure
       if (t - reward.getRewardStartTime() >= reward.getRewardVolume())
         reward.off();
     }
-    while(Serial.available()){
-      char c = Serial.read();
-      if(c=='r'){
-        soft_restart();
+    if(pollFromPC){
+      pollSerial();
+    }else{
+      while(Serial.available()){
+        char c = Serial.read();
+        if(c=='r'){
+          soft_restart();
+        }
       }
     }
     sf->updateState(t);
@@ -606,10 +799,14 @@ class Stage3:public ExperimentalProcedure
       if(t-lhStartTime>limitedHold)
         lh=false;
     }  
-    while(Serial.available()){
-      char c = Serial.read();
-      if(c=='r'){
-        soft_restart();
+    if(pollFromPC){
+      pollSerial();
+    }else{
+      while(Serial.available()){
+        char c = Serial.read();
+        if(c=='r'){
+          soft_restart();
+        }
       }
     }
     fm->updateState(t);
@@ -777,7 +974,10 @@ class Stage4:public ExperimentalProcedure
       fr->updateState(t);
       fl->updateState(t);
     }
-    if(trialNum>=sessionLength || trialNum<=baselineLength){
+    if(pollFromPC){
+      pollSerial();
+      requestSchedule(trialNum, t);
+    }else if(trialNum>=sessionLength || trialNum<=baselineLength){
       while(Serial.available()){
         char c = Serial.read();
         if(c=='r'){
@@ -801,7 +1001,10 @@ class Stage4:public ExperimentalProcedure
         writeData("TN",trialNum);
         if(trialNum>baselineLength){
           //stopChecked=false;
-          isStopTrial = checkIfStop(trialNum, stopArray, 0, stopTrialsNum-1);
+          if(scheduleLength > 0)
+            isStopTrial = scheduledKind(trialNum) != KIND_GO;
+          else
+            isStopTrial = checkIfStop(trialNum, stopArray, 0, stopTrialsNum-1);
           if(isStopTrial){
             writeData("TT",2);
           }else{
@@ -1039,7 +1242,12 @@ class Test:public ExperimentalProcedure
   // stop Array change dynamically
 
   void stopArrayUpdate(bool isSkipped){
-    
+    if(scheduleLength > 0){
+      if(isSkipped)
+        scheduleRetry(trialNum);
+      return;
+    }
+
     // get array length
     int arrayLength = stopTrialsNum;
   
@@ -1079,20 +1287,31 @@ class Test:public ExperimentalProcedure
   {
     // obtain the initial stop signal delay ssd when baseline ended from the control program in PC.
     while(trialNum==baselineLength+1 && !ssdCatched){
-       while(Serial.available()){
-         char inByte=Serial.read();
-           if(inByte=='\n'){
-             ssdCatched=true;
-           }else{
-             initialSSD+=inByte;
-           }
-       }
-       if(ssdCatched){
-         ssd=initialSSD.toInt();
+       if(pollFromPC){
+         pollSerial();
+         if(ssdReceived){
+           ssd=ssdFromPC;
+           ssdCatched=true;
+         }
+       }else{
+         while(Serial.available()){
+           char inByte=Serial.read();
+             if(inByte=='\n'){
+               ssdCatched=true;
+             }else{
+               initialSSD+=inByte;
+             }
+         }
+         if(ssdCatched){
+           ssd=initialSSD.toInt();
+         }
        }
     }
 
-    if(trialNum>=sessionLength || trialNum<=baselineLength){
+    if(pollFromPC){
+      pollSerial();
+      requestSchedule(trialNum, t);
+    }else if(trialNum>=sessionLength || trialNum<=baselineLength){
       while(Serial.available()){
         char c = Serial.read();
         if(c=='r'){
@@ -1155,6 +1374,17 @@ class Test:public ExperimentalProcedure
         // check if stop
         if(trialNum>baselineLength){
         //  stopChecked=false;
+          if(scheduleLength > 0){
+            int kind = scheduledKind(trialNum);
+            isStopTrial = kind == KIND_STOP;
+            isNoiseTrial = kind == KIND_NOISE;
+            if(isNoiseTrial)
+              writeData("TT",3);
+            else if(isStopTrial)
+              writeData("TT",2);
+            else
+              writeData("TT",1);
+          }else{
           isStopTrial = checkIfStop(trialNum, stopArray, 0, stopTrialsNum-1);
           if(isStopTrial){
               if(with_10_noise){
@@ -1172,6 +1402,7 @@ class Test:public ExperimentalProcedure
             }else{
               writeData("TT",1);
             }
+          }
         }else{
           writeData("TT",1);
         }
@@ -1410,7 +1641,10 @@ class TestBox:public ExperimentalProcedure
   }
   
   void updating(unsigned long t){
-    recvCommandFromPC();
+    if(pollFromPC)
+      pollSerial();
+    else
+      recvCommandFromPC();
     if(complete_command[0]=='t'){
       complete_command = "";
       reward.on();
@@ -1457,16 +1691,42 @@ int laserFreq;
 int pulseDur;
 long laserDur;
 
-String inputArguments[15];
+String inputArguments[16];
 String singleArgument="";
 int counter=0;
 boolean argumentsComplete = false;
 
+// parameters of a MSG_PARAMS frame, little endian
+void setParamsFromFrame(const byte p[]){
+  stage = p[0];
+  side = (char)p[1];
+  lh = readU16(p+2);
+  len = readU16(p+4);
+  baseline = readU16(p+6);
+  stopNum = readU16(p+8);
+  rdelay = readU16(p+10);
+  blockLength = readU16(p+12);
+  blockNumber = readU16(p+14);
+  reward_volume = readU16(p+16);
+  blinkFreq = readU16(p+18);
+  isLaser = p[20];
+  laserFreq = readU16(p+21);
+  pulseDur = readU16(p+23);
+  laserDur = readU16(p+25) | ((long)readU16(p+27) << 16);
+  scheduleLength = readU16(p+29);
+  argumentsComplete = true;
+}
+
 void getParams() {
-  while (Serial.available()) {
+  while (Serial.available() && !argumentsComplete) {
     // get the new byte:
     char inByte = Serial.read(); 
-    if(inByte==','){
+    // a binary frame as the first byte switches to binary commands
+    if(binaryCommands || (counter == 0 && singleArgument.length() == 0 && (byte)inByte == SYNC1)){
+      binaryCommands = true;
+      frameByte(inByte);
+    }
+    else if(inByte==','){
       inputArguments[counter]=singleArgument;
       singleArgument = "";
       counter++;
@@ -1567,30 +1827,34 @@ void setup()
     getParams();
   }
   
-  stage=inputArguments[0].toInt();
-  side = char(inputArguments[1][0]);
-  lh=inputArguments[2].toInt();
-  len=inputArguments[3].toInt();
-  baseline=inputArguments[4].toInt();
-  
-  rdelay=inputArguments[6].toInt();
-  blockLength=inputArguments[7].toInt();
-  blockNumber=inputArguments[8].toInt();
-  
-  stopNum=inputArguments[5].toInt();
-  
-  reward_volume=inputArguments[9].toInt();
+  if(!binaryCommands){   // binary parameters were set by setParamsFromFrame
+    stage=inputArguments[0].toInt();
+    side = char(inputArguments[1][0]);
+    lh=inputArguments[2].toInt();
+    len=inputArguments[3].toInt();
+    baseline=inputArguments[4].toInt();
+    
+    rdelay=inputArguments[6].toInt();
+    blockLength=inputArguments[7].toInt();
+    blockNumber=inputArguments[8].toInt();
+    
+    stopNum=inputArguments[5].toInt();
+    
+    reward_volume=inputArguments[9].toInt();
+    blinkFreq=inputArguments[10].toInt();
+
+    isLaser=inputArguments[11].toInt();
+    laserFreq=inputArguments[12].toInt();
+    pulseDur=inputArguments[13].toInt();
+    laserDur=inputArguments[14].toInt();
+    scheduleLength=inputArguments[15].toInt();  // empty (0) from older control programs
+  }
+  pollFromPC = binaryCommands || scheduleLength > 0;
+
   reward.setParams(reward_volume);
-  
-  blinkFreq=inputArguments[10].toInt();
   f[0].setParams(blinkFreq);
   f[1].setParams(blinkFreq);
   f[2].setParams(blinkFreq);
-
-  isLaser=inputArguments[11].toInt();
-  laserFreq=inputArguments[12].toInt();
-  pulseDur=inputArguments[13].toInt();
-  laserDur=inputArguments[14].toInt();
   
   if(stage==1){
     s1.setParams(rdelay);
@@ -1602,10 +1866,16 @@ void setup()
     s3.setParams(lh, side);
     ep=&s3;
   }else if(stage==4){
-    generateStopTrialNum(stopNumArray, baseline+1, blockLength*blockNumber+baseline+1, stopNum);
+    if(scheduleLength == 0)
+      generateStopTrialNum(stopNumArray, baseline+1, blockLength*blockNumber+baseline+1, stopNum);
     s4.setParams(lh, side, len, baseline, stopNum,rdelay, stopNumArray);
     //s4.printStopArray();
     ep=&s4;
+  }else if(stage==5 && scheduleLength > 0){
+    // stop trials are streamed by the PC
+    laser.setParams(laserFreq, pulseDur, laserDur);
+    test.setParams(lh, side, len, baseline, stopNum,rdelay, blockLength, blockNumber, stopNumArray, isLaser);
+    ep=&test;
   }else if(stage==5){
     // generated random trial numbers blockwise.
     int stopNumInBlock = stopNum/blockNumber;
@@ -0,0 +1,49 @@
+'''
+Benchmark of the bootstrap engine on synthetic sessions.
+
+    python benchmarks/bench_bootstrap.py [sessions] [resamples] [processes]
+
+Defaults: 1000 sessions x 10000 resamples on all cores. Sessions have 225
+correct go trials and 75 stop trials, like a 320 trial stage 5 session.
+'''
+import sys
+import time
+import multiprocessing
+
+import numpy as np
+
+from sst.bootstrap import bootstrapSessions
+
+
+def syntheticSessions(n, seed=0):
+    rng = np.random.RandomState(seed)
+    sessions = []
+    for _ in range(n):
+        go_rt = 150 + rng.gamma(4, 50, 225)
+        ssd = rng.uniform(50, 300, 75)
+        stop_success = rng.rand(75) < 0.5
+        sessions.append((go_rt, stop_success, ssd))
+    return sessions
+
+
+def main():
+    n_sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_boot = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else multiprocessing.cpu_count()
+    sessions = syntheticSessions(n_sessions)
+
+    start = time.perf_counter()
+    bootstrapSessions(sessions[:1], n_boot, processes=1)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = bootstrapSessions(sessions, n_boot, processes=processes)
+    elapsed = time.perf_counter() - start
+    widths = np.array([r['ssrt'][2]-r['ssrt'][1] for r in results])
+    print('%d sessions x %d resamples on %d processes: %.1f s (%.3f s per session on one core)' % (
+        n_sessions, n_boot, processes, elapsed, single))
+    print('median 95%% CI width of SSRT: %.1f ms' % np.median(widths))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+'''
+Load time of reports through sst.cache against preprocess.loadData.
+
+Writes emulated stage 5 reports (as sst_gui.saveData) to a temporary
+directory, then loads every report passes times, the way a cohort script or
+a notebook re-run does: directly, through a cold in-memory cache, through a
+new cache on the disk cache of the first one (a new process), and through a
+cache too small for the cohort (LRU evictions). One report is then rewritten
+to show that it is parsed again.
+
+    python benchmarks/bench_cache.py [reports] [trials] [passes]
+'''
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import numpy as np
+
+import sst.preprocess
+from sst.preprocess import loadData
+from sst.cache import SessionCache
+from sst.Data import Data
+
+
+def quiet(*args):
+    pass
+
+
+def emulatedSession(trials, seed):
+    '''
+    Data.get() of a stage 5 session with every poke in every trial, as
+    loadData expects: left, middle, right
+    '''
+    rng = np.random.RandomState(seed)
+    data = Data()
+    tick = 0
+    for trial in range(1, trials+1):
+        stop = trial > 20 and rng.rand() < 0.25
+        data.write(('TN', trial))
+        data.write(('TT', 2 if stop else 1))
+        for code in ['IL', 'OL', 'IM', 'OM']:
+            tick += int(rng.gamma(3, 100))
+            data.write((code, tick))
+        if stop:
+            data.write(('SS', tick + 200))
+            data.write(('SD', 200))
+        tick += int(300 + rng.exponential(120))
+        data.write(('IR', tick))
+        data.write(('RS', tick if rng.rand() < 0.7 else 0))
+        tick += int(rng.gamma(5, 100))
+        data.write(('OR', tick))
+    return data.get()
+
+
+def writeReport(path, columns):
+    with open(path, 'w') as f:
+        f.write('General Message:\n')
+        f.write('trialNum: %d stage: 5 None' % len(columns['pokeInM']))
+        for name, value in columns.items():
+            f.write('\n'+name+'\n')
+            f.write(str(value))
+        f.write('\n')
+
+
+def timed(load, paths, passes):
+    start = time.perf_counter()
+    for _ in range(passes):
+        for path in paths:
+            load(path)
+    return time.perf_counter() - start
+
+
+def show(name, seconds, loads, cache=None):
+    line = '%-22s %8.2f ms per load' % (name, 1e3*seconds/loads)
+    if cache is not None:
+        stats = cache.stats()
+        mean = stats['meanMs']
+        line += '   hit rate %5.1f%%, memory %d x %.2f ms, disk %d x %.2f ms, parsed %d x %.2f ms, %d evicted' % (
+            100*stats['hitRate'], stats['hits'], mean['hit'], stats['diskHits'], mean['disk'],
+            stats['misses'], mean['miss'], stats['evictions'])
+    print(line)
+
+
+def main():
+    n_reports = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    trials = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    passes = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    sst.preprocess.print = quiet   # loadData prints the header of every report
+    work = tempfile.mkdtemp(prefix='sst_cache_')
+    try:
+        paths = []
+        for i in range(n_reports):
+            path = os.path.join(work, 'SST Report 2026-01-%02d 10-00.txt' % (i+1))
+            writeReport(path, emulatedSession(trials, i))
+            paths.append(path)
+        loads = n_reports*passes
+
+        show('loadData', timed(loadData, paths, passes), loads)
+        cache_dir = os.path.join(work, 'cache')
+        memory = SessionCache(cache_dir=cache_dir)
+        show('memory + disk (cold)', timed(memory.load, paths, passes), loads, memory)
+        disk = SessionCache(cache_dir=cache_dir)
+        show('disk cache (new proc)', timed(disk.load, paths, passes), loads, disk)
+        small = SessionCache(max_bytes=memory.bytes//2)
+        show('LRU at half the size', timed(small.load, paths, passes), loads, small)
+
+        assert memory.load(paths[0])['df'].equals(loadData(paths[0])['df'])
+        writeReport(paths[0], emulatedSession(trials + 10, 999))
+        df = memory.load(paths[0])['df']
+        assert len(df) == trials + 10 and df.equals(loadData(paths[0])['df'])
+        print('rewritten report parsed again: %d trials' % len(df))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
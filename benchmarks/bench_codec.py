@@ -0,0 +1,105 @@
+'''
+Size and speed of the session codec (sst.codec) against the text columns of
+the reports.
+
+Sessions come from an emulated board fed through Data (stage 5: baseline go
+trials, then blocks with a quarter stop trials, middle/side pokes, rewards,
+stop signals, SSDs and laser pulses) and from any reports given on the
+command line. For each, the text size of the columns is compared with int32
+ticks and with the encoded session without compression, with zlib and with
+lzma. Times are the best of 5 for encoding, decoding all columns and reading
+the columns of one block of 100 trials.
+
+    python benchmarks/bench_codec.py [report.txt ...]
+'''
+import sys
+import time
+
+import numpy as np
+
+from sst.Data import Data
+from sst.codec import encodeSession, SessionReader, readReportColumns
+
+
+def quiet(*args):
+    pass
+
+
+def emulatedSession(trials, seed):
+    rng = np.random.RandomState(seed)
+    data = Data()
+    tick = 0
+    ssd = 250
+    write = data.write
+    for trial in range(1, trials+1):
+        stop = trial > 20 and rng.rand() < 0.25
+        write(('TN', trial))
+        write(('TT', 2 if stop else 1))
+        tick += int(rng.gamma(4, 400))
+        write(('IM', tick))
+        tick += int(rng.gamma(3, 60))
+        write(('OM', tick))
+        if stop:
+            write(('SS', tick + ssd))
+            write(('SD', ssd))
+        side = 'L' if rng.rand() < 0.5 else 'R'
+        respond = not stop or rng.rand() < 0.5
+        if respond:
+            tick += int(300 + rng.exponential(120))
+            write(('I' + side, tick))
+        rewarded = respond != stop
+        write(('RS', tick if rewarded else 0))
+        if stop:
+            ssd = max(0, ssd + (51 if rewarded else -51))
+        if rng.rand() < 0.1:
+            write(('LH', tick + 10))
+        if respond:
+            tick += int(rng.gamma(5, 100))
+            write(('O' + side, tick))
+    return data.get()
+
+
+def textSize(columns):
+    return sum(len(name) + len(str(value)) + 2 for name, value in columns.items())
+
+
+def tickSize(columns):
+    return sum(4*len(value) for value in columns.values())
+
+
+def best(function, repeats=5):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure(name, columns):
+    text = textSize(columns)
+    row = [name, text, tickSize(columns)]
+    for compression in [None, 'zlib', 'lzma']:
+        raw = encodeSession(columns, compression=compression)
+        assert SessionReader(raw).get() == columns
+        row.append(len(raw))
+    raw = encodeSession(columns)
+    reader = SessionReader(raw)
+    row.append(1e3*best(lambda: encodeSession(columns)))
+    row.append(1e3*best(lambda: SessionReader(raw).get()))
+    row.append(1e3*best(lambda: reader.trials(101, 200)))
+    print('%-24s %8d %8d %8d %8d %8d %5.1fx %7.2f %7.2f %7.2f' % tuple(row[:6] + [text/row[4]] + row[6:]))
+
+
+def main():
+    print('%-24s %8s %8s %8s %8s %8s %6s %7s %7s %7s' % ('session', 'text', 'int32', 'none', 'zlib',
+                                                         'lzma', 'ratio', 'enc ms', 'dec ms', '100 tr'))
+    for trials in [320, 1000, 5000]:
+        measure('emulated %d trials' % trials, emulatedSession(trials, trials))
+    for path in sys.argv[1:]:
+        _, columns = readReportColumns(path)
+        measure(path[-24:], columns)
+
+
+if __name__ == '__main__':
+    main()
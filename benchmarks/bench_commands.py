@@ -0,0 +1,159 @@
+'''
+Round trip of parameter commands over a loopback serial device (a pty).
+
+A board emulator on the master side of the pty parses the old text
+parameter line and the binary frames of sst.sst_protocol. It answers both
+with an "AK" event, the text line once its newline arrives, so both paths
+are timed from the write to the decoded answer through SerialConnection.
+The emulator paces its input at the baud rate, and it can drop bytes at
+random. With drops, a text line is counted as misconfigured when the fields
+it parses differ from the ones sent. The binary channel retries until the
+CRC check passes.
+
+    python benchmarks/bench_commands.py [commands] [drop probability]
+'''
+import os
+import sys
+import time
+import tty
+import struct
+import threading
+
+import numpy as np
+
+from sst.SerialConnection import SerialConnection
+from sst.sst_protocol import CommandChannel, FrameDecoder, MSG_PARAMS, PARAMS_FORMAT
+
+PARAMS = {'stage': 5, 'direction': 'l', 'lh': '1536', 'sessionLength': '400', 'baseline': '20',
+          'punishment': '1024', 'blockLength': '100', 'blockNumber': '3', 'reward': '102',
+          'blinkerFreq': '2', 'isLaser': '0', 'laserFreq': '20', 'pulseDur': '10', 'laserDur': '2048'}
+BAUD = 115200
+
+
+def textLine(params, stop_num, schedule_length=0):
+    return (str(params['stage'])+','+params['direction']+','+params['lh']+','+params['sessionLength']+','
+            +params['baseline']+','+str(stop_num)+','+params['punishment']+','+params['blockLength']+','
+            +params['blockNumber']+','+params['reward']+','+params['blinkerFreq']+','+params['isLaser']+','
+            +params['laserFreq']+','+params['pulseDur']+','+params['laserDur']+','+str(schedule_length)+',\n')
+
+
+class BoardEmulator(threading.Thread):
+    def __init__(self, fd, expected_text, drop=0.0, seed=0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fd = fd
+        self.expected_text = expected_text
+        self.drop = drop
+        self.rng = np.random.RandomState(seed)
+        self.decoder = FrameDecoder()
+        self.line = bytearray()
+        self.misconfigured = 0
+        self.alive = True
+
+    def event(self, code, value):
+        os.write(self.fd, b'<' + code + struct.pack('<l', value) + b'>')
+
+    def run(self):
+        while self.alive:
+            try:
+                data = os.read(self.fd, 256)
+            except OSError:
+                return
+            time.sleep(len(data)*10.0/BAUD)   # bytes arrive at the baud rate
+            if self.drop:
+                data = bytes(b for b in data if self.rng.rand() >= self.drop)
+            if data[:1] == b'\xaa' or self.decoder.buffer:
+                for seq, kind, payload in self.decoder.feed(data):
+                    if kind is None:
+                        self.event(b'NK', seq)
+                    else:
+                        if kind == MSG_PARAMS:
+                            PARAMS_FORMAT.unpack(payload)
+                        self.event(b'AK', seq)
+                continue
+            for byte in bytearray(data):
+                self.line.append(byte)
+                if byte == 10:
+                    if self.line.decode(errors='replace') != self.expected_text:
+                        self.misconfigured += 1
+                    self.line = bytearray()
+                    self.event(b'AK', 0)
+
+
+class Reader(threading.Thread):
+    '''
+    the part of SerialMonitor that matters here
+    '''
+    def __init__(self, connection, channel):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.connection = connection
+        self.channel = channel
+        self.text_ack = threading.Event()
+        self.alive = True
+
+    def run(self):
+        while self.alive:
+            queue = self.connection.read()
+            while not queue.empty():
+                data_in = queue.get()
+                self.channel.on_event(data_in)
+                if data_in[:2] == ('AK', 0):
+                    self.text_ack.set()
+            time.sleep(0.0001)
+
+
+def run(n, drop):
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    connection = SerialConnection(os.ttyname(slave), BAUD)
+    channel = CommandChannel(connection, timeout=0.05, retries=10)
+    text = textLine(PARAMS, 75, 320)
+    board = BoardEmulator(master, text, drop)
+    reader = Reader(connection, channel)
+    board.start()
+    reader.start()
+
+    text_rtt = []
+    lost = 0
+    for _ in range(n):
+        reader.text_ack.clear()
+        start = time.perf_counter()
+        connection.write(text, append_headers=False)
+        if reader.text_ack.wait(0.5):
+            text_rtt.append(time.perf_counter() - start)
+        else:
+            lost += 1
+            connection.write('\n', append_headers=False)   # resynchronise the emulator
+            reader.text_ack.wait(0.5)
+        board.line = bytearray()
+
+    binary_rtt = []
+    for _ in range(n):
+        start = time.perf_counter()
+        if channel.sendParams(PARAMS, 75, 320):
+            binary_rtt.append(time.perf_counter() - start)
+
+    reader.alive = False
+    board.alive = False
+    connection.connection.close()
+    os.close(master)
+
+    def ms(values, q):
+        return 1000*np.percentile(values, q) if values else float('nan')
+    print('drop %.4f  text:   median %.2f ms  p99 %.2f ms  misconfigured %d/%d' % (
+        drop, ms(text_rtt, 50), ms(text_rtt, 99), board.misconfigured + lost, n))
+    print('             binary: median %.2f ms  p99 %.2f ms  failed %d/%d  retransmissions %d' % (
+        ms(binary_rtt, 50), ms(binary_rtt, 99), channel.failures, n, channel.retransmissions))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    drops = [float(sys.argv[2])] if len(sys.argv) > 2 else [0.0, 0.001, 0.01]
+    for drop in drops:
+        run(n, drop)
+
+
+if __name__ == '__main__':
+    main()
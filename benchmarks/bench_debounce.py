@@ -0,0 +1,197 @@
+'''
+Nose-poke chatter through sst.debounce: event volume, cost per event and
+downstream analysis time on replayed sessions.
+
+Emulated stage 5 sessions are replayed twice, clean and with chatter: a
+share of the poke edges come with a burst of 1 to 4 in/out pairs one tick
+apart, and some pokes with a short dropout in the middle. The chattering
+stream goes into Data directly and through PokeDebouncer (10 ms). Reported:
+events stored, debouncer time per event, and the time of the analysis of a
+session end (calRT, calCR, peri-event rasters, toDataFrame, encoding). The
+debounced columns must equal the clean ones.
+
+Reports given as arguments are replayed as well (their pokes in time
+order), to show how many edges the debouncer removes from real sessions.
+
+    python benchmarks/bench_debounce.py [sessions] [trials] [report ...]
+'''
+import sys
+import time
+
+import numpy as np
+
+import sst.sst_summary
+from sst.Data import Data
+from sst.debounce import PokeDebouncer
+from sst.sst_summary import calRT, calCR
+from sst.preprocess import toDataFrame
+from sst.psth import eventRasters
+from sst.codec import encodeSession, readReportColumns
+from sst.events import EVENT_ID, CODES
+
+DWELL_MS = 10.0
+POKES = ['pokeInL', 'pokeOutL', 'pokeInM', 'pokeOutM', 'pokeInR', 'pokeOutR']
+
+
+def quiet(*args):
+    pass
+
+
+def decoded(code, tick):
+    return (code, tick, CODES.get(code, EVENT_ID[0]))
+
+
+def session(trials, chatter=0.3, seed=0):
+    '''
+    (clean events, chattering events) of a stage 5 session, in time order
+    '''
+    rng = np.random.RandomState(seed)
+    clean = []
+    noisy = []
+    tick = 0
+    for trial in range(1, trials+1):
+        stop = trial > 20 and rng.rand() < 0.25
+        trial_events = [(tick, ('TN', trial)), (tick, ('TT', 2 if stop else 1))]
+        edges = []
+        for port in 'LMR':
+            tick += 60 + int(rng.gamma(3, 100))
+            poke_in = tick
+            tick += 40 + int(rng.gamma(3, 60))
+            edges.append(('I'+port, poke_in, 'O'+port, tick))
+        if stop:
+            trial_events.append((edges[1][3] + 200, ('SS', edges[1][3] + 200)))
+        trial_events.append((edges[2][1] + 1, ('RS', edges[2][1] + 1 if rng.rand() < 0.7 else 0)))
+        clean += trial_events
+        noisy += trial_events
+        for code_in, poke_in, code_out, poke_out in edges:
+            clean += [(poke_in, (code_in, poke_in)), (poke_out, (code_out, poke_out))]
+            noisy.append((poke_in, (code_in, poke_in)))
+            if rng.rand() < chatter:
+                for j in range(rng.randint(1, 5)):
+                    noisy += [(poke_in + 2*j + 1, (code_out, poke_in + 2*j + 1)),
+                              (poke_in + 2*j + 2, (code_in, poke_in + 2*j + 2))]
+            if rng.rand() < chatter/3:   # dropout in the middle of the poke
+                middle = (poke_in + poke_out)//2
+                noisy += [(middle, (code_out, middle)), (middle + 1, (code_in, middle + 1))]
+            noisy.append((poke_out, (code_out, poke_out)))
+            if rng.rand() < chatter:
+                for j in range(rng.randint(1, 5)):
+                    noisy += [(poke_out + 2*j + 1, (code_in, poke_out + 2*j + 1)),
+                              (poke_out + 2*j + 2, (code_out, poke_out + 2*j + 2))]
+        tick += 200
+    order = lambda item: item[0]
+    return ([decoded(*event) for _, event in sorted(clean, key=order)],
+            [decoded(*event) for _, event in sorted(noisy, key=order)])
+
+
+def replay(events, debounce):
+    data = Data()
+    write = data.write
+    debouncer = None
+    if debounce:
+        debouncer = PokeDebouncer(data.write, DWELL_MS)
+        write = debouncer.write
+    start = time.perf_counter()
+    for event in events:
+        write(event)
+    if debouncer is not None:
+        debouncer.flush()
+    return data, time.perf_counter() - start, debouncer
+
+
+def analysis(data):
+    '''
+    seconds of the analysis of a session end
+    '''
+    columns = data.get()
+    start = time.perf_counter()
+    rt = calRT(columns['pokeOutL'], columns['pokeInR'])
+    calCR(columns['trialType'], columns['isRewarded'])
+    eventRasters(columns, 'IM')
+    try:
+        toDataFrame(columns)
+    except ValueError:   # columns of unequal length (chatter)
+        pass
+    size = len(encodeSession(columns))
+    return time.perf_counter() - start, rt, size
+
+
+def storedEvents(data):
+    return sum(len(column) for name, column in data.snapshot().items() if name in POKES)
+
+
+def reportEvents(path):
+    '''
+    poke events of a report in time order, as decoded packets
+    '''
+    header, columns = readReportColumns(path)
+    events = []
+    for name in POKES:
+        code = ('I' if 'In' in name else 'O') + name[-1]
+        events += [(int(round(float(t)*1.024)), code) for t in columns.get(name, [])]
+    events.sort()
+    return [decoded(code, tick) for tick, code in events]
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    trials = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    reports = sys.argv[3:]
+    sst.sst_summary.print = quiet
+
+    totals = dict((key, 0.0) for key in ['clean', 'raw', 'stored', 'events', 'direct', 'debounced',
+                                          'analysisRaw', 'analysisDebounced', 'sizeRaw', 'sizeDebounced'])
+    wrong_rt = 0
+    for seed in range(sessions):
+        clean_events, noisy_events = session(trials, seed=seed)
+        clean, _, _ = replay(clean_events, False)
+        raw, direct, _ = replay(noisy_events, False)
+        debounced, through, debouncer = replay(noisy_events, True)
+        for name in POKES:
+            assert debounced.snapshot()[name] == clean.snapshot()[name], name
+        clean_rt = analysis(clean)[1]
+        raw_time, raw_rt, raw_size = analysis(raw)
+        debounced_time, debounced_rt, debounced_size = analysis(debounced)
+        assert np.array_equal(debounced_rt, clean_rt)
+        wrong_rt += not (len(raw_rt) == len(clean_rt) and np.array_equal(raw_rt, clean_rt))
+        totals['clean'] += storedEvents(clean)
+        totals['raw'] += storedEvents(raw)
+        totals['stored'] += storedEvents(debounced)
+        totals['events'] += len(noisy_events)
+        totals['direct'] += direct
+        totals['debounced'] += through
+        totals['analysisRaw'] += raw_time
+        totals['analysisDebounced'] += debounced_time
+        totals['sizeRaw'] += raw_size
+        totals['sizeDebounced'] += debounced_size
+
+    print('%d sessions of %d trials, dwell %.0f ms' % (sessions, trials, DWELL_MS))
+    print('poke events: clean %d, with chatter %d (%.2fx), debounced %d' % (
+        totals['clean'], totals['raw'], totals['raw']/totals['clean'], totals['stored']))
+    print('debounced columns equal the clean session in all %d sessions' % sessions)
+    print('write per event: Data %.2f us, debouncer + Data %.2f us' % (
+        1e6*totals['direct']/totals['events'], 1e6*totals['debounced']/totals['events']))
+    print('session-end analysis: %.1f ms with chatter, %.1f ms debounced' % (
+        1e3*totals['analysisRaw']/sessions, 1e3*totals['analysisDebounced']/sessions))
+    print('encoded session: %.1f kB with chatter, %.1f kB debounced' % (
+        totals['sizeRaw']/1e3/sessions, totals['sizeDebounced']/1e3/sessions))
+    print('calRT wrong with chatter in %d of %d sessions, right in all debounced ones' % (wrong_rt, sessions))
+
+    # cost per event does not depend on the session length
+    for n in [trials, 10*trials]:
+        events = session(n, seed=1)[1]
+        debouncer = PokeDebouncer(quiet, DWELL_MS)
+        start = time.perf_counter()
+        for event in events:
+            debouncer.write(event)
+        print('debouncer alone, %6d events: %.2f us per event' % (
+            len(events), 1e6*(time.perf_counter() - start)/len(events)))
+
+    for path in reports:
+        events = reportEvents(path)
+        data, _, debouncer = replay(events, True)
+        print('%s: %d poke edges, %d stored' % (path, len(events), storedEvents(data)))
+
+
+if __name__ == '__main__':
+    main()
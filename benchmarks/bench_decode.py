@@ -0,0 +1,133 @@
+'''
+Decode and store time per packet: the event ID tables against the previous
+path. The previous path decoded each code to a new str and compared it with
+up to 20 literals in Data.write. It is reproduced here as legacyDecode and
+LegacyData.
+
+Packets follow a stage 5 session (pokes, trial number/type, rewards, stop
+signals, a few laser and unknown codes). The per-event print of the previous
+Data.write is left out (Data.write now logs at DEBUG, which is off), so only
+decoding and storing are timed.
+
+    python benchmarks/bench_decode.py [packets]
+'''
+import sys
+import time
+import struct
+
+import numpy as np
+
+from sst.Data import Data
+from sst.SerialConnection import SerialConnection
+
+MIX = [('IL', 12), ('OL', 10), ('IM', 11), ('OM', 8), ('IR', 12), ('OR', 10), ('TN', 5), ('TT', 5),
+       ('RS', 6), ('SS', 2), ('SD', 1), ('TS', 1), ('GE', 1), ('SE', 1), ('L\x00', 2), ('PL', 1)]
+
+
+def legacyDecode(data_array):
+    try:
+        event = data_array[0:2].decode()
+    except UnicodeDecodeError:
+        event = 'UnicodeError'
+    timestamp = struct.unpack('<l', data_array[2:])[0]
+    return (event, timestamp)
+
+
+def quiet(*args):
+    pass
+
+
+class LegacyData(object):
+    def __init__(self):
+        self.columns = dict((name, []) for name in ['IL', 'OL', 'IM', 'OM', 'IR', 'OR', 'SS', 'RS', 'TT',
+                                                   'SD', 'TS', 'L', 'TN', 'rewarded', 'unicode'])
+        self.who_knows = []
+
+    def write(self, data_in):
+        quiet(data_in)
+        if len(data_in) == 2:
+            event = data_in[0]
+            timestamp = data_in[1]
+            c = self.columns
+            if event == 'IL':
+                c['IL'].append(timestamp/1.024)
+            elif event == 'OL':
+                c['OL'].append(timestamp/1.024)
+            elif event == 'IM':
+                c['IM'].append(timestamp/1.024)
+            elif event == 'OM':
+                c['OM'].append(timestamp/1.024)
+            elif event == 'IR':
+                c['IR'].append(timestamp/1.024)
+            elif event == 'OR':
+                c['OR'].append(timestamp/1.024)
+            elif event == 'SS':
+                c['SS'].append(timestamp/1.024)
+            elif event == 'RS':
+                c['RS'].append(timestamp/1.024)
+                c['rewarded'].append(0 if timestamp == 0 else 1)
+            elif event == 'TT':
+                c['TT'].append(int(timestamp))
+            elif event == 'SD':
+                c['SD'].append(timestamp/1.024)
+            elif event == 'TS':
+                c['TS'].append(int(timestamp))
+            elif event[0] == 'L':
+                c['L'].append(timestamp/1.024)
+            elif event[0] in 'Vv':
+                pass
+            elif event == 'UnicodeError':
+                c['unicode'].append(timestamp)
+            elif event == 'DataLengthError':
+                pass
+            elif event == 'TN':
+                c['TN'].append(timestamp)
+                if timestamp > 1:
+                    return 0
+            elif event in ('GE', 'SE', 'LE', 'S+', 'S-'):
+                pass
+            else:
+                if len(c['TN']) > 0:
+                    self.who_knows.append((c['TN'][-1], data_in))
+        return 1
+
+
+def packets(n, seed=0):
+    rng = np.random.RandomState(seed)
+    codes = [code for code, _ in MIX]
+    weights = np.array([w for _, w in MIX], dtype=float)
+    chosen = rng.choice(len(codes), n, p=weights/weights.sum())
+    times = np.cumsum(rng.randint(1, 500, n))
+    return [bytes(bytearray(codes[i].encode('latin-1'))) + struct.pack('<l', int(t))
+            for i, t in zip(chosen, times)]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    stream = [bytearray(p) for p in packets(n)]
+    connection = SerialConnection.__new__(SerialConnection)
+
+    best = {}
+    for _ in range(3):
+        legacy = LegacyData()
+        start = time.perf_counter()
+        for packet in stream:
+            legacy.write(legacyDecode(packet))
+        best['legacy'] = min(best.get('legacy', 1e9), time.perf_counter() - start)
+
+        data = Data()
+        decode = connection._process_each_data
+        start = time.perf_counter()
+        for packet in stream:
+            data.write(decode(packet))
+        best['table'] = min(best.get('table', 1e9), time.perf_counter() - start)
+
+    assert data.poke_in_l == legacy.columns['IL'] and data.laser_on == legacy.columns['L']
+    assert data.trial_num == legacy.columns['TN'] and len(data.unknown_code) == len(legacy.who_knows)
+    for name in ['legacy', 'table']:
+        print('%-7s %6.0f ns per packet' % (name, 1e9*best[name]/n))
+    print('speedup %.2fx' % (best['legacy']/best['table']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+'''
+Event log of the GUI (sst.eventlog) on a session of millions of events, and
+the cost of the per-event console output of Data.write.
+
+A free exploration session with laser pulses (the mix of stress_bounded) is
+logged through a Data listener. Reported:
+
+- time per event of EventLog.on_event, and of Data.write with the log
+  attached against without;
+- the queries of the event log panel on the whole session: all rows of a
+  trial range, the rows of some codes (whole session and a trial range),
+  and the new rows of an incremental refresh (the last second of events);
+- formatting the visible page of the table (50 rows x 5 cells), at the
+  start and the end of the session;
+- Data.write with DEBUG logging off (the default) against the print of
+  every event it replaced, to /dev/null, so only the formatting and the
+  write call are counted and not a terminal.
+
+    python benchmarks/bench_eventlog.py [events]
+'''
+import os
+import sys
+import time
+import logging
+import contextlib
+
+import numpy as np
+
+from sst.Data import Data
+from sst.eventlog import EventLog
+from sst.events import CODES, EVENT_ID
+
+RATE = 50.0     # events per second
+
+
+def session(n, seed=0):
+    '''
+    n decoded events: pokes, laser pulses and a trial every 20 s
+    '''
+    rng = np.random.RandomState(seed)
+    codes = ['IL', 'OL', 'IM', 'OM', 'IR', 'OR', 'L\x01']
+    p = np.array([1, 1, 1, 1, 1, 1, 44], dtype=float)
+    p /= p.sum()
+    chosen = rng.choice(len(codes), n, p=p)
+    ticks = np.cumsum(rng.exponential(1024/RATE, n)).astype(np.int64)
+    events = []
+    trial = 0
+    next_trial = 0
+    for c, t in zip(chosen.tolist(), ticks.tolist()):
+        if t >= next_trial:
+            trial += 1
+            next_trial += 20*1024
+            events += [('TN', trial, CODES['TN']), ('TT', 1, CODES['TT'])]
+        code = codes[c]
+        events.append((code, t, CODES.get(code, EVENT_ID[0x014c])))
+    return events[:n]
+
+
+def timed(function, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def formatRow(log, row):
+    # the cells of EventLogModel.data
+    row, trial, code, value = log.row(row)
+    return [str(row), str(trial), code, str(value), '%.1f' % (value/1.024)]
+
+
+def writeAll(data, events):
+    write = data.write
+    start = time.perf_counter()
+    for event in events:
+        write(event)
+    return time.perf_counter() - start
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    events = session(n)
+    log = EventLog()
+    start = time.perf_counter()
+    for event in events:
+        log.on_event(event)
+    append = time.perf_counter() - start
+    print('%d events, %d trials' % (len(log), log.trial))
+    print('EventLog.on_event: %.2f us per event' % (1e6*append/len(events)))
+
+    plain = Data()
+    bare = writeAll(plain, events)
+    plain.clear_temp()
+    logged = Data()
+    logged.listeners.append(EventLog().on_event)
+    with_log = writeAll(logged, events)
+    logged.clear_temp()
+    print('Data.write: %.2f us per event, %.2f us with the event log attached' % (
+        1e6*bare/len(events), 1e6*with_log/len(events)))
+
+    trials = log.trial
+    middle = (trials//2, trials//2 + 10)
+    queries = [('all rows', lambda: log.select()),
+               ('trials %d-%d' % middle, lambda: log.select(trials=middle)),
+               ('codes IL IR (session)', lambda: log.select(['IL', 'IR'])),
+               ('codes IL IR, trials %d-%d' % middle, lambda: log.select(['IL', 'IR'], middle)),
+               ('code TN (session)', lambda: log.select(['TN'])),
+               ('refresh, last %d events' % RATE, lambda: log.select(start=len(log) - int(RATE))),
+               ('refresh IL IR, last %d events' % RATE,
+                lambda: log.select(['IL', 'IR'], start=len(log) - int(RATE)))]
+    print('%-34s %10s %10s' % ('query', 'rows', 'ms'))
+    for name, query in queries:
+        seconds, rows = timed(query)
+        print('%-34s %10d %10.3f' % (name, len(rows), 1e3*seconds))
+
+    for name, first in [('first', 0), ('last', len(log) - 50)]:
+        seconds, _ = timed(lambda: [formatRow(log, row) for row in range(first, first + 50)])
+        print('format the %s page (50 rows): %.3f ms' % (name, 1e3*seconds))
+
+    # Data.write with DEBUG logging off, against print() of every event
+    logging.getLogger('sst.Data').setLevel(logging.WARNING)
+    sample = events[:200000]
+    quiet = Data()
+    off = writeAll(quiet, sample)
+    quiet.clear_temp()
+    printing = Data()
+    printing.listeners.append(print)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        printed = writeAll(printing, sample)
+    printing.clear_temp()
+    print('Data.write, logging off: %.2f us per event; with a print per event (to /dev/null): %.2f us' % (
+        1e6*off/len(sample), 1e6*printed/len(sample)))
+
+
+if __name__ == '__main__':
+    main()
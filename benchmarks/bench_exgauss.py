@@ -0,0 +1,47 @@
+'''
+Benchmark of the batched ex-Gaussian fits, in sessions fitted per second.
+
+    python benchmarks/bench_exgauss.py [sessions]
+'''
+import sys
+import time
+
+import numpy as np
+
+from sst.exgauss import fitExGaussian, fitSessions
+
+
+def syntheticSessions(n, seed=0):
+    rng = np.random.RandomState(seed)
+    sessions = []
+    for _ in range(n):
+        n_go = rng.randint(150, 260)
+        go_rt = rng.normal(300, 40, n_go) + rng.exponential(100, n_go)
+        ssd = rng.uniform(50, 300, 75)
+        # constant 200 ms stop process racing the go process
+        race = rng.normal(300, 40, 75) + rng.exponential(100, 75)
+        responded = race < ssd + 200
+        sessions.append((go_rt, race[responded], ssd, responded.mean()))
+    return sessions
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    sessions = syntheticSessions(n)
+    print('%8s %10s %12s' % ('batch', 'seconds', 'sessions/s'))
+    for batch in [1, 10, 100, 1000, n]:
+        batch = min(batch, n)
+        start = time.perf_counter()
+        for i in range(0, n, batch):
+            fitExGaussian([s[0] for s in sessions[i:i+batch]])
+        elapsed = time.perf_counter() - start
+        print('%8d %10.2f %12.0f' % (batch, elapsed, n/elapsed))
+    start = time.perf_counter()
+    result = fitSessions(sessions)
+    elapsed = time.perf_counter() - start
+    print('go + signal-respond fits and race SSRT: %.0f sessions/s, median SSRT %.1f ms (true 200)' % (
+        n/elapsed, np.nanmedian(result['ssrt'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''
+Throughput of the video path stage by stage, without a camera: capture
+(FrameSource.read into a preallocated buffer), overlay and encode
+(AdaptiveEncoder at its best level), pack and send over a loopback socket
+drained by a reader thread.
+
+Sources are SyntheticSource and FileSource over a directory of JPEGs written
+from it, both unpaced (fps None), so the numbers are the capacity of one
+core. Reproducible on a headless Linux box.
+
+    python benchmarks/bench_frame_pipeline.py [frames]
+'''
+import os
+import sys
+import time
+import socket
+import shutil
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+from sst.sst_server import SyntheticSource, FileSource, AdaptiveEncoder
+
+
+def drain(sock, total):
+    while True:
+        chunk = sock.recv(1 << 16)
+        if not chunk:
+            break
+        total[0] += len(chunk)
+
+
+def overlay(frame):
+    cv2.putText(frame, 'Trial Finished: 123', (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                (255, 255, 255), 1, cv2.LINE_AA)
+    cv2.putText(frame, 'Time Elapsed: 12 min', (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                (255, 255, 255), 1, cv2.LINE_AA)
+
+
+def pipeline(source, frames):
+    sender, receiver = socket.socketpair()
+    received = [0]
+    reader = threading.Thread(target=drain, args=(receiver, received))
+    reader.start()
+    encoder = AdaptiveEncoder(level=0, adaptive=False)
+    buffer = source.read()
+    times = np.zeros(3)
+    sent = 0
+    start = time.perf_counter()
+    for trial in range(frames):
+        t0 = time.perf_counter()
+        frame = source.read(buffer)
+        t1 = time.perf_counter()
+        r, jpg = encoder.encode(frame, overlay)
+        t2 = time.perf_counter()
+        packet = encoder.pack(jpg, trial)
+        sender.sendall(packet)
+        sent += len(packet)
+        t3 = time.perf_counter()
+        times += [t1-t0, t2-t1, t3-t2]
+        reused = frame is buffer
+    elapsed = time.perf_counter() - start
+    sender.close()
+    reader.join()
+    receiver.close()
+    assert received[0] == sent
+    return frames/elapsed, 1e3*times/frames, sent/frames, reused
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    work = tempfile.mkdtemp(prefix='sst_frames_')
+    try:
+        synthetic = SyntheticSource(fps=None)
+        for i in range(100):
+            cv2.imwrite(os.path.join(work, '%04d.jpg' % i), synthetic.read())
+        sources = [('synthetic 640x480', SyntheticSource(fps=None)),
+                   ('image directory', FileSource(work, fps=None))]
+        print('%-20s %8s %10s %10s %10s %9s %7s' % ('source', 'fps', 'capture', 'encode', 'send',
+                                                    'bytes', 'reused'))
+        for name, source in sources:
+            fps, (capture, encode, send), size, reused = pipeline(source, frames)
+            print('%-20s %8.0f %7.2f ms %7.2f ms %7.2f ms %9.0f %7s' % (name, fps, capture, encode,
+                                                                         send, size, reused))
+        paced = SyntheticSource(fps=30)
+        buffer = paced.read()
+        start = time.perf_counter()
+        for _ in range(30):
+            paced.read(buffer)
+        print('synthetic at fps=30: %.1f frames/s' % (30/(time.perf_counter() - start)))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+'''
+Mosaic service with 16 synthetic rigs on loopback.
+
+Every rig replays JPEGs of a SyntheticSource (480 px, as MyTCPHandler sends
+them) at 15 fps; the mosaic subscribes to all of them and serves one
+supervisor, which decodes every composite. Reported: composites per
+second and compose time, tiles redrawn per composite, and the decode time of
+the supervisor against decoding all rig streams itself.
+
+A second, offline part times Mosaic.update with 1, 4 and all 16 rigs
+changed against redrawing every tile.
+
+    python benchmarks/bench_mosaic.py [rigs] [seconds]
+'''
+import sys
+import time
+import socket
+import struct
+import pickle
+import threading
+
+import cv2
+
+from sst.sst_server import SyntheticSource, AdaptiveEncoder
+from sst.sst_mosaic import RigFeed, Mosaic, MosaicServer, recvExact
+
+
+class ReplayRig(threading.Thread):
+    '''
+    a rig's video server replaying JPEGs of a SyntheticSource at fps, in
+    the packet format of MyTCPHandler; encoded beforehand so that 16 rigs fit
+    next to the mosaic on one core
+    '''
+    def __init__(self, seed, fps=15, frames=30):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        source = SyntheticSource(fps=None, seed=seed)
+        encoder = AdaptiveEncoder(level=1, adaptive=False)
+        self.packets = [bytes(encoder.pack(encoder.encode(source.read())[1], seed)) for _ in range(frames)]
+        self.fps = fps
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.alive = True
+
+    def run(self):
+        sock, _ = self.listener.accept()
+        next_time = time.time()
+        i = 0
+        try:
+            while self.alive:
+                sock.sendall(self.packets[i % len(self.packets)])
+                i += 1
+                next_time += 1.0/self.fps
+                time.sleep(max(0.0, next_time - time.time()))
+        except OSError:
+            pass
+        sock.close()
+
+
+def supervisor(port, seconds, result):
+    header = struct.Struct('I')
+    decode = 0.0
+    frames = 0
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        start = time.time()
+        while time.time() - start < seconds:
+            jpg = pickle.loads(recvExact(sock, header.unpack(recvExact(sock, header.size))[0]))
+            pickle.loads(recvExact(sock, header.unpack(recvExact(sock, header.size))[0]))
+            t = time.perf_counter()
+            image = cv2.imdecode(jpg, cv2.IMREAD_COLOR)
+            decode += time.perf_counter() - t
+            frames += 1
+    result.update({'frames': frames, 'decode': decode, 'shape': image.shape, 'fps': frames/seconds})
+
+
+class StillFeed(object):
+    '''
+    feed of fixed JPEGs for the offline part
+    '''
+    def __init__(self, name, jpg):
+        self.name = name
+        self.jpg = jpg
+        self.version = 1
+
+    def latest(self):
+        return self.version, self.jpg, 1, time.time()
+
+
+def offline(n_rigs):
+    encoder = AdaptiveEncoder(level=0, adaptive=False)
+    jpgs = [encoder.encode(SyntheticSource(fps=None, seed=i).read())[1] for i in range(n_rigs)]
+    feeds = [StillFeed('rig%02d' % i, jpg) for i, jpg in enumerate(jpgs)]
+    mosaic = Mosaic(feeds)
+    mosaic.update()
+    print('offline Mosaic.update, %d tiles of 320x240 from 640 px JPEGs:' % n_rigs)
+    for changed in [1, 4, n_rigs]:
+        start = time.perf_counter()
+        for _ in range(20):
+            for feed in feeds[:changed]:
+                feed.version += 1
+            mosaic.update()
+        print('  %2d changed: %6.2f ms' % (changed, 1e3*(time.perf_counter() - start)/20))
+    start = time.perf_counter()
+    for _ in range(20):
+        mosaic.update(force=True)
+    print('  redraw all: %6.2f ms' % (1e3*(time.perf_counter() - start)/20))
+    start = time.perf_counter()
+    for _ in range(20):
+        for jpg in jpgs:
+            cv2.imdecode(jpg, cv2.IMREAD_COLOR)
+    return (time.perf_counter() - start)/20/n_rigs
+
+
+def main():
+    n_rigs = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    full_decode = offline(n_rigs)
+
+    rigs = [ReplayRig(i) for i in range(n_rigs)]
+    for rig in rigs:
+        rig.start()
+    feeds = [RigFeed('rig%02d' % i, '127.0.0.1', rig.port) for i, rig in enumerate(rigs)]
+    mosaic = MosaicServer(feeds, ('127.0.0.1', 0), fps=10)
+    mosaic.start()
+    time.sleep(2.0)   # connect and warm up
+    versions = [feed.version for feed in feeds]
+    composites, tiles, compose = mosaic.composites, mosaic.mosaic.tiles_updated, mosaic.compose_time
+    result = {}
+    supervisor(mosaic.server_address[1], seconds, result)
+    composites = mosaic.composites - composites
+    tiles = mosaic.mosaic.tiles_updated - tiles
+    compose = mosaic.compose_time - compose
+    rig_frames = sum(feed.version for feed in feeds) - sum(versions)
+    mosaic.stop()
+    for rig in rigs:
+        rig.alive = False
+
+    print()
+    print('%d rigs streaming %.1f frames/s in total to the mosaic' % (n_rigs, rig_frames/seconds))
+    print('mosaic: %.1f composites/s, %.1f ms compose+encode, %.1f of %d tiles redrawn per composite' % (
+        composites/seconds, 1e3*compose/max(composites, 1), tiles/float(max(composites, 1)), n_rigs))
+    print('supervisor: one stream of %dx%d at %.1f frames/s, decode %.1f ms per frame = %.1f ms/s' % (
+        result['shape'][1], result['shape'][0], result['fps'], 1e3*result['decode']/result['frames'],
+        1e3*result['decode']/seconds))
+    print('without the mosaic: %d streams, decode %.1f ms per frame = %.1f ms/s' % (
+        n_rigs, 1e3*full_decode, 1e3*full_decode*rig_frames/seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+Benchmark of the ROI motion detector on one core.
+
+    python benchmarks/bench_motion.py [clip]
+
+clip can be any video OpenCV reads or a recording of sst-gui --record (the
+.mjpeg with its .idx). Without a clip a synthetic one is generated: a dark
+blob moving between the port regions over a noisy background. Frames are
+decoded up front so only the detector is timed.
+'''
+import os
+import sys
+import time
+
+import numpy as np
+import cv2
+
+from sst.sst_motion import MotionDetector
+from sst.sst_recorder import RecordingIndex, INDEX_SUFFIX
+
+
+def syntheticClip(frames=600, width=640, height=480):
+    rng = np.random.RandomState(0)
+    background = rng.randint(90, 110, (height, width, 3)).astype(np.uint8)
+    clip = []
+    for i in range(frames):
+        frame = background.copy()
+        # blob walks left to right and back, rearing every 200 frames
+        x = int((width-80) * abs((i % 60) - 30) / 30.0)
+        y = int(height*0.6) if i % 200 > 40 else int(height*0.1)
+        cv2.circle(frame, (x+40, y+40), 40, (20, 20, 20), -1)
+        clip.append(frame)
+    return clip
+
+
+def loadClip(path, limit=2000):
+    if os.path.exists(path + INDEX_SUFFIX):
+        index = RecordingIndex(path)
+        rows = np.flatnonzero(index.length > 0)[:limit]
+        return [index.decode(index.read_frame(row)) for row in rows]
+    capture = cv2.VideoCapture(path)
+    clip = []
+    while len(clip) < limit:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        clip.append(frame)
+    return clip
+
+
+def main():
+    cv2.setNumThreads(1)
+    if len(sys.argv) > 1:
+        clip = loadClip(sys.argv[1])
+    else:
+        clip = syntheticClip()
+    print('%d frames of %dx%d' % (len(clip), clip[0].shape[1], clip[0].shape[0]))
+    print('%6s %10s %12s %8s' % ('scale', 'fps', 'ms/frame', 'events'))
+    for scale in [1, 2, 4, 8]:
+        events = []
+        # a budget this large never changes the scale
+        detector = MotionDetector(events.append, scale=scale, budget=1.0)
+        detector.setClock(0)
+        start = time.perf_counter()
+        for i, frame in enumerate(clip):
+            detector.on_frame(i, i/30.0, frame)
+        elapsed = time.perf_counter() - start
+        print('%6d %10.0f %12.3f %8d' % (scale, len(clip)/elapsed, 1000*elapsed/len(clip), len(events)))
+
+    # with the default per-frame budget
+    events = []
+    detector = MotionDetector(events.append)
+    detector.setClock(0)
+    start = time.perf_counter()
+    for i, frame in enumerate(clip):
+        detector.on_frame(i, i/30.0, frame)
+    elapsed = time.perf_counter() - start
+    print('budget %.1f ms: %.0f fps, final scale %d, %d events' % (
+        1000*detector.budget, len(clip)/elapsed, detector.scale, len(events)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+'''
+Learning curves and stage criteria (sst.progress) over simulated years of
+training: cost of adding one session against the length of the history.
+
+Every animal trains once a day. Its reports are written in the GUI format
+with a trial rate that grows with training, and the simulated trainer acts
+on the criteria like the lab would: stage 2 until two days of 100 trials in
+30 min, then stage 3 with an LH of 30 s shortened by 0.6x whenever the
+shorten-lh criterion is met, and stage 4 once it is met at 5 s. Each report
+is indexed with SessionArchive.addReport as the collector does. Reported:
+
+- time of addReport (header, fold) at history lengths, and of reading
+  the report's columns, as it still does for reports without the
+  minutes and trials30min header items;
+- the same summary computed by hand from the animal's reports (reading all
+  of them), as before;
+- that the state folded day by day equals a rebuild from the stored curve;
+- the days each animal needed per stage.
+
+    python benchmarks/bench_progress.py [animals] [days]
+'''
+import os
+import sys
+import time
+import shutil
+import datetime
+import tempfile
+
+import numpy as np
+
+from sst.sst_archive import SessionArchive
+from sst.codec import readReportColumns
+from sst.progress import sessionMetrics, columnMetrics
+
+
+def writeReport(path, stage, lh, trials_per_min, minutes, rng):
+    '''
+    report of one session; lh in ms
+    '''
+    gaps = rng.exponential(60000.0/trials_per_min, int(trials_per_min*minutes*1.5) + 1)
+    starts = np.cumsum(gaps)
+    starts = starts[starts < minutes*60000.0]
+    go = min(0.95, 0.4 + trials_per_min/10.0)
+    columns = [('pokeInL', (starts + 800).round(1).tolist()), ('pokeOutL', (starts + 1000).round(1).tolist()),
+               ('pokeInR', (starts - 500).round(1).tolist()), ('pokeOutR', (starts - 300).round(1).tolist()),
+               ('pokeInM', starts.round(1).tolist()), ('pokeOutM', (starts + 200).round(1).tolist()),
+               ('trialType', [1]*len(starts)), ('isRewarded', (rng.rand(len(starts)) < go).astype(int).tolist())]
+    metrics = columnMetrics(dict(columns))     # as saveData writes them
+    header = 'trialNum: %d stage: %d direction: l lh: %d sessionLength: 320 baseline: 20 goCorrect: %.2f ' \
+             'stopCorrect: 0.0 minutes: %.2f trials30min: %d None' % (
+                 len(starts), stage, lh, go, metrics['minutes'], metrics['trials_30min'])
+    with open(path, 'w') as f:
+        f.write('General Message:\n' + header)
+        for name, values in columns:
+            f.write('\n' + name + '\n' + str(values))
+        f.write('\n')
+
+
+def byHand(paths):
+    '''
+    what the trainer computed from the reports: trials in 30 min of every
+    session and the rate of the last 5
+    '''
+    rows = []
+    for path in paths:
+        header, columns = readReportColumns(path)
+        starts = np.asarray(columns['pokeInM'])
+        rows.append((len(starts)/max(starts.max()/60000.0, 1e-9), np.count_nonzero(starts <= 30*60000.0)))
+    return np.mean([rate for rate, _ in rows[-5:]])
+
+
+def main():
+    animals = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    work = tempfile.mkdtemp(prefix='sst_progress_')
+    marks = sorted(set([1, 10, 100, days//2, days]))
+    fold_times = dict((mark, []) for mark in marks)
+    hand_times = dict((mark, []) for mark in marks)
+    read_times = dict((mark, []) for mark in marks)
+    stage_days = []
+    try:
+        archive = SessionArchive(os.path.join(work, 'sst_archive.db'))
+        start_day = datetime.datetime(2015, 1, 5, 10, 0)
+        for animal in range(animals):
+            rng = np.random.RandomState(animal)
+            directory = os.path.join(work, 'rat%02d' % animal)
+            os.makedirs(directory)
+            stage, lh = 2, 30000
+            skill = 1.0 + rng.rand()
+            reached = {2: 1}
+            paths = []
+            for day in range(1, days + 1):
+                date = start_day + datetime.timedelta(days=day - 1, minutes=int(rng.randint(0, 120)))
+                path = os.path.join(directory, 'SST Report %s.txt' % date.strftime('%Y-%m-%d %H-%M'))
+                skill = min(skill + 0.25*rng.rand(), 6.0)   # trials per minute
+                rate = max(0.5, skill*(1.0 - 0.5*(stage == 3)*(30000 - lh)/30000.0) + rng.normal(0, 0.4))
+                writeReport(path, stage, lh, rate, 45, rng)
+                paths.append(path)
+                start = time.perf_counter()
+                flags = archive.addReport(path)
+                elapsed = time.perf_counter() - start
+                if day in fold_times:
+                    fold_times[day].append(elapsed)
+                    start = time.perf_counter()
+                    sessionMetrics(path)
+                    read_times[day].append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    byHand(paths)
+                    hand_times[day].append(time.perf_counter() - start)
+                # the trainer follows the criteria
+                if 'stage2-done' in flags:
+                    stage = 3
+                    reached[3] = day + 1
+                elif 'shorten-lh' in flags:
+                    lh = max(5000, int(lh*0.6))
+                elif 'stage3-done' in flags:
+                    stage = 4
+                    reached[4] = day + 1
+            stage_days.append(reached)
+
+            folded = archive.progress.state('rat%02d' % animal)
+            curve = archive.progress.curve('rat%02d' % animal)
+            with archive.connection:
+                rebuilt = archive.progress.rebuild('rat%02d' % animal)
+            assert folded == rebuilt, 'rat%02d' % animal
+            assert curve == archive.progress.curve('rat%02d' % animal)
+        flagged = archive.progress.flagged()
+        archive.close()
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    print('%d animals, %d daily sessions each' % (animals, days))
+    print('%8s %14s %18s %24s' % ('session', 'addReport ms', 'full read ms', 'by hand from reports ms'))
+    for mark in marks:
+        print('%8d %14.2f %18.2f %24.1f' % (mark, 1e3*np.median(fold_times[mark]), 1e3*np.median(read_times[mark]),
+                                            1e3*np.median(hand_times[mark])))
+    print('folded state equals a rebuild from the curve for every animal')
+    for animal, reached in enumerate(stage_days):
+        print('rat%02d: stage 3 on day %s, stage 4 on day %s' % (animal, reached.get(3, '-'), reached.get(4, '-')))
+    print('criteria met at the last session: %d' % len(flagged))
+
+
+if __name__ == '__main__':
+    main()
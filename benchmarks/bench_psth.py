@@ -0,0 +1,102 @@
+'''
+Peri-event rasters over long sessions: sst.psth against a loop over trials,
+and drawing one LineCollection against one vlines call per trial.
+
+A session of n trials (every poke, a quarter stop trials, rewards and laser
+pulses) is aligned to the stop signal and to the middle poke, for all event
+codes. The loop reference (boolean mask per trial) runs on the first 2000
+alignments and is scaled up; its rasters must equal those of periEvent.
+
+    python benchmarks/bench_psth.py [trials]
+'''
+import sys
+import time
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from sst.psth import CODE_COLUMNS, eventRasters, alignTimes, plotRaster
+
+WINDOW = (-1000.0, 2000.0)
+
+
+def session(trials, seed=0):
+    rng = np.random.RandomState(seed)
+    data = dict((column, []) for column in CODE_COLUMNS.values())
+    gaps = rng.gamma(3, 100, (trials, 6))
+    start = np.cumsum(gaps.sum(axis=1) + 1000) - gaps.sum(axis=1)   # trial k starts after trial k-1
+    stop = rng.rand(trials) < 0.25
+    for column, k in [('pokeInL', 0), ('pokeOutL', 1), ('pokeInM', 2), ('pokeOutM', 3),
+                      ('pokeInR', 4), ('pokeOutR', 5)]:
+        data[column] = (start + gaps[:, :k+1].sum(axis=1))/1.024
+    data['stopSignalStart'] = data['pokeOutM'][stop] + 200/1.024
+    data['rewardStart'] = data['pokeInR'].copy()
+    data['isRewarded'] = (rng.rand(trials) < 0.7).astype(int)
+    data['rewardStart'][data['isRewarded'] == 0] = 0
+    data['laserOn'] = data['pokeInM'][rng.rand(trials) < 0.1]
+    return data
+
+
+def loopRasters(data, align, codes, limit):
+    align_times = alignTimes(data, align)[:limit]
+    result = {}
+    for code in codes:
+        events = alignTimes(data, code)
+        rows = []
+        for t in align_times:
+            inside = events[(events >= t + WINDOW[0]) & (events <= t + WINDOW[1])]
+            rows.append(inside - t)
+        result[code] = rows
+    return result
+
+
+def drawTime(draw):
+    fig = Figure(figsize=(6, 4), dpi=70)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    start = time.perf_counter()
+    draw(ax)
+    canvas.draw()
+    return time.perf_counter() - start
+
+
+def main():
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    data = session(trials)
+    codes = sorted(CODE_COLUMNS)
+    limit = 2000
+    for align in ['SS', 'IM']:
+        n_align = len(alignTimes(data, align))
+        start = time.perf_counter()
+        rasters = eventRasters(data, align, codes, WINDOW)
+        fast = time.perf_counter() - start
+        start = time.perf_counter()
+        reference = loopRasters(data, align, codes, limit)
+        loop = (time.perf_counter() - start)*n_align/min(limit, n_align)
+        for code in codes:
+            for i, row in enumerate(reference[code]):
+                assert np.array_equal(rasters[code][i], row)
+        events = sum(len(raster.times) for raster in rasters.values())
+        print('align %s: %d trials x %d codes, %d events: searchsorted %.1f ms, loop %.0f ms (%.0fx)' % (
+            align, n_align, len(codes), events, 1e3*fast, 1e3*loop, loop/fast))
+
+    raster = eventRasters(data, 'IM', ['IR'], WINDOW)['IR']
+    shown = 2000
+    small = type(raster)(raster.times[:raster.offsets[shown]], raster.offsets[:shown+1],
+                         raster.align[:shown], WINDOW)
+    collection = drawTime(lambda ax: plotRaster(ax, small))
+
+    def perTrial(ax):
+        for i in range(len(small)):
+            ax.vlines(small[i], i - 0.4, i + 0.4, color='k', linewidth=0.8)
+
+    loop = drawTime(perTrial)
+    print('draw %d trials: LineCollection %.0f ms, vlines per trial %.0f ms (%.0fx)' % (
+        shown, 1e3*collection, 1e3*loop, loop/collection))
+
+
+if __name__ == '__main__':
+    main()
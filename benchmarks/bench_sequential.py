@@ -0,0 +1,166 @@
+'''
+Batched sequential effects and inhibition function fits (sst.sequential)
+against a loop over the trials of every session, on synthetic sessions with
+known effects.
+
+Sessions have 300 trials, 25 % stop trials with SSDs from a staircase, go
+RTs slowed by 40 ms after a successful stop and 20 ms after a failed stop,
+and P(respond | SSD) logistic with a known SSD50. Reported: time of the
+vectorized functions and of the loops (the loop reference is pandas-free
+Python over trials, with scipy.optimize.minimize per session for the
+logistic fit), the largest differences between both, and the recovered
+effects.
+
+    python benchmarks/bench_sequential.py [sessions]
+'''
+import sys
+import time
+
+import numpy as np
+from scipy.optimize import minimize
+
+from sst.sequential import (sequentialEffects, inhibitionFunction, fitInhibition, outcomes,
+                            GO_CORRECT, GO_ERROR, STOP_SUCCESS, STOP_FAILURE)
+
+SLOWING = {STOP_SUCCESS: 40.0, STOP_FAILURE: 20.0}
+
+
+def syntheticSessions(n, trials=300, seed=0):
+    '''
+    (rt, trial_type, is_rewarded, ssd) arrays and the true SSD50 of every session
+    '''
+    rng = np.random.RandomState(seed)
+    rt = np.full((n, trials), np.nan)
+    trial_type = np.ones((n, trials), dtype=np.int64)
+    is_rewarded = np.zeros((n, trials), dtype=np.int64)
+    ssd = np.zeros((n, trials))
+    ssd50 = rng.uniform(150, 300, n)
+    slope = rng.uniform(0.01, 0.03, n)
+    for s in range(n):
+        length = trials - rng.randint(0, 30)     # sessions of different lengths
+        delay = 200.0
+        previous = GO_CORRECT
+        for t in range(length):
+            if rng.rand() < 0.25:
+                trial_type[s, t] = 2
+                ssd[s, t] = delay
+                respond = rng.rand() < 1/(1 + np.exp(-slope[s]*(delay - ssd50[s])))
+                is_rewarded[s, t] = 0 if respond else 1
+                rt[s, t] = 350 + rng.normal(0, 40) if respond else np.nan
+                delay = max(0.0, delay + (-50 if respond else 50))
+                previous = STOP_FAILURE if respond else STOP_SUCCESS
+            else:
+                correct = rng.rand() < 0.85
+                is_rewarded[s, t] = int(correct)
+                rt[s, t] = 300 + SLOWING.get(previous, 0.0) + rng.normal(0, 40) + rng.exponential(60) \
+                    if correct else np.nan
+                previous = GO_CORRECT if correct else GO_ERROR
+        trial_type[s, length:] = 0
+    return rt, trial_type, is_rewarded, ssd, ssd50
+
+
+def loopEffects(rt, trial_type, is_rewarded):
+    '''
+    mean and median RT of correct go trials, go and stop accuracy, by the
+    outcome of the trial before, trial by trial
+    '''
+    shape = (len(rt), 4)
+    mean_rt, median_rt = np.full(shape, np.nan), np.full(shape, np.nan)
+    go_accuracy, stop_accuracy = np.full(shape, np.nan), np.full(shape, np.nan)
+    for s in range(len(rt)):
+        rts = [[] for _ in range(4)]
+        go = [[0, 0] for _ in range(4)]
+        stop = [[0, 0] for _ in range(4)]
+        for t in range(1, rt.shape[1]):
+            if trial_type[s, t] == 0 or trial_type[s, t-1] == 0:
+                continue
+            before = (0 if is_rewarded[s, t-1] else 1) + (2 if trial_type[s, t-1] == 2 else 0)
+            if trial_type[s, t] == 1:
+                go[before][0] += is_rewarded[s, t]
+                go[before][1] += 1
+                if is_rewarded[s, t] == 1:
+                    rts[before].append(rt[s, t])
+            else:
+                stop[before][0] += is_rewarded[s, t]
+                stop[before][1] += 1
+        for k in range(4):
+            if rts[k]:
+                mean_rt[s, k] = sum(rts[k])/len(rts[k])
+                median_rt[s, k] = np.median(rts[k])
+            if go[k][1]:
+                go_accuracy[s, k] = go[k][0]/float(go[k][1])
+            if stop[k][1]:
+                stop_accuracy[s, k] = stop[k][0]/float(stop[k][1])
+    return mean_rt, median_rt, go_accuracy, stop_accuracy
+
+
+def loopFits(trial_type, is_rewarded, ssd):
+    '''
+    logistic fit of every session with scipy.optimize
+    '''
+    fits = []
+    for s in range(len(ssd)):
+        stop = trial_type[s] == 2
+        x = ssd[s, stop]/100.0
+        y = (is_rewarded[s, stop] == 0).astype(float)
+
+        def loss(theta):
+            eta = theta[0] + theta[1]*x
+            return np.sum(y*np.logaddexp(0, -eta) + (1-y)*np.logaddexp(0, eta)) + 0.5e-3*np.dot(theta, theta)
+        theta = minimize(loss, np.zeros(2), method='BFGS', options={'gtol': 1e-8}).x
+        fits.append((theta[0], theta[1]/100.0))
+    return np.array(fits)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rt, trial_type, is_rewarded, ssd, ssd50 = syntheticSessions(n)
+    print('%d sessions, %d trials' % (n, np.count_nonzero(trial_type)))
+
+    start = time.perf_counter()
+    effects = sequentialEffects(rt, trial_type, is_rewarded)
+    vector_effects = time.perf_counter() - start
+    start = time.perf_counter()
+    centers, counts, p_respond = inhibitionFunction(trial_type, is_rewarded, ssd)
+    vector_function = time.perf_counter() - start
+    start = time.perf_counter()
+    fit = fitInhibition(trial_type, is_rewarded, ssd)
+    vector_fit = time.perf_counter() - start
+
+    subset = min(n, 200)    # the loops are slow; timed on a subset and scaled
+    start = time.perf_counter()
+    loop = loopEffects(rt[:subset], trial_type[:subset], is_rewarded[:subset])
+    loop_effects = (time.perf_counter() - start)*n/subset
+    start = time.perf_counter()
+    loop_fit = loopFits(trial_type[:subset], is_rewarded[:subset], ssd[:subset])
+    loop_fit_time = (time.perf_counter() - start)*n/subset
+
+    print('%-28s %12s %12s %8s' % ('', 'vectorized s', 'loop s', 'speedup'))
+    print('%-28s %12.3f %12.2f %8.0f' % ('sequential effects', vector_effects, loop_effects,
+                                         loop_effects/vector_effects))
+    print('%-28s %12.3f %12s' % ('inhibition function', vector_function, '-'))
+    print('%-28s %12.3f %12.2f %8.0f' % ('logistic fits', vector_fit, loop_fit_time, loop_fit_time/vector_fit))
+    for name, reference in zip(['rt', 'rtMedian', 'goAccuracy', 'stopAccuracy'], loop):
+        assert np.array_equal(np.isnan(effects[name][:subset]), np.isnan(reference)), name
+        assert np.nanmax(np.abs(effects[name][:subset] - reference)) < 1e-9, name
+    print('largest difference: mean RT %.2e ms, intercept %.2e, slope %.2e per ms' % (
+        np.nanmax(np.abs(effects['rt'][:subset] - loop[0])),
+        np.max(np.abs(fit['intercept'][:subset] - loop_fit[:, 0])),
+        np.max(np.abs(fit['slope'][:subset] - loop_fit[:, 1]))))
+    print('fits converged: %d of %d in %d iterations' % (fit['converged'].sum(), n, fit['iterations']))
+
+    print('post-stop slowing %.1f ms (true 40), after a failed stop %.1f ms (true 20), '
+          'after a go error %.1f ms (true 0)' % (np.nanmean(effects['postStopSlowing']),
+                                                 np.nanmean(effects['postFailedStopSlowing']),
+                                                 np.nanmean(effects['postErrorSlowing'])))
+    print('go accuracy after go/error/stop success/stop failure: %s' % ' '.join(
+        '%.3f' % value for value in np.nanmean(effects['goAccuracy'], axis=0)))
+    print('SSD50: median error %.1f ms' % np.nanmedian(np.abs(fit['ssd50'] - ssd50)))
+    pooled = np.nansum(p_respond*counts, axis=0)/np.maximum(counts.sum(axis=0), 1)
+    print('pooled P(respond | SSD): %s' % ' '.join('%d:%.2f' % (c, p) for c, p, k in
+                                                  zip(centers, pooled, counts.sum(axis=0)) if k > 100))
+    assert np.array_equal(outcomes(trial_type, is_rewarded) >= 0, trial_type > 0)
+
+
+if __name__ == '__main__':
+    main()
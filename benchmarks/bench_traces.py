@@ -0,0 +1,150 @@
+'''
+Per-trial cost of the performance traces of the GUI (sst.traces) over a
+session of 10,000 trials, against redrawing the full series every trial.
+
+A stage 5 session grows one trial at a time in a dict of columns as
+Data.get() returns them. After every trial the incremental path folds the
+new trial (SessionTraces.update), sets the downsampled lines
+(TracePlot.update) and draws the figure; the full path clears the axes and
+plots the rolling series of all trials so far, as MyHistCanvas does with
+the RTs. Both draw into an Agg canvas of the size of the GUI's. Reported:
+milliseconds per trial around trials 10, 100, 1000 and 10000, the points
+drawn, and that the min/max buckets keep the extremes of every trace.
+
+    python benchmarks/bench_traces.py [trials]
+'''
+import sys
+import time
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from sst.traces import SessionTraces, TracePlot, MinMaxTrace, WINDOW
+
+MARKS = [10, 100, 1000, 10000]
+SAMPLES = 5     # trials timed around each mark
+
+
+def session(trials, seed=0):
+    '''
+    columns of a stage 5 session with direction 'l', one entry per trial
+    '''
+    rng = np.random.RandomState(seed)
+    trial_type = np.where(rng.rand(trials) < 0.25, 2, 1)
+    is_rewarded = (rng.rand(trials) < np.where(trial_type == 1, 0.85, 0.5)).astype(int)
+    start = np.cumsum(rng.uniform(3000, 6000, trials))
+    rt = 300 + rng.exponential(80, trials) + 100*np.sin(np.arange(trials)/500.0)
+    ssd = np.clip(200 + np.cumsum(np.where(is_rewarded[trial_type == 2] == 1, 50, -50)), 0, 600)
+    return {'trialType': trial_type.tolist(), 'isRewarded': is_rewarded.tolist(),
+            'pokeOutR': (start + 200).tolist(), 'pokeInL': (start + 200 + rt).tolist(),
+            'SSDs': ssd.astype(float).tolist()}
+
+
+def grow(columns, trials):
+    '''
+    the columns of the first trials trials
+    '''
+    stops = columns['trialType'][:trials].count(2)
+    grown = dict((name, values[:trials]) for name, values in columns.items() if name != 'SSDs')
+    grown['SSDs'] = columns['SSDs'][:stops]
+    return grown
+
+
+def newFigure():
+    figure = Figure(figsize=(5, 4), dpi=70)
+    return figure, FigureCanvasAgg(figure)
+
+
+def rolling(values, window=WINDOW):
+    total = np.cumsum(np.insert(values, 0, 0.0))
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return (total[1:] - total[np.maximum(np.arange(1, len(values) + 1) - window, 0)])/counts
+
+
+def fullRedraw(figure, columns, trials):
+    '''
+    clear and plot the rolling series of all trials so far
+    '''
+    data = grow(columns, trials)
+    trial_type = np.asarray(data['trialType'])
+    rewarded = np.asarray(data['isRewarded'], dtype=float)
+    x = np.arange(1, trials + 1)
+    go, stop = trial_type == 1, trial_type == 2
+    timed = go & (rewarded == 1)
+    rt = np.asarray(data['pokeInL']) - np.asarray(data['pokeOutR'])
+    series = [[(x[go], rolling(rewarded[go])), (x[stop], rolling(rewarded[stop]))],
+              [(x[timed], rolling(rt[timed]))],
+              [(x[stop], np.asarray(data['SSDs']))]]
+    figure.clear()
+    points = 0
+    for position, lines in zip([311, 312, 313], series):
+        ax = figure.add_subplot(position)
+        for line_x, line_y in lines:
+            ax.plot(line_x, line_y)
+            points += len(line_x)
+    return points
+
+
+def main():
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    marks = [mark for mark in MARKS if mark <= trials]
+    last = trials + SAMPLES
+    columns = session(last)
+
+    figure, canvas = newFigure()
+    traces = SessionTraces()
+    plot = TracePlot(figure, traces)
+    incremental = dict((mark, []) for mark in marks)
+    drawn = {}
+    for trial in range(1, last):
+        data = grow(columns, trial)
+        if not any(mark <= trial < mark + SAMPLES for mark in marks):
+            traces.update(data)     # not timed, nor drawn
+            continue
+        start = time.perf_counter()
+        traces.update(data)
+        plot.update()
+        canvas.draw()
+        elapsed = time.perf_counter() - start
+        for mark in marks:
+            if mark <= trial < mark + SAMPLES:
+                incremental[mark].append(elapsed)
+                drawn[mark] = sum(len(line.get_xdata()) for line in plot.lines.values())
+
+    full = {}
+    full_points = {}
+    figure, canvas = newFigure()
+    for mark in marks:
+        times = []
+        for trial in range(mark, mark + SAMPLES):
+            start = time.perf_counter()
+            full_points[mark] = fullRedraw(figure, columns, trial)
+            canvas.draw()
+            times.append(time.perf_counter() - start)
+        full[mark] = times
+
+    print('%8s %16s %8s %16s %8s' % ('trial', 'incremental ms', 'points', 'full redraw ms', 'points'))
+    for mark in marks:
+        print('%8d %16.1f %8d %16.1f %8d' % (mark, 1e3*np.median(incremental[mark]), drawn[mark],
+                                             1e3*np.median(full[mark]), full_points[mark]))
+
+    # the min/max buckets keep the extremes of a long series
+    rng = np.random.RandomState(1)
+    y = np.cumsum(rng.normal(0, 1, 100000))
+    trace = MinMaxTrace(400)
+    start = time.perf_counter()
+    for x, value in enumerate(y.tolist()):
+        trace.append(x, value)
+    append = time.perf_counter() - start
+    xs, ys = trace.points()
+    assert ys.min() == y.min() and ys.max() == y.max()
+    assert np.all(np.diff(xs) >= 0) and len(xs) <= 800
+    print('MinMaxTrace: %d points -> %d, extremes kept, %.2f us per append' % (
+        len(y), len(xs), 1e6*append/len(y)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''
+Benchmark of the video stream under simulated slow links.
+
+A synthetic camera (sst_server.SyntheticSource) feeds the real MyTCPHandler
+over loopback; the client reads with a small receive buffer at a limited byte
+rate (throttled local socket). For each link rate the adaptive encoder is
+compared with the fixed 480 px / quality 30 setting, reporting encode time
+per frame, delivered frame rate and end-to-end latency (capture to received).
+
+    python benchmarks/bench_video_stream.py [seconds per run]
+'''
+import sys
+import time
+import socket
+import struct
+import pickle
+import threading
+
+import numpy as np
+
+from sst.sst_server import ThreadedTCPServer, MyTCPHandler, AdaptiveEncoder, CameraStream, SyntheticSource
+
+
+def throttledClient(port, rate, seconds, sent_times, C_TYPE_FORMAT='I'):
+    '''
+    read the stream at rate bytes per second, return latencies of frames
+    '''
+    latencies = []
+    header_size = struct.calcsize(C_TYPE_FORMAT)
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8192)
+        sock.connect(('localhost', port))
+        data = b''
+        messages = []
+        start = time.time()
+        received = 0
+        while time.time()-start < seconds:
+            chunk = sock.recv(2048)
+            if not chunk:
+                break
+            received += len(chunk)
+            data += chunk
+            # parse complete messages: frame then trial number
+            while len(data) >= header_size:
+                size = struct.unpack(C_TYPE_FORMAT, data[:header_size])[0]
+                if len(data) < header_size+size:
+                    break
+                messages.append(data[header_size:header_size+size])
+                data = data[header_size+size:]
+                if len(messages) == 2:
+                    frame_id = pickle.loads(messages[1])
+                    latencies.append(time.time()-sent_times[frame_id])
+                    messages = []
+            # sleep to hold the link rate
+            ahead = received/float(rate) - (time.time()-start)
+            if ahead > 0:
+                time.sleep(ahead)
+    return latencies
+
+
+def run(rate, adaptive, seconds):
+    server = ThreadedTCPServer(('localhost', 0), MyTCPHandler)
+    server.camera = CameraStream(SyntheticSource(fps=30))
+    server.camera.start()
+    server.adaptive = adaptive
+    sent_times = {}
+    counter = [0]
+
+    def getTrialNum():
+        # the trial number carries a frame id to measure latency
+        counter[0] += 1
+        sent_times[counter[0]] = time.time()
+        return counter[0]
+    server.getTrialNum = getTrialNum
+    server.getTimeSinceStart = lambda: 0
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    latencies = throttledClient(server.server_address[1], rate, seconds, sent_times)
+    server.shutdown()
+    server.server_close()
+    server.camera.stop()
+    return np.array(latencies)
+
+
+def encodeTime(level, frames=100):
+    encoder = AdaptiveEncoder(level=level, adaptive=False)
+    frame = SyntheticSource(fps=None).read()
+    encoder.encode(frame)
+    start = time.perf_counter()
+    for _ in range(frames):
+        encoder.encode(frame)
+    return (time.perf_counter()-start)/frames
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print('encode time per frame')
+    for level, (width, quality, fps) in enumerate(AdaptiveEncoder.LEVELS):
+        print('  %4d px q%-3d %7.2f ms' % (width, quality, 1000*encodeTime(level)))
+    print()
+    print('%10s %9s %8s %12s %12s' % ('link', 'encoder', 'fps', 'latency p50', 'latency p95'))
+    for rate in [2000000, 200000, 50000, 15000]:
+        for adaptive in [False, True]:
+            latencies = run(rate, adaptive, seconds)
+            if len(latencies) == 0:
+                print('%7d kB/s %9s   no frame received' % (rate//1000, 'adaptive' if adaptive else 'fixed'))
+                continue
+            print('%7d kB/s %9s %8.1f %10.0f ms %10.0f ms' % (
+                rate//1000, 'adaptive' if adaptive else 'fixed', len(latencies)/seconds,
+                1000*np.median(latencies), 1000*np.percentile(latencies, 95)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+'''
+Lab collector on loopback: simulated rigs stream events and reports to one
+CollectorServer, which is killed in the middle of the run and restarted on
+the same archive. At the end every rig's event log must hold each of its
+events exactly once, in order, and every report must be in the index.
+
+Each rig writes 'IL' events with the timestamps 1, 2, 3, ... at a fixed
+rate through its RigUploader, and a report every few seconds.
+
+    python benchmarks/sim_collector.py [rigs] [seconds] [events/s per rig]
+'''
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from sst.sst_collector import CollectorServer, RigUploader, readEventLog
+
+PORT = 9997
+
+
+def startCollector(root):
+    server = CollectorServer(root, ('127.0.0.1', PORT))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def killCollector(server):
+    server.shutdown()
+    server.server_close()
+
+
+def rig(uploader, stop, rate, spool, counts, name):
+    n = 0
+    reports = 0
+    start = time.time()
+    uploader.startSession('session')
+    while not stop.is_set():
+        due = int((time.time() - start)*rate)
+        while n < due:
+            n += 1
+            uploader.on_event(('IL', n, 1))
+        if time.time() - start > 2*(reports+1):
+            reports += 1
+            path = os.path.join(spool, 'SST Report 2026-01-01 00-%02d.txt' % reports)
+            with open(path, 'w') as f:
+                f.write('General Message:\ntrialNum: %d stage: 5 None\n' % n)
+            uploader.sendReport(path)
+        time.sleep(0.01)
+    counts[name] = (n, reports)
+
+
+def main():
+    n_rigs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else 200.0
+    work = tempfile.mkdtemp(prefix='sst_collector_')
+    root = os.path.join(work, 'collector')
+    try:
+        server = startCollector(root)
+        stop = threading.Event()
+        counts = {}
+        uploaders, threads = [], []
+        for i in range(n_rigs):
+            name = 'rig%02d' % i
+            spool = os.path.join(work, 'spool', name)
+            uploader = RigUploader('127.0.0.1', PORT, name, spool)
+            uploader.start()
+            uploaders.append(uploader)
+            threads.append(threading.Thread(target=rig, args=(uploader, stop, rate, spool, counts, name)))
+        start = time.time()
+        for t in threads:
+            t.start()
+
+        time.sleep(seconds/2)
+        killCollector(server)
+        print('collector killed after %.1f s, %d events stored' % (time.time() - start,
+                                                                    server.events_received))
+        time.sleep(1.0)
+        server = startCollector(root)
+        print('collector restarted')
+        time.sleep(seconds/2)
+
+        stop.set()
+        for t in threads:
+            t.join()
+        drain = time.time()
+        for uploader in uploaders:
+            uploader.stop(timeout=30.0)
+        drain = time.time() - drain
+        killCollector(server)
+
+        errors = 0
+        total_events = total_reports = 0
+        for i, uploader in enumerate(uploaders):
+            name = 'rig%02d' % i
+            n, reports = counts[name]
+            total_events += n
+            total_reports += reports
+            stamps = [timestamp for _, _, timestamp in
+                      readEventLog(os.path.join(root, name, 'events', 'session.events'))]
+            if stamps != list(range(1, n+1)):
+                errors += 1
+                print('%s: %d events stored, %d written' % (name, len(stamps), n))
+            if uploader.pending:
+                errors += 1
+                print('%s: %d messages left in the spool' % (name, len(uploader.pending)))
+        connection = sqlite3.connect(os.path.join(root, 'sst_archive.db'))
+        indexed = connection.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+        streamed = connection.execute('SELECT SUM(events) FROM streams').fetchone()[0]
+        connection.close()
+        if indexed != total_reports or streamed != total_events:
+            errors += 1
+
+        elapsed = time.time() - start
+        print('%d rigs, %.0f s: %d events (%.0f/s), %d reports' % (
+            n_rigs, elapsed, total_events, total_events/elapsed, total_reports))
+        print('messages sent %d, reconnect attempts %d, spool drained in %.2f s' % (
+            sum(u.sent for u in uploaders), sum(u.reconnects for u in uploaders), drain))
+        print('index: %d of %d reports, %d of %d events' % (indexed, total_reports, streamed, total_events))
+        print('FAILED' if errors else 'every event stored exactly once')
+        return 1 if errors else 0
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
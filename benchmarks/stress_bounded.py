@@ -0,0 +1,154 @@
+'''
+Resident memory of a simulated 24-hour high-rate session: Data with plain
+lists against Data(hot_window) with columns spilled to disk.
+
+Events follow free exploration with a laser: pokes into all three ports
+(about 6 per second), laser pulses at 40 per second and a trial number every
+20 seconds, 50 events per second or 4.3 million per day. As in the GUI, every
+trial takes a snapshot with statistics (over the hot window when bounded)
+and every 10 minutes the temp file is saved. Each mode runs in its own
+process; the resident set size (VmRSS) is read every simulated hour. At the
+end, the columns of both modes must be equal (count and sum), through
+get(), np.asarray and iteration.
+
+Linux (reads /proc/self/status).
+
+    python benchmarks/stress_bounded.py [hours] [events per second]
+'''
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import tempfile
+import subprocess
+
+import numpy as np
+
+import sst.sst_summary
+from sst.Data import Data
+from sst.sst_summary import calCR
+
+HOT_WINDOW = 4096
+CHECKED = ['pokeInL', 'pokeInM', 'pokeOutR', 'laserOn', 'trialType', 'isRewarded']
+
+
+def quiet(*args):
+    pass
+
+
+def rss():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])*1024
+    return 0
+
+
+def session(hours, rate, seed=0):
+    '''
+    events of the session, one simulated minute at a time
+    '''
+    rng = np.random.RandomState(seed)
+    codes = ['IL', 'OL', 'IM', 'OM', 'IR', 'OR', 'L\x01']
+    weights = np.array([1, 1, 1, 1, 1, 1, 0], dtype=float)
+    pokes = 6.0
+    weights *= pokes/weights.sum()
+    weights[-1] = max(rate - pokes - 0.05, 0)
+    p = weights/weights.sum()
+    tick = 0
+    trial = 0
+    for minute in range(int(hours*60)):
+        n = rng.poisson(rate*60)
+        chosen = rng.choice(len(codes), n, p=p)
+        ticks = tick + np.sort(rng.randint(0, 60*1024, n))
+        timed = [(int(t), (codes[c], int(t))) for c, t in zip(chosen, ticks)]
+        for second in range(0, 60, 20):
+            trial += 1
+            at = tick + second*1024
+            timed += [(at, ('TN', trial)), (at, ('TT', 1 + int(rng.rand() < 0.25))),
+                      (at + 1, ('RS', at + 1 if rng.rand() < 0.7 else 0))]
+        timed.sort(key=lambda item: item[0])
+        events = [event for _, event in timed]
+        tick += 60*1024
+        yield minute, events
+
+
+def run(mode, hours, rate, work):
+    sst.sst_summary.print = quiet
+    data = Data() if mode == 'lists' else Data(HOT_WINDOW, os.path.join(work, 'sst_spill'))
+    data.temp_file_name = os.path.join(work, 'temp_%s.txt' % mode)
+    memory = [(0, rss())]
+    start = time.time()
+    events = 0
+    stats_time = 0.0
+    for minute, chunk in session(hours, rate):
+        write = data.write
+        for event in chunk:
+            if write(event) == 0:   # trial ended
+                t = time.perf_counter()
+                snapshot = data.snapshot()
+                live = snapshot if mode == 'lists' else snapshot.lastTrials(HOT_WINDOW)
+                calCR(live['trialType'], live['isRewarded'])
+                np.asarray(live['pokeInM'])
+                stats_time += time.perf_counter() - t
+        events += len(chunk)
+        if minute % 10 == 9:
+            data.save()
+        if minute % 60 == 59:
+            memory.append((minute + 1, rss()))
+    elapsed = time.time() - start
+    snapshot = data.snapshot()
+    lists = data.get()
+    check = {}
+    for name in CHECKED:
+        values = lists[name]
+        array = np.asarray(snapshot[name], dtype=float)
+        total = math.fsum(values)
+        assert len(array) == len(values) and math.fsum(array) == total
+        assert math.fsum(snapshot[name]) == total
+        check[name] = [len(values), total]
+    spilled = 0
+    if data.spill_dir is not None:
+        spilled = sum(os.path.getsize(os.path.join(data.spill_dir, name))
+                      for name in os.listdir(data.spill_dir))
+    data.clear_temp()
+    return {'mode': mode, 'events': events, 'seconds': elapsed, 'statsSeconds': stats_time,
+            'memory': memory, 'check': check, 'spilledBytes': spilled}
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        mode, hours, rate, work = sys.argv[2], float(sys.argv[3]), float(sys.argv[4]), sys.argv[5]
+        print(json.dumps(run(mode, hours, rate, work)))
+        return
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24.0
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 50.0
+    work = tempfile.mkdtemp(prefix='sst_bounded_')
+    results = {}
+    try:
+        for mode in ['lists', 'bounded']:
+            output = subprocess.check_output([sys.executable, __file__, '--child', mode, str(hours), str(rate),
+                                              work])
+            results[mode] = json.loads(output.decode().strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    print('%.0f h at %.0f events/s: %d events' % (hours, rate, results['lists']['events']))
+    print('%6s %14s %14s' % ('hour', 'lists MB', 'bounded MB'))
+    for (hour, lists), (_, bounded) in zip(results['lists']['memory'], results['bounded']['memory']):
+        if hour % 180 == 0 or hour == results['lists']['memory'][-1][0]:
+            print('%6d %14.1f %14.1f' % (hour//60, lists/1e6, bounded/1e6))
+    for mode in ['lists', 'bounded']:
+        result = results[mode]
+        memory = [m for _, m in result['memory']]
+        print('%-8s growth after hour 1: %7.1f MB, %.1f s (%.1f s live statistics), spill files %.1f MB' % (
+            mode, (memory[-1] - memory[min(1, len(memory)-1)])/1e6, result['seconds'], result['statsSeconds'],
+            result['spilledBytes']/1e6))
+    assert results['lists']['check'] == results['bounded']['check']
+    print('columns equal in both modes: %s' % ', '.join(CHECKED))
+
+
+if __name__ == '__main__':
+    main()
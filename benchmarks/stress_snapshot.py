@@ -0,0 +1,104 @@
+'''
+Stress test of Data.snapshot() with one emulated board writing as fast as it
+can, a second writer adding video events through Data.writeVideo (as the motion
+detector does from the camera thread) and a reader hammering snapshots.
+
+The board writes trials in a fixed order: TN TT OR IL RS. A consistent view
+therefore has len(pokeOutR) >= len(pokeInL) >= len(rewardStart) >=
+len(pokeOutR)-1, and trialType at least as long as pokeInL. rewardStart and
+isRewarded always have the same length, because RS writes both. Every snapshot is
+checked, and so is the naive alternative of reading the live lists one by
+one. The thread switch interval is set to 1 us so that threads interleave
+inside writes.
+
+    python benchmarks/stress_snapshot.py [seconds]
+'''
+import sys
+import time
+import threading
+
+from sst.Data import Data
+from sst.events import TN, TT, OR, IL, RS
+
+TRIAL = [('TN', TN), ('TT', TT), ('OR', OR), ('IL', IL), ('RS', RS)]
+
+
+def quiet(*args):
+    pass
+
+
+def consistent(lengths):
+    return (lengths['pokeOutR'] >= lengths['pokeInL'] >= lengths['rewardStart'] >= lengths['pokeOutR'] - 1
+            and lengths['rewardStart'] == lengths['isRewarded']
+            and lengths['trialType'] >= lengths['pokeInL'])
+
+
+def board(data, stop, counts):
+    trial = 0
+    while not stop.is_set():
+        trial += 1
+        for code, event_id in TRIAL:
+            data.write((code, trial if code == 'TN' else 1, event_id))
+    counts['board'] = trial*len(TRIAL)
+
+
+def camera(data, stop, counts):
+    n = 0
+    while not stop.is_set():
+        n += 1
+        data.writeVideo(('VL', n))
+        time.sleep(0.0005)
+    counts['camera'] = n
+
+
+def run(seconds, with_reader):
+    data = Data()
+    stop = threading.Event()
+    counts = {}
+    threads = [threading.Thread(target=board, args=(data, stop, counts)),
+               threading.Thread(target=camera, args=(data, stop, counts))]
+    for t in threads:
+        t.start()
+    result = {'snapshots': 0, 'snapshot errors': 0, 'naive errors': 0}
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        if not with_reader:
+            time.sleep(0.01)
+            continue
+        view = data.snapshot()
+        lengths = dict((name, len(view[name])) for name in
+                       ['isRewarded', 'rewardStart', 'pokeInL', 'pokeOutR', 'trialType'])
+        result['snapshots'] += 1
+        result['snapshot errors'] += not consistent(lengths)
+
+        # the same lengths from the live lists, one after the other
+        live = {}
+        for name, column in [('pokeOutR', data.poke_out_r), ('rewardStart', data.reward_start),
+                             ('isRewarded', data.is_rewarded), ('trialType', data.trial_type),
+                             ('pokeInL', data.poke_in_l)]:
+            live[name] = len(column)
+        result['naive errors'] += not consistent(live)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for t in threads:
+        t.join()
+    result.update({'events/s': counts['board']/elapsed, 'snapshots/s': result['snapshots']/elapsed,
+                   'retries': data.snapshot_retries, 'video': counts['camera']})
+    return result
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    sys.setswitchinterval(1e-6)
+    alone = run(seconds/2, False)
+    loaded = run(seconds, True)
+    print('writer alone:       %9.0f events/s' % alone['events/s'])
+    print('writer with reader: %9.0f events/s, %d video events' % (loaded['events/s'], loaded['video']))
+    print('snapshots:          %9.0f /s, %d retries, %d inconsistent of %d' % (
+        loaded['snapshots/s'], loaded['retries'], loaded['snapshot errors'], loaded['snapshots']))
+    print('naive reads:        %d inconsistent of %d' % (loaded['naive errors'], loaded['snapshots']))
+    return 1 if loaded['snapshot errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
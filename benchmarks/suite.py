@@ -0,0 +1,468 @@
+'''
+Benchmark suite of the acquisition-to-analysis path, with stored results
+and a comparison that flags regressions between runs.
+
+Every benchmark builds its input from a fixed seed (a stage 5 session of
+`trials` trials, the packets of its events, a report written from it and
+640x480 synthetic camera frames) and times one call of the code under test:
+
+    serial.frame      SerialConnection.read: marker framing of a packet stream
+    serial.unpack     SerialConnection._process_each_data per packet
+    data.write        Data.write of decoded events
+    data.get          Data.get of a whole session
+    data.save         Data.save (temp file written after every trial)
+    stats.calRT       calRT as in trialEndUpdate
+    stats.calCR       calCR as in trialEndUpdate
+    stats.median      np.median of the RTs (initial SSD)
+    gui.histogram     MyHistCanvas.update_figure (needs PyQt5)
+    preprocess.loadData
+    preprocess.calSSRT2
+    video.capture     SyntheticSource.read into a preallocated frame
+    video.encode      AdaptiveEncoder.encode (resize, overlay, JPEG)
+    video.pack        AdaptiveEncoder.pack
+
+A benchmark is run in rounds of enough calls to last `--min-time`; the
+minimum and median time per call over `--rounds` rounds are stored, with
+the machine and the git commit, as JSON. `compare` flags a benchmark whose
+minimum grew by more than `--threshold` and exits with 1 if any did.
+Benchmarks whose dependencies are missing are stored as skipped.
+
+    python benchmarks/suite.py run [-o results.json] [-k video] [--trials 1000] [--quick]
+    python benchmarks/suite.py compare base.json new.json [--threshold 0.1]
+'''
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import struct
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import OrderedDict
+
+import numpy as np
+
+import sst.preprocess
+import sst.sst_summary
+from sst.Data import Data
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+BENCHMARKS = OrderedDict()   # name -> setup(context) returning (call, items)
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def quiet(*args):
+    pass
+
+
+class Skip(Exception):
+    pass
+
+
+class Context(object):
+    '''
+    inputs shared by the benchmarks, built on first use from a fixed seed
+    '''
+    def __init__(self, trials, seed=0):
+        self.trials = trials
+        self.seed = seed
+        self.work = tempfile.mkdtemp(prefix='sst_suite_')
+        self._events = None
+        self._session = None
+
+    def events(self):
+        '''
+        (code, tick) of a stage 5 session, as written by the board
+        '''
+        if self._events is None:
+            rng = np.random.RandomState(self.seed)
+            events = []
+            tick = 0
+            for trial in range(1, self.trials+1):
+                stop = trial > 20 and rng.rand() < 0.25
+                events.append(('TN', trial))
+                events.append(('TT', 2 if stop else 1))
+                for code in ['IL', 'OL', 'IM', 'OM']:
+                    tick += int(rng.gamma(3, 100))
+                    events.append((code, tick))
+                if stop:
+                    events.append(('SS', tick + 200))
+                    events.append(('SD', 200))
+                tick += int(300 + rng.exponential(120))
+                events.append(('IR', tick))
+                events.append(('RS', tick if rng.rand() < 0.7 else 0))
+                tick += int(rng.gamma(5, 100))
+                events.append(('OR', tick))
+            self._events = events
+        return self._events
+
+    def packets(self):
+        return [code.encode('latin-1') + struct.pack('<l', tick) for code, tick in self.events()]
+
+    def data(self):
+        data = Data()
+        data.temp_file_name = os.path.join(self.work, 'sst_data_temp.txt')
+        for event in self.events():
+            data.write(event)
+        return data
+
+    def session(self):
+        '''
+        Data.get() of the session
+        '''
+        if self._session is None:
+            self._session = self.data().get()
+        return self._session
+
+    def report(self):
+        '''
+        path of the session written as a report of sst_gui.saveData
+        '''
+        path = os.path.join(self.work, 'report.txt')
+        if not os.path.exists(path):
+            columns = self.session()
+            with open(path, 'w') as f:
+                f.write('General Message:\n')
+                f.write('trialNum: %d stage: 5 None' % len(columns['pokeInM']))
+                for name, value in columns.items():
+                    f.write('\n'+name+'\n')
+                    f.write(str(value))
+                f.write('\n')
+        return path
+
+    def close(self):
+        shutil.rmtree(self.work, ignore_errors=True)
+
+
+class FakePort(object):
+    '''
+    serial port replaying bytes, one per read() as pySerial returns them
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.stream) - self.position
+
+    def read(self, size=1):
+        chunk = self.stream[self.position:self.position+size]
+        self.position += size
+        return chunk
+
+
+class ListQueue(list):
+    put = list.append
+
+
+@benchmark('serial.frame')
+def serialFrame(context):
+    from sst.SerialConnection import SerialConnection
+    packets = context.packets()[:20000]
+    stream = b''.join(b'<' + packet + b'>' for packet in packets)
+
+    def call():
+        # without __init__, which opens the port
+        connection = SerialConnection.__new__(SerialConnection)
+        connection.connection = FakePort(stream)
+        connection.complete_data = ListQueue()
+        connection.read_in_process = False
+        connection.each_data = bytearray()
+        connection.read()
+    return call, len(packets)
+
+
+@benchmark('serial.unpack')
+def serialUnpack(context):
+    from sst.SerialConnection import SerialConnection
+    packets = [bytearray(packet) for packet in context.packets()]
+    decode = SerialConnection.__new__(SerialConnection)._process_each_data
+
+    def call():
+        for packet in packets:
+            decode(packet)
+    return call, len(packets)
+
+
+@benchmark('data.write')
+def dataWrite(context):
+    from sst.SerialConnection import SerialConnection
+    decode = SerialConnection.__new__(SerialConnection)._process_each_data
+    decoded = [decode(bytearray(packet)) for packet in context.packets()]
+
+    def call():
+        data = Data()
+        write = data.write
+        for event in decoded:
+            write(event)
+    return call, len(decoded)
+
+
+@benchmark('data.get')
+def dataGet(context):
+    data = context.data()
+    return data.get, context.trials
+
+
+@benchmark('data.save')
+def dataSave(context):
+    data = context.data()
+    return data.save, context.trials
+
+
+@benchmark('stats.calRT')
+def statsRT(context):
+    data = context.session()
+    return lambda: sst.sst_summary.calRT(data['pokeOutL'], data['pokeInR']), context.trials
+
+
+@benchmark('stats.calCR')
+def statsCR(context):
+    data = context.session()
+    return lambda: sst.sst_summary.calCR(data['trialType'], data['isRewarded']), context.trials
+
+
+@benchmark('stats.median')
+def statsMedian(context):
+    data = context.session()
+    rt = sst.sst_summary.calRT(data['pokeOutL'], data['pokeInR'])
+    return lambda: np.median(rt), len(rt)
+
+
+@benchmark('gui.histogram')
+def guiHistogram(context):
+    try:
+        from sst.sst_gui import MyHistCanvas
+    except ImportError as e:
+        raise Skip(str(e))
+    from PyQt5.QtWidgets import QApplication
+    context.app = QApplication.instance() or QApplication(['suite', '-platform', 'offscreen'])
+    canvas = MyHistCanvas()
+    data = context.session()
+    rt = sst.sst_summary.calRT(data['pokeOutL'], data['pokeInR'])
+    return lambda: canvas.update_figure(rt), 1
+
+
+@benchmark('preprocess.loadData')
+def loadData(context):
+    path = context.report()
+    return lambda: sst.preprocess.loadData(path), context.trials
+
+
+@benchmark('preprocess.calSSRT2')
+def calSSRT2(context):
+    if context.trials <= 320:
+        raise Skip('needs more than 320 trials')
+    df = sst.preprocess.loadData(context.report())['df']
+    return lambda: sst.preprocess.calSSRT2(df), context.trials
+
+
+def _video():
+    try:
+        from sst.sst_server import SyntheticSource, AdaptiveEncoder
+    except ImportError as e:
+        raise Skip(str(e))
+    return SyntheticSource, AdaptiveEncoder
+
+
+@benchmark('video.capture')
+def videoCapture(context):
+    SyntheticSource, _ = _video()
+    source = SyntheticSource(fps=None, seed=context.seed)
+    buffer = source.read()
+    return lambda: source.read(buffer), 1
+
+
+@benchmark('video.encode')
+def videoEncode(context):
+    SyntheticSource, AdaptiveEncoder = _video()
+    import cv2
+    frame = SyntheticSource(fps=None, seed=context.seed).read()
+    encoder = AdaptiveEncoder(level=0, adaptive=False)
+
+    def overlay(image):
+        cv2.putText(image, 'Trial Finished: 123', (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                    (255, 255, 255), 1, cv2.LINE_AA)
+    return lambda: encoder.encode(frame, overlay), 1
+
+
+@benchmark('video.pack')
+def videoPack(context):
+    SyntheticSource, AdaptiveEncoder = _video()
+    encoder = AdaptiveEncoder(level=0, adaptive=False)
+    jpg = encoder.encode(SyntheticSource(fps=None, seed=context.seed).read())[1]
+    return lambda: encoder.pack(jpg, 123), 1
+
+
+def measure(call, rounds, min_time):
+    '''
+    (min, median) seconds per call over rounds of calls lasting min_time
+    '''
+    call()   # warm up
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number = max(2*number, int(number*1.2*min_time/max(elapsed, 1e-9)))
+    times = [elapsed/number]
+    for _ in range(rounds-1):
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        times.append((time.perf_counter() - start)/number)
+    return min(times), float(np.median(times)), number
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def machine():
+    import pandas
+    info = OrderedDict([('commit', gitCommit()), ('date', time.strftime('%Y-%m-%d %H:%M:%S')),
+                        ('python', platform.python_version()), ('platform', platform.platform()),
+                        ('processor', platform.processor() or platform.machine()),
+                        ('cpus', os.cpu_count()), ('numpy', np.__version__), ('pandas', pandas.__version__)])
+    try:
+        import cv2
+        info['opencv'] = cv2.__version__
+    except ImportError:
+        pass
+    return info
+
+
+def run(names, trials=1000, rounds=5, min_time=0.2, seed=0, out=sys.stdout):
+    '''
+    {'machine': ..., 'settings': ..., 'results': {name: result}} of the named benchmarks
+    '''
+    summary_print, sst.sst_summary.print = getattr(sst.sst_summary, 'print', print), quiet
+    preprocess_print, sst.preprocess.print = getattr(sst.preprocess, 'print', print), quiet
+    context = Context(trials, seed)
+    results = OrderedDict()
+    try:
+        for name in names:
+            try:
+                call, items = BENCHMARKS[name](context)
+            except Skip as e:
+                results[name] = {'skipped': str(e)}
+                out.write('%-22s skipped: %s\n' % (name, e))
+                continue
+            best, median, number = measure(call, rounds, min_time)
+            results[name] = OrderedDict([('min', best), ('median', median), ('items', items),
+                                         ('calls', number), ('rounds', rounds)])
+            out.write('%-22s %s  %s per item (%d items)\n' % (name, duration(best), duration(best/items),
+                                                             items))
+    finally:
+        context.close()
+        sst.sst_summary.print, sst.preprocess.print = summary_print, preprocess_print
+    settings = OrderedDict([('trials', trials), ('rounds', rounds), ('minTime', min_time), ('seed', seed)])
+    return OrderedDict([('machine', machine()), ('settings', settings), ('results', results)])
+
+
+def compare(base, new, threshold=0.1):
+    '''
+    [(name, base min, new min, ratio, flag)] of the benchmarks of both runs;
+    flag is 'REGRESSION' when new is slower than base by more than threshold,
+    'faster' when faster by as much
+    '''
+    rows = []
+    for name, result in new['results'].items():
+        old = base['results'].get(name)
+        if old is None or 'skipped' in old or 'skipped' in result:
+            continue
+        ratio = result['min']/old['min']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+        elif ratio < 1/(1 + threshold):
+            flag = 'faster'
+        rows.append((name, old['min'], result['min'], ratio, flag))
+    return rows
+
+
+def duration(seconds):
+    for unit, scale in [('s', 1.0), ('ms', 1e-3), ('us', 1e-6)]:
+        if seconds >= scale:
+            return '%8.2f %-2s' % (seconds/scale, unit)
+    return '%8.2f ns' % (seconds*1e9)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark suite of sst.')
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run benchmarks and store the results')
+    run_parser.add_argument('-o', '--output', help='JSON file (default benchmarks/results/<commit>.json)')
+    run_parser.add_argument('-k', '--select', help='regular expression of benchmark names')
+    run_parser.add_argument('--trials', type=int, default=1000)
+    run_parser.add_argument('--rounds', type=int, default=5)
+    run_parser.add_argument('--min-time', type=float, default=0.2, help='seconds per round')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--quick', action='store_true', help='3 rounds of 0.05 s')
+    compare_parser = commands.add_parser('compare', help='flag regressions between two runs')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='relative slowdown flagged (default %(default)s)')
+    commands.add_parser('list', help='names of the benchmarks')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        print('\n'.join(BENCHMARKS))
+    elif args.command == 'run':
+        names = [name for name in BENCHMARKS if args.select is None or re.search(args.select, name)]
+        rounds, min_time = (3, 0.05) if args.quick else (args.rounds, args.min_time)
+        report = run(names, args.trials, rounds, min_time, args.seed)
+        output = args.output
+        if output is None:
+            if not os.path.isdir(RESULTS_DIR):
+                os.makedirs(RESULTS_DIR)
+            output = os.path.join(RESULTS_DIR, '%s.json' % (report['machine']['commit'] or
+                                                              time.strftime('%Y%m%d-%H%M%S')))
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('results in {0}'.format(output))
+    elif args.command == 'compare':
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        if base['settings'] != new['settings']:
+            print('settings differ: {0} against {1}'.format(base['settings'], new['settings']))
+        if base['machine'].get('platform') != new['machine'].get('platform'):
+            print('machines differ: {0} against {1}'.format(base['machine'].get('platform'),
+                                                            new['machine'].get('platform')))
+        rows = compare(base, new, args.threshold)
+        print('%-22s %11s %11s %7s' % ('benchmark', base['machine'].get('commit') or 'base',
+                                        new['machine'].get('commit') or 'new', 'ratio'))
+        for name, old, current, ratio, flag in rows:
+            print('%-22s %s %s %6.2fx %s' % (name, duration(old), duration(current), ratio, flag))
+        regressions = [row for row in rows if row[4] == 'REGRESSION']
+        if regressions:
+            print('{0} regression(s) above {1:.0%}'.format(len(regressions), args.threshold))
+            return 1
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
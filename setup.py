@@ -12,7 +12,10 @@ setup(
     packages=find_packages(),
     package_data={'sst.resources':['*']}, 
     entry_points={
-        'console_scripts':['sst-gui=sst.sst_gui:main']
+        'console_scripts':['sst-gui=sst.sst_gui:main',
+                           'sst-archive=sst.sst_archive:main',
+                           'sst-collector=sst.sst_collector:main',
+                           'sst-mosaic=sst.sst_mosaic:main']
         },    
     platforms=['any'],
     )
@@ -6,107 +6,321 @@ Created on Fri May 15 18:27:47 2015
 """
 
 import os
+import time
+import shutil
+import logging
+import tempfile
+from itertools import islice
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+from sst.spill import SpillColumn
+from sst.events import (eventId, N_EVENTS, IL, OL, IM, OM, IR, OR, SS, RS, TT, SD, TS, TN,
+                        GE, SE, S_PLUS, S_MINUS, SQ, SU, AK, NK, LASER, VIDEO,
+                        UNICODE_ERROR, DATA_LENGTH_ERROR)
+
+# every event at DEBUG (was a print per event); off unless configured
+log = logging.getLogger(__name__)
+
+# one item per trial from stage 3 on (a poke that did not happen is 0), as
+# calRT and calCR pair them by index
+TRIAL_COLUMNS = ['trialType', 'isRewarded', 'rewardStart', 'pokeInL', 'pokeOutL',
+                 'pokeInR', 'pokeOutR', 'pokeInM', 'pokeOutM']
+
+class ColumnView(Sequence):
+    '''
+    Read-only view of the first length items of an append-only list.
+
+    The list keeps growing under the writer; the view does not, so it is
+    immutable without copying anything.
+    '''
+    __slots__ = ('_items', '_length')
+
+    def __init__(self, items, length):
+        self._items = items
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._items[slice(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('column index out of range')
+        return self._items[index]
+
+    def __iter__(self):
+        return islice(self._items, self._length)
+
+    def __array__(self, dtype=None, copy=None):
+        if isinstance(self._items, SpillColumn):
+            return self._items.toarray(self._length, dtype)
+        return np.array(self.tolist(), dtype=dtype)
+
+    def __eq__(self, other):
+        if isinstance(other, (ColumnView, list)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def tolist(self):
+        return self._items[:self._length]
+
+
+class Snapshot(Mapping):
+    '''
+    Length-consistent view of all columns of Data at one point between
+    two writes, keyed as Data.get()
+    '''
+    def __init__(self, epoch, columns):
+        self.epoch = epoch
+        self._columns = columns
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def lists(self):
+        '''
+        copies of the columns as plain lists
+        '''
+        return dict((name, column.tolist()) for name, column in self._columns.items())
+
+    def tail(self, n):
+        '''
+        Snapshot of the last n items of every column (live statistics of a
+        bounded session)
+        '''
+        return Snapshot(self.epoch, dict((name, ColumnView(column[max(len(column) - n, 0):],
+                                                           min(len(column), n)))
+                                         for name, column in self._columns.items()))
+
+    def lastTrials(self, n):
+        '''
+        Snapshot of the last n trials: the TRIAL_COLUMNS from the same first
+        trial, so that their items still pair by index; the other columns
+        (at most one item per trial, e.g. SSDs) as tail(n). Pokes are many
+        per trial before stage 3; a column with more than 2*n items since
+        the first trial is not per trial and is cut as tail(n) too, which
+        keeps the spilled part of the column on disk.
+        '''
+        first = max(len(self._columns['trialType']) - n, 0)
+        columns = dict(self.tail(n)._columns)
+        for name in TRIAL_COLUMNS:
+            column = self._columns[name]
+            if len(column) - first <= 2*n:
+                columns[name] = ColumnView(column[first:], max(len(column) - first, 0))
+        return Snapshot(self.epoch, columns)
+
 
 class Data(object):
     '''
     data encapsulation
+
+    The SerialMonitor thread writes while the GUI thread reads. Columns are
+    append-only lists. Readers take a snapshot(): the lengths of all columns,
+    read while no write is in progress and with the write sequence unchanged.
+    The serial thread is the only writer of the columns and it never waits:
+    as in a seqlock, it makes the sequence odd before a write and even again
+    after it, and a reader that sees an odd or changed sequence tries again.
+    Video events of the camera thread come through writeVideo(); they go to
+    a list of their own and stay out of the sequence.
+
+    With hot_window, the numeric columns are SpillColumns of sst.spill: the
+    last hot_window to 2*hot_window items of each stay in memory, older ones
+    go to files in a new directory under spill_dir, and memory stays flat
+    however long the session runs. Snapshots and get() read both parts.
     '''
-    def __init__(self):
+    def __init__(self, hot_window=None, spill_dir='sst_spill'):
         self.temp_file_name = 'sst_data_temp.txt'
-        self.poke_in_l = []
-        self.poke_out_l = []
-        self.poke_in_r = []
-        self.poke_out_r = []
-        self.poke_in_m = []
-        self.poke_out_m = []
-        self.reward_start = []
-        self.stop_signal_start = []
-        self.is_rewarded = []
-        self.trial_type = []
-        self.ssd = []
-        self.trials_skipped = []
-        self.laser_on = []
+        self.hot_window = hot_window
+        self.spill_dir = None
+        if hot_window is not None:
+            if not os.path.isdir(spill_dir):
+                os.makedirs(spill_dir)
+            self.spill_dir = tempfile.mkdtemp(prefix='session_', dir=spill_dir)
+        column = self._newColumn
+        self.poke_in_l = column('pokeInL')
+        self.poke_out_l = column('pokeOutL')
+        self.poke_in_r = column('pokeInR')
+        self.poke_out_r = column('pokeOutR')
+        self.poke_in_m = column('pokeInM')
+        self.poke_out_m = column('pokeOutM')
+        self.reward_start = column('rewardStart')
+        self.stop_signal_start = column('stopSignalStart')
+        self.is_rewarded = column('isRewarded', np.int64)
+        self.trial_type = column('trialType', np.int64)
+        self.ssd = column('SSDs')
+        self.trials_skipped = column('trialsSkipped', np.int64)
+        self.laser_on = column('laserOn')
         self.unicode_error = []
         self.data_length_error = []
         self.missed_data_error = []
-        self.trial_num = []
-        self.who_knows = []
+        self.trial_num = column('trialNum', np.int64)
+        self.video_events = []  # (code, timestamp) from the camera motion detector
+        # trials that started before their schedule arrived
+        self.schedule_underrun = column('scheduleUnderrun', np.int64)
+        # events with codes the store does not know, as columns
+        self.unknown_trial = column('unknownTrial', np.int64)
+        self.unknown_code = []
+        self.unknown_timestamp = column('unknownTimestamp', np.int64)
+        self.listeners = []  # called with every (event, timestamp), e.g. video recorder
+        self.sequence = 0  # twice the completed writes, odd during a write
+        self.snapshot_retries = 0
+        self.columns = [('pokeInL', self.poke_in_l), ('pokeOutL', self.poke_out_l),
+                        ('pokeInR', self.poke_in_r), ('pokeOutR', self.poke_out_r),
+                        ('pokeInM', self.poke_in_m), ('pokeOutM', self.poke_out_m),
+                        ('rewardStart', self.reward_start), ('stopSignalStart', self.stop_signal_start),
+                        ('isRewarded', self.is_rewarded), ('trialType', self.trial_type),
+                        ('SSDs', self.ssd), ('trialsSkipped', self.trials_skipped),
+                        ('unicodeError', self.unicode_error), ('dataLengthError', self.data_length_error),
+                        ('laserOn', self.laser_on), ('videoEvents', self.video_events),
+                        ('scheduleUnderrun', self.schedule_underrun),
+                        ('unknownTrial', self.unknown_trial), ('unknownCode', self.unknown_code),
+                        ('unknownTimestamp', self.unknown_timestamp)]
+
+        # store of every event ID of sst.events; return 0 when a trial ended
+        self.store = [self._storeUnknown]*N_EVENTS
+        for event_id, column in [(IL, self.poke_in_l), (OL, self.poke_out_l),
+                                 (IM, self.poke_in_m), (OM, self.poke_out_m),
+                                 (IR, self.poke_in_r), (OR, self.poke_out_r),
+                                 (SS, self.stop_signal_start), (SD, self.ssd),
+                                 (LASER, self.laser_on)]:
+            self.store[event_id] = self._storeTime(column.append)
+        for event_id, column in [(TT, self.trial_type), (TS, self.trials_skipped),
+                                 (SU, self.schedule_underrun)]:
+            self.store[event_id] = self._storeInt(column.append)
+        for event_id in [GE, SE, S_PLUS, S_MINUS, SQ, AK, NK]:
+            # SQ: schedule request, answered by the schedule streamer
+            # AK/NK: command (n)acknowledged, read by the command channel
+            self.store[event_id] = self._ignore
+        self.store[RS] = self._storeReward
+        self.store[TN] = self._storeTrialNum
+        self.store[VIDEO] = self._storeVideo
+        self.store[UNICODE_ERROR] = self._storeRaw(self.unicode_error.append)
+        self.store[DATA_LENGTH_ERROR] = self._storeRaw(self.data_length_error.append)
+
+    def _newColumn(self, name, dtype=np.float64):
+        if self.hot_window is None:
+            return []
+        return SpillColumn(os.path.join(self.spill_dir, name + '.bin'), dtype, self.hot_window)
+
+    @staticmethod
+    def _storeTime(append):
+        def store(event, timestamp):
+            append(timestamp/1.024)
+        return store
+
+    @staticmethod
+    def _storeInt(append):
+        def store(event, timestamp):
+            append(int(timestamp))
+        return store
+
+    @staticmethod
+    def _storeRaw(append):
+        def store(event, timestamp):
+            append(timestamp)
+        return store
+
+    @staticmethod
+    def _ignore(event, timestamp):
+        pass
+
+    def _storeReward(self, event, timestamp):
+        self.reward_start.append(timestamp/1.024)
+        self.is_rewarded.append(0 if timestamp == 0 else 1)
+
+    def _storeTrialNum(self, event, timestamp):
+        self.trial_num.append(timestamp)
+        if timestamp > 1:
+            return 0
+
+    def _storeVideo(self, event, timestamp):
+        # video motion onset/offset
+        self.video_events.append((event, timestamp/1.024))
+
+    def _storeUnknown(self, event, timestamp):
+        if len(self.trial_num) > 0:
+            self.unknown_trial.append(self.trial_num[-1])
+            self.unknown_code.append(event)
+            self.unknown_timestamp.append(timestamp)
 
     def write(self, data_in):
         '''
         append timestamps of different events
+
+        data_in is (code, timestamp) or, from the decoder, (code, timestamp, event ID)
         '''
-        print(data_in)
-        if len(data_in) == 2:
-            event = data_in[0]
-            timestamp = data_in[1]
-            if event == 'IL':
-                self.poke_in_l.append(timestamp/1.024)
-            elif event == 'OL':
-                self.poke_out_l.append(timestamp/1.024)
-            elif event == 'IM':
-                self.poke_in_m.append(timestamp/1.024)
-            elif event == 'OM':
-                self.poke_out_m.append(timestamp/1.024)
-            elif event == 'IR':
-                self.poke_in_r.append(timestamp/1.024)
-            elif event == 'OR':
-                self.poke_out_r.append(timestamp/1.024)
-            elif event == 'SS':#stop signal start
-                self.stop_signal_start.append(timestamp/1.024)
-            elif event == 'RS':#reward start
-                self.reward_start.append(timestamp/1.024)
-                if timestamp == 0:
-                    self.is_rewarded.append(0)
-                else:
-                    self.is_rewarded.append(1)
-            elif event == 'TT':#trialType
-                self.trial_type.append(int(timestamp))
-            elif event == 'SD':
-                self.ssd.append(timestamp/1.024)
-            elif event == 'TS':#trialSkipped
-                self.trials_skipped.append(int(timestamp))
-            elif event[0] == 'L':#Laser on timestamps
-                self.laser_on.append(timestamp/1.024)
-            elif event == 'UnicodeError':
-                self.unicode_error.append(timestamp)
-            elif event == 'DataLengthError':
-                self.data_length_error.append(timestamp)
-            elif event == 'TN':
-                self.trial_num.append(timestamp)
-                if timestamp > 1:
-                    return 0
-            elif event == 'GE':
-                pass
-            elif event == 'SE':
-                pass
-            elif event == 'LE':
-                pass
-            elif event == 'S+':
-                pass
-            elif event == 'S-':
-                pass
-            else:
-                if len(self.trial_num) > 0:
-                    self.who_knows.append((self.trial_num[-1], data_in))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('%s', data_in)
+        for listener in self.listeners:
+            listener(data_in)
+        try:
+            event_id = data_in[2]
+        except IndexError:
+            if len(data_in) != 2:
+                return 1
+            event_id = eventId(data_in[0])
+        self.sequence += 1
+        try:
+            result = self.store[event_id](data_in[0], data_in[1])
+        finally:
+            self.sequence += 1
+        if result == 0:
+            return 0
         return 1
 
+    def writeVideo(self, data_in):
+        '''
+        append a (code, timestamp) video event from a thread other than the
+        serial writer, e.g. the motion detector
+        '''
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('%s', data_in)
+        for listener in self.listeners:
+            listener(data_in)
+        self._storeVideo(data_in[0], data_in[1])
+
+    def snapshot(self):
+        '''
+        return a Snapshot of all columns, as Data.get() but without copies
+        '''
+        while True:
+            sequence = self.sequence
+            if not sequence & 1:
+                lengths = [len(column) for _, column in self.columns]
+                if self.sequence == sequence:
+                    break
+            self.snapshot_retries += 1
+            time.sleep(0)
+        columns = dict((name, ColumnView(column, length))
+                       for (name, column), length in zip(self.columns, lengths))
+        columns['trialType'] = ColumnView(self.trial_type, min(len(columns['trialType']),
+                                                               len(columns['pokeInL'])))
+        return Snapshot(sequence >> 1, columns)
+
 
     def get(self):
         '''
-        return the all the list
+        return the all the list (copies of one consistent snapshot)
         '''
-        return {'pokeInL':self.poke_in_l, 'pokeOutL':self.poke_out_l, 'pokeInR':self.poke_in_r,
-                'pokeOutR':self.poke_out_r, 'pokeInM':self.poke_in_m, 'pokeOutM':self.poke_out_m,
-                'rewardStart':self.reward_start, 'stopSignalStart':self.stop_signal_start,
-                'isRewarded':self.is_rewarded, 'trialType':self.trial_type[0:len(self.poke_in_l)],
-                'SSDs':self.ssd, 'trialsSkipped':self.trials_skipped,
-                'unicodeError':self.unicode_error, 'dataLengthError':self.data_length_error,
-                'laserOn':self.laser_on, 'whoKnows':self.who_knows}
+        return self.snapshot().lists()
 
-    def save(self, over_write=True):
+    def save(self, over_write=True, snapshot=None):
         '''
-        create a temp file and save the data
+        create a temp file and save the data (of snapshot, or a new one)
         used for data restore
         '''
         file_name = self.temp_file_name
@@ -116,16 +330,26 @@ class Data(object):
                 file_name = file_name + str(counter)
                 counter += 1
 
-        data_to_write = self.get()
+        data_to_write = self.snapshot() if snapshot is None else snapshot
 
         with open(file_name, 'w') as temp_file:
             for name, value in data_to_write.items():
+                items = getattr(value, '_items', None)
+                if isinstance(items, SpillColumn):
+                    # the spilled part is in the spill file already: name @items before
+                    offset, value = items.tail(len(value))
+                    name = '%s @%d' % (name, offset)
                 temp_file.write('\n'+name+'\n')
                 temp_file.write(str(value))
 
     def clear_temp(self):
         '''
-        remove temp file
+        remove temp file (and spill files)
         '''
         if os.path.exists(self.temp_file_name):
             os.remove(self.temp_file_name)
+        if self.spill_dir is not None:
+            for _, column in self.columns + [('trialNum', self.trial_num)]:
+                if isinstance(column, SpillColumn):
+                    column.close()
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
@@ -2,9 +2,14 @@
 """
 @author: lin
 """
-from struct import unpack
+from struct import Struct
 import serial
 from queue import Queue
+from threading import Lock
+
+from sst.events import EVENT_ID, EVENT_NAME
+
+PACKET = Struct('<Hl')   # code as one 16-bit number, timestamp
 
 class SerialConnection(object):
     '''
@@ -23,6 +28,7 @@ class SerialConnection(object):
         self.read_in_process = False
         self.new_data_obtained = False
         self.each_data = bytearray()
+        self.write_lock = Lock()  # commands come from the GUI and the serial monitor thread
         try:
             self.connection = serial.Serial(self.port, self.baudrate)
         except serial.SerialException as e:
@@ -40,7 +46,13 @@ class SerialConnection(object):
                 to_send = self.START_MARKER + something +self.END_MARKER
             else:
                 to_send = something
-            self.connection.write(to_send.encode())
+            with self.write_lock:
+                self.connection.write(to_send.encode())
+
+    def writeBytes(self, data):
+        if self.opened():
+            with self.write_lock:
+                self.connection.write(data)
 
     def read(self):
         if self.opened():
@@ -61,20 +73,13 @@ class SerialConnection(object):
         return self.complete_data
 
     def _process_each_data(self, data_array):
+        '''
+        (code, timestamp, event ID), see sst.events
+        '''
         if len(data_array) == self.EVENT_LENGTH + self.TIMESTAMP_LENGTH:
-            try:
-                event = data_array[0:self.EVENT_LENGTH].decode()
-            except UnicodeDecodeError:
-                event = 'UnicodeError'
-            ts = data_array[self.EVENT_LENGTH:]
-            try:
-                timestamp = unpack('<l', ts)[0]
-            except:
-                timestamp = ts
-        else:
-            event = 'DataLengthError'
-            timestamp = data_array
-        return (event, timestamp)
+            code, timestamp = PACKET.unpack(data_array)
+            return (EVENT_NAME[code], timestamp, EVENT_ID[code])
+        return ('DataLengthError', data_array)
 
     def getPort(self):
         return self.port
@@ -12,10 +12,12 @@ class SerialMonitor(QThread):
     """
     STATE = pyqtSignal()
 
-    def __init__(self, data, conn):
+    def __init__(self, data, conn, write=None):
         QThread.__init__(self)
         self.data = data
         self.connection = conn
+        # data.write, or a filter in front of it (sst.debounce)
+        self.write = data.write if write is None else write
         self.alive = True
 
     def __del__(self):
@@ -28,7 +30,7 @@ class SerialMonitor(QThread):
         while self.alive:
             data_in = self.connection.read()
             while not data_in.empty():
-                k = self.data.write(data_in.get())
+                k = self.write(data_in.get())
                 if k == 0:
                     self.STATE.emit()
     def stop(self):
@@ -0,0 +1,146 @@
+'''
+Bootstrap confidence intervals for SSRT, go RT quantiles and stop accuracy.
+
+All resamples of a session are drawn at once as a matrix of indices into the
+sorted go RTs (and into the stop trials), so no statistic is computed in a
+Python loop over resamples:
+
+* go RT quantiles: np.partition of the index rows at the quantile ranks.
+* SSRT (integration method, as preprocess.calSSRT): the rank to read depends
+  on the stop accuracy of each resample, so it is found from the cumulative
+  counts of the indices in every row.
+
+Sessions are spread over a process pool. On Windows call
+bootstrapSessions from under "if __name__ == '__main__':".
+'''
+import multiprocessing
+
+import numpy as np
+
+from sst.cache import loadSession
+
+CHUNK = 2000   # resamples computed together, bounds memory per session
+
+
+def sessionArrays(data, baseline=20, end=320):
+    '''
+    go RTs of correct go trials, success and SSD of stop trials from a
+    DataFrame of preprocess.loadData, selected as in preprocess.calSSRT
+    '''
+    data = data.iloc[baseline:end]
+    correct_go = data.loc[(data['TrialType']==1) & (data['IsRewarded']==1)]
+    if correct_go['PokeInR'].iloc[0] > correct_go['PokeInL'].iloc[0]:
+        gort = correct_go['PokeInR'] - correct_go['PokeOutL']
+    else:
+        gort = correct_go['PokeInL'] - correct_go['PokeOutR']
+    stop = data.loc[data['TrialType']==2]
+    return (np.asarray(gort, dtype=float),
+            np.asarray(stop['IsRewarded']==1, dtype=bool),
+            np.asarray(stop['SSDs'], dtype=float))
+
+
+def integrationSSRT(go_rt, stop_success, ssd):
+    '''
+    point estimate of the integration method
+    '''
+    go_rt = np.sort(go_rt)
+    k = min(int(len(go_rt)*(1-np.mean(stop_success))), len(go_rt)-1)
+    return go_rt[k] - np.mean(ssd[ssd > 0])
+
+
+def _interval(values, estimate, ci):
+    alpha = (1-ci)/2*100
+    low, high = np.percentile(values, [alpha, 100-alpha])
+    return (float(estimate), float(low), float(high))
+
+
+def bootstrapSession(go_rt, stop_success, ssd, n_boot=10000, quantiles=(0.1, 0.5, 0.9),
+                     ci=0.95, seed=None):
+    '''
+    Bootstrap one session.
+
+    Parameters
+    ----------
+    go_rt: RTs of correct go trials.
+    stop_success: bool per stop trial, True if the response was inhibited.
+    ssd: SSD per stop trial (0 for skipped stop signals, left out of the mean).
+    n_boot: number of resamples.
+    quantiles: go RT quantiles to report.
+    ci: coverage of the percentile intervals.
+
+    Returns
+    -------
+    result: Dictionary
+        'ssrt', 'stopAccuracy' and 'goRT' (a dict keyed by quantile) as
+        (estimate, low, high), plus 'ssrtSE' and the trial counts.
+    '''
+    rng = np.random.RandomState(seed)
+    go_rt = np.sort(np.asarray(go_rt, dtype=float))
+    stop_success = np.asarray(stop_success, dtype=bool)
+    ssd = np.asarray(ssd, dtype=float)
+    n_go = len(go_rt)
+    n_stop = len(stop_success)
+    ranks = np.round(np.asarray(quantiles)*(n_go-1)).astype(np.int64)
+
+    ssrts = np.empty(n_boot)
+    accuracies = np.empty(n_boot)
+    go_quantiles = np.empty((n_boot, len(ranks)))
+    for start in range(0, n_boot, CHUNK):
+        b = min(CHUNK, n_boot-start)
+        rows = slice(start, start+b)
+
+        # stop trials: accuracy and mean SSD of every resample
+        stop_idx = rng.randint(0, n_stop, (b, n_stop))
+        accuracy = stop_success[stop_idx].mean(axis=1)
+        ssd_b = ssd[stop_idx]
+        with np.errstate(invalid='ignore'):
+            ssd_mean = ssd_b.sum(axis=1) / (ssd_b > 0).sum(axis=1)
+
+        # go trials: indices into the sorted RTs
+        go_idx = rng.randint(0, n_go, (b, n_go))
+        go_quantiles[rows] = go_rt[np.partition(go_idx, ranks, axis=1)[:, ranks]]
+
+        # rank k of every resample from the cumulative index counts
+        counts = np.bincount((go_idx + n_go*np.arange(b)[:, None]).ravel(),
+                             minlength=b*n_go).reshape(b, n_go)
+        k = np.minimum((n_go*(1-accuracy)).astype(np.int64), n_go-1)
+        position = (counts.cumsum(axis=1) <= k[:, None]).sum(axis=1)
+        ssrts[rows] = go_rt[position] - ssd_mean
+        accuracies[rows] = accuracy
+
+    ssrts = ssrts[np.isfinite(ssrts)]
+    go_estimate = go_rt[ranks]
+    return {'ssrt': _interval(ssrts, integrationSSRT(go_rt, stop_success, ssd), ci),
+            'ssrtSE': float(np.std(ssrts)),
+            'stopAccuracy': _interval(accuracies, np.mean(stop_success), ci),
+            'goRT': dict((q, _interval(go_quantiles[:, i], go_estimate[i], ci))
+                         for i, q in enumerate(quantiles)),
+            'nGo': n_go, 'nStop': n_stop}
+
+
+def _bootstrapOne(args):
+    session, n_boot, quantiles, ci, seed, baseline, end = args
+    if isinstance(session, str):
+        session = sessionArrays(loadSession(session)['df'], baseline, end)
+    return bootstrapSession(session[0], session[1], session[2], n_boot, quantiles, ci, seed)
+
+
+def bootstrapSessions(sessions, n_boot=10000, quantiles=(0.1, 0.5, 0.9), ci=0.95, seed=0,
+                      processes=None, baseline=20, end=320, chunksize=4):
+    '''
+    Bootstrap many sessions in a process pool.
+
+    sessions: report file names, or (go_rt, stop_success, ssd) tuples.
+    Session i uses seed+i, so results do not depend on the number of processes.
+    Returns the results of bootstrapSession in the order of sessions.
+    '''
+    tasks = [(session, n_boot, quantiles, ci, None if seed is None else seed+i, baseline, end)
+             for i, session in enumerate(sessions)]
+    if processes == 1:
+        return [_bootstrapOne(task) for task in tasks]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_bootstrapOne, tasks, chunksize)
+    finally:
+        pool.close()
+        pool.join()
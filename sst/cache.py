@@ -0,0 +1,177 @@
+'''
+Cache of parsed reports for analysis scripts and notebooks.
+
+SessionCache.load(path) returns what preprocess.loadData returns, but parses
+a report only once:
+
+* in memory, an LRU of parsed sessions bounded by max_bytes;
+* on disk (optional), the DataFrame as a JSON header line and the raw float64
+  values, one file per report under cache_dir, named by its path.
+
+Both are keyed by (absolute path, size, mtime), plus a SHA-1 of the content
+with hash_content=True (for copies that keep their mtime), so a changed
+report is parsed again without any explicit invalidation. stats() gives hits,
+misses and load times.
+
+    from sst.cache import loadSession
+    df = loadSession('SST Report 2017-03-01 10-00.txt')['df']
+'''
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from sst.preprocess import loadData
+
+DISK_VERSION = 1
+
+
+def fileKey(path, hash_content=False):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if hash_content:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        key += (digest.hexdigest(),)
+    return key
+
+
+def sessionBytes(session):
+    df = session['df']
+    if all(dtype == np.float64 for dtype in df.dtypes):
+        size = 8*df.size   # memory_usage() takes as long as parsing a small report
+    else:
+        size = int(df.memory_usage(index=False, deep=True).sum())
+    return size + len(session['info'])
+
+
+class SessionCache(object):
+    '''
+    In-memory LRU and optional on-disk cache around a report loader.
+    '''
+    def __init__(self, max_bytes=256 << 20, cache_dir=None, hash_content=False, loader=loadData):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.hash_content = hash_content
+        self.loader = loader
+        self.entries = OrderedDict()   # key -> (session, bytes), least recently used first
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_time = {'hit': 0.0, 'disk': 0.0, 'miss': 0.0}
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def load(self, path):
+        '''
+        the session of a report, as preprocess.loadData; the DataFrame is a
+        copy, so changing it does not change the cache
+        '''
+        start = time.perf_counter()
+        key = fileKey(path, self.hash_content)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            session = self._copy(entry[0])
+            with self.lock:
+                self.load_time['hit'] += time.perf_counter() - start
+            return session
+
+        session = self._readDisk(key)
+        kind = 'disk' if session is not None else 'miss'
+        if session is None:
+            session = self.loader(path)
+            self._writeDisk(key, session)
+        with self.lock:
+            if kind == 'disk':
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+            self._insert(key, session)
+            self.load_time[kind] += time.perf_counter() - start
+        return self._copy(session)
+
+    @staticmethod
+    def _copy(session):
+        return {'info': session['info'], 'df': session['df'].copy()}
+
+    def _insert(self, key, session):
+        size = sessionBytes(session)
+        if size > self.max_bytes:
+            return
+        # drop older versions of the same report
+        for old in [old for old in self.entries if old[0] == key[0]]:
+            self.bytes -= self.entries.pop(old)[1]
+        self.entries[key] = (session, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def _diskPath(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key[0].encode()).hexdigest() + '.cache')
+
+    def _readDisk(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._diskPath(key), 'rb') as f:
+                header = json.loads(f.readline().decode())
+                if header['version'] != DISK_VERSION or header['key'] != list(key):
+                    return None
+                values = np.frombuffer(f.read(), dtype='<f8').reshape(-1, len(header['columns']))
+            return {'info': header['info'], 'df': pd.DataFrame(values.copy(), columns=header['columns'])}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _writeDisk(self, key, session):
+        if self.cache_dir is None:
+            return
+        df = session['df']
+        if not all(dtype == np.float64 for dtype in df.dtypes):
+            return   # only the float columns of loadData are cached on disk
+        header = {'version': DISK_VERSION, 'key': list(key), 'info': session['info'],
+                  'columns': [str(name) for name in df.columns]}
+        path = self._diskPath(key)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(json.dumps(header).encode() + b'\n')
+            f.write(np.ascontiguousarray(df.to_numpy(), dtype='<f8').tobytes())
+        os.replace(path + '.tmp', path)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        loads = self.hits + self.disk_hits + self.misses
+        return {'loads': loads, 'hits': self.hits, 'diskHits': self.disk_hits, 'misses': self.misses,
+                'hitRate': (self.hits + self.disk_hits)/loads if loads else 0.0,
+                'evictions': self.evictions, 'sessions': len(self.entries), 'bytes': self.bytes,
+                'meanMs': dict((kind, 1e3*self.load_time[kind]/count if count else 0.0) for kind, count in
+                               [('hit', self.hits), ('disk', self.disk_hits), ('miss', self.misses)])}
+
+
+DEFAULT_CACHE = SessionCache(cache_dir=os.environ.get('SST_CACHE_DIR'))
+
+
+def loadSession(path):
+    '''
+    preprocess.loadData through the default cache (on disk if SST_CACHE_DIR is set)
+    '''
+    return DEFAULT_CACHE.load(path)
@@ -0,0 +1,361 @@
+'''
+Compact storage of the event columns of a session.
+
+Reports keep the columns as text (str of tick/1.024 floats). This codec
+stores them as the integer ticks the board sent, with the tick to ms scale
+as metadata, so decoding gives back the same floats:
+
+* every column is cut into blocks of block_size values, each encoded on its
+  own so a trial block can be read without decoding the session;
+* a block is delta encoded (if that is smaller), zig-zag mapped to unsigned
+  and written as LEB128 varints or bit-packed at the width of its largest
+  value, whichever is smaller, then compressed (zlib or lzma) if that helps;
+* columns that are not integer ticks (video events, unknown codes, errors)
+  are kept as their repr in one compressed block.
+
+File layout: MAGIC, version byte, header length (uint32), zlib compressed JSON
+header (columns, their scale and the offsets of their blocks), blocks.
+
+    writeSession('session.sstz', data.get(), {'stage': 5})
+    session = readSession('session.sstz')
+    session['pokeInL']                  # all values, in ms
+    session.trials(101, 200)            # the columns of trials 101-200
+'''
+import os
+import ast
+import json
+import lzma
+import zlib
+import struct
+import bisect
+import argparse
+
+import numpy as np
+
+MAGIC = b'SSTZ'
+VERSION = 1
+TICK_MS = 1/1.024   # ms per board tick
+
+# columns of Data.get() in ms, stored as ticks
+TIME_COLUMNS = set(['pokeInL', 'pokeOutL', 'pokeInR', 'pokeOutR', 'pokeInM', 'pokeOutM',
+                    'rewardStart', 'stopSignalStart', 'SSDs', 'laserOn'])
+TRIAL_START = 'pokeInM'   # one per trial
+TRIAL_COLUMNS = set(['trialType', 'trialNum'])   # indexed by trial
+ALIGNED = {'isRewarded': 'rewardStart', 'SSDs': 'stopSignalStart'}   # same index as
+
+DELTA = 1      # block flags
+BITPACK = 2
+
+COMPRESSORS = {None: (lambda raw, level: raw, lambda raw: raw),
+               'zlib': (zlib.compress, zlib.decompress),
+               'lzma': (lambda raw, level: lzma.compress(raw, preset=level), lzma.decompress)}
+
+
+def zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def unzigzag(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64)
+
+
+def encodeVarints(values):
+    '''
+    LEB128 bytes of unsigned values, 7 bits per byte with the top bit set
+    on all but the last byte of a value
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        lengths += values >= np.uint64(1 << 7*k)
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    starts = np.cumsum(lengths) - lengths
+    for k in range(int(lengths.max()) if len(values) else 0):
+        more = lengths > k
+        byte = (values[more] >> np.uint64(7*k)) & np.uint64(0x7f)
+        byte |= np.where(lengths[more] > k+1, np.uint64(0x80), np.uint64(0))
+        out[starts[more] + k] = byte
+    return out.tobytes()
+
+
+def decodeVarints(raw):
+    data = np.frombuffer(raw, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.uint64)
+    last = data < 0x80
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    group = np.cumsum(last) - last
+    shift = (np.arange(len(data)) - starts[group])*7
+    terms = (data & 0x7f).astype(np.uint64) << shift.astype(np.uint64)
+    return np.bitwise_or.reduceat(terms, starts)
+
+
+def packBits(values):
+    '''
+    (width, bytes) of unsigned values at the bit width of the largest
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    width = int(values.max()).bit_length() if len(values) else 0
+    if not width:
+        return 0, b''
+    bits = (values[:, None] >> np.arange(width-1, -1, -1, dtype=np.uint64)) & np.uint64(1)
+    return width, np.packbits(bits.astype(np.uint8).ravel()).tobytes()
+
+
+def unpackBits(raw, width, count):
+    if not width:
+        return np.zeros(count, dtype=np.uint64)
+    bits = np.unpackbits(np.frombuffer(raw, dtype=np.uint8))[:count*width].reshape(count, width)
+    return (bits.astype(np.uint64) << np.arange(width-1, -1, -1, dtype=np.uint64)).sum(axis=1,
+                                                                                        dtype=np.uint64)
+
+
+def encodeBlock(values):
+    '''
+    smallest of delta/plain x varint/bit-packed for int64 values
+    '''
+    best = None
+    for flags, mapped in [(0, values), (DELTA, np.diff(np.concatenate(([0], values))))]:
+        unsigned = zigzag(mapped)
+        candidates = [(flags, encodeVarints(unsigned))]
+        width, packed = packBits(unsigned)
+        candidates.append((flags | BITPACK, bytes(bytearray([width])) + packed))
+        for candidate in candidates:
+            if best is None or len(candidate[1]) < len(best[1]):
+                best = candidate
+    return bytes(bytearray([best[0]])) + best[1]
+
+
+def decodeBlock(raw, count):
+    flags = raw[0]
+    if flags & BITPACK:
+        unsigned = unpackBits(raw[2:], raw[1], count)
+    else:
+        unsigned = decodeVarints(raw[1:])
+    values = unzigzag(unsigned)
+    if flags & DELTA:
+        values = np.cumsum(values)
+    return values
+
+
+def toTicks(values, scale):
+    '''
+    int64 ticks of values in units of scale, or None when they are not
+    exactly ticks (so nothing is lost by storing them as integers)
+    '''
+    if not all(isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+               for value in values):
+        return None
+    array = np.asarray(values, dtype=np.float64)
+    if not np.all(np.isfinite(array)):
+        return None
+    ticks = np.rint(array/scale).astype(np.int64)
+    if scale == 1:
+        exact = all(isinstance(value, (int, np.integer)) for value in values)
+    else:
+        exact = (np.asarray(fromTicks(ticks, scale)) == array).all()
+    return ticks if exact else None
+
+
+def fromTicks(ticks, scale):
+    if scale == 1:
+        return ticks.tolist()
+    if scale == TICK_MS:
+        return (ticks/1.024).tolist()   # the same floats as Data
+    return (ticks*scale).tolist()
+
+
+def encodeSession(columns, meta=None, block_size=128, compression='zlib', level=6):
+    '''
+    bytes of columns (name -> list, as Data.get()) and meta (JSON-able)
+    '''
+    compress = COMPRESSORS[compression][0]
+
+    def pack(raw):
+        # small blocks may not shrink; those are stored as they are
+        packed = compress(raw, level)
+        return (packed, 1) if len(packed) < len(raw) else (raw, 0)
+
+    header = {'compression': compression, 'blockSize': block_size, 'meta': meta or {},
+              'tickMs': TICK_MS, 'columns': []}
+    blobs = []
+    offset = 0
+    for name, values in columns.items():
+        values = list(values)
+        scale = TICK_MS if name in TIME_COLUMNS else 1
+        ticks = toTicks(values, scale) if values else np.zeros(0, dtype=np.int64)
+        if ticks is None and scale != 1:
+            scale = 1
+            ticks = toTicks(values, scale)
+        column = {'name': name, 'count': len(values), 'blocks': []}
+        if ticks is None:
+            column['kind'] = 'repr'
+            raw, packed = pack(repr(values).encode())
+            column['blocks'].append([offset, len(raw), len(values), None, None, packed])
+            blobs.append(raw)
+            offset += len(raw)
+        else:
+            column.update({'kind': 'ticks', 'scale': scale,
+                           'sorted': bool(len(ticks) < 2 or (np.diff(ticks) >= 0).all())})
+            for start in range(0, len(ticks), block_size):
+                block = ticks[start:start+block_size]
+                raw, packed = pack(encodeBlock(block))
+                column['blocks'].append([offset, len(raw), len(block), int(block[0]), int(block[-1]), packed])
+                blobs.append(raw)
+                offset += len(raw)
+        header['columns'].append(column)
+    head = zlib.compress(json.dumps(header, separators=(',', ':')).encode())
+    return MAGIC + bytes(bytearray([VERSION])) + struct.pack('<I', len(head)) + head + b''.join(blobs)
+
+
+class SessionReader(object):
+    '''
+    Columns of an encoded session, decoded block by block on access.
+    '''
+    def __init__(self, raw):
+        raw = memoryview(raw)
+        if bytes(raw[:4]) != MAGIC or raw[4] != VERSION:
+            raise ValueError('not an encoded session')
+        length = struct.unpack('<I', bytes(raw[5:9]))[0]
+        self.header = json.loads(zlib.decompress(bytes(raw[9:9+length])).decode())
+        self.meta = self.header['meta']
+        self.columns = dict((column['name'], column) for column in self.header['columns'])
+        self.names = [column['name'] for column in self.header['columns']]
+        self._blobs = raw[9+length:]
+        self._decompress = COMPRESSORS[self.header['compression']][1]
+
+    def _block(self, column, i):
+        offset, length, count, _, _, packed = column['blocks'][i]
+        raw = bytes(self._blobs[offset:offset+length])
+        if packed:
+            raw = self._decompress(raw)
+        if column['kind'] == 'repr':
+            return ast.literal_eval(raw.decode())
+        return decodeBlock(raw, count)
+
+    def ticks(self, name, start=0, stop=None):
+        '''
+        int64 array of values start:stop of a tick column, in ticks
+        '''
+        column = self.columns[name]
+        if column['kind'] != 'ticks':
+            raise ValueError('{0} is not stored as ticks'.format(name))
+        count = column['count']
+        stop = count if stop is None else max(start, min(stop, count))
+        size = self.header['blockSize']
+        blocks = [self._block(column, i) for i in range(start//size, (stop-1)//size + 1)] if stop > start else []
+        values = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int64)
+        first = (start//size)*size
+        return values[start-first:stop-first]
+
+    def values(self, name, start=0, stop=None):
+        '''
+        values start:stop of a column as Data.get() had them
+        '''
+        column = self.columns[name]
+        if column['kind'] == 'repr':
+            return self._block(column, 0)[start:stop]
+        return fromTicks(self.ticks(name, start, stop), column['scale'])
+
+    def search(self, name, tick):
+        '''
+        index of the first value >= tick of a sorted tick column
+        '''
+        column = self.columns[name]
+        if not column['sorted']:
+            raise ValueError('{0} is not sorted'.format(name))
+        lasts = [block[4] for block in column['blocks']]
+        i = bisect.bisect_left(lasts, tick)
+        if i == len(lasts):
+            return column['count']
+        block = self._block(column, i)
+        return i*self.header['blockSize'] + int(np.searchsorted(block, tick))
+
+    def trials(self, first, last):
+        '''
+        columns of trials first..last (numbered from 1): per trial columns by
+        index, sorted time columns between the start of trial first and of
+        trial last+1, aligned columns as their partner. Other columns are left
+        out.
+        '''
+        starts = self.columns[TRIAL_START]['count']
+        begin = self.ticks(TRIAL_START, first-1, first)
+        end = self.ticks(TRIAL_START, last, last+1)
+        begin = int(begin[0]) if len(begin) else None
+        end = int(end[0]) if len(end) else None
+        result = {}
+        ranges = {}
+        for name, column in self.columns.items():
+            if name in TRIAL_COLUMNS:
+                result[name] = self.values(name, first-1, last)
+            elif column['kind'] == 'ticks' and column['sorted'] and name not in ALIGNED:
+                if begin is None:
+                    ranges[name] = (column['count'], column['count'])
+                else:
+                    start = 0 if first == 1 else self.search(name, begin)
+                    stop = column['count'] if end is None or last >= starts else self.search(name, end)
+                    ranges[name] = (start, stop)
+                result[name] = self.values(name, *ranges[name])
+        for name, partner in ALIGNED.items():
+            if name in self.columns and partner in ranges:
+                result[name] = self.values(name, *ranges[partner])
+        return result
+
+    def __getitem__(self, name):
+        return self.values(name)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def get(self):
+        '''
+        all columns, as Data.get()
+        '''
+        return dict((name, self.values(name)) for name in self.names)
+
+
+def writeSession(path, columns, meta=None, **options):
+    with open(path, 'wb') as f:
+        f.write(encodeSession(columns, meta, **options))
+
+
+def readSession(path):
+    with open(path, 'rb') as f:
+        return SessionReader(f.read())
+
+
+def readReportColumns(path):
+    '''
+    (General Message line, columns) of a text report of sst_gui
+    '''
+    columns = {}
+    with open(path, 'r') as f:
+        f.readline()
+        header = f.readline().strip()
+        lines = f.read().split('\n')
+    for name, value in zip(lines[0::2], lines[1::2]):
+        try:
+            columns[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            columns[name] = value
+    return header, columns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sst.codec',
+                                     description='Convert text reports to encoded sessions (.sstz).')
+    parser.add_argument('reports', nargs='+')
+    parser.add_argument('--compression', default='zlib', choices=['zlib', 'lzma', 'none'])
+    args = parser.parse_args(argv)
+    compression = None if args.compression == 'none' else args.compression
+    for path in args.reports:
+        header, columns = readReportColumns(path)
+        target = path[:-4] + '.sstz' if path.endswith('.txt') else path + '.sstz'
+        writeSession(target, columns, {'generalMessage': header}, compression=compression)
+        print('{0}: {1} -> {2} bytes'.format(target, os.path.getsize(path), os.path.getsize(target)))
+
+
+if __name__ == '__main__':
+    main()
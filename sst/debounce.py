@@ -0,0 +1,120 @@
+'''
+Debouncing of nose-poke chatter between the decoder and Data.
+
+An infrared beam at the edge of breaking produces bursts of in/out pairs a
+tick or two apart. PokeDebouncer keeps one state machine per port (L, M, R):
+a stable state (out or in) and at most one candidate edge. An edge against
+the stable state becomes the candidate; the candidate is stored once no
+opposite edge came within the dwell time (by board time of later pokes),
+and an opposite edge within the dwell time cancels it. When a burst ends
+with the same edge it started with, the stored edge keeps the time of the
+first one, so a poke is timed by its first break of the beam. Repeated
+edges in the same direction are dropped. Events other than pokes pass
+through at once; a trial number (TN) first stores all candidates, so the
+trial is complete when the GUI updates.
+
+Per event the work is constant: three ports, no buffers. Raw and stored
+edges are counted per code.
+
+    debouncer = PokeDebouncer(data.write, dwell_ms=10)
+    SerialMonitor(data, connection, write=debouncer.write)
+'''
+from threading import Lock
+
+from sst.events import eventId, IL, OR, TN
+
+POKE_CODES = ['IL', 'OL', 'IM', 'OM', 'IR', 'OR']   # in event ID order, IL..OR = 1..6
+
+
+class PokeDebouncer(object):
+    '''
+    Streaming debouncer of poke events in front of a write function
+    '''
+    def __init__(self, write, dwell_ms=10.0):
+        self.store = write
+        self.dwell = dwell_ms*1.024          # board ticks
+        self.stable = [0, 0, 0]              # per port: 1 in, 0 out
+        self.candidate = [None]*3            # per port: (event, first time, direction)
+        self.cancelled = [None]*3            # per port: (direction, first time, time cancelled)
+        self.deadline = float('inf')         # earliest time a candidate is stored
+        self.raw = [0]*(OR+1)
+        self.stored = [0]*(OR+1)
+        self.lock = Lock()                   # flush() comes from the GUI thread
+
+    def write(self, event):
+        '''
+        as Data.write: 0 when a trial ended, else 1
+        '''
+        try:
+            event_id = event[2]
+        except IndexError:
+            event_id = eventId(event[0]) if len(event) == 2 else 0
+        with self.lock:
+            if not IL <= event_id <= OR:
+                if event_id == TN:
+                    self._commit(float('inf'))
+                return self.store(event)
+            self.raw[event_id] += 1
+            timestamp = event[1]
+            if timestamp >= self.deadline:
+                self._commit(timestamp)
+            port = (event_id - 1) >> 1
+            direction = event_id & 1
+            candidate = self.candidate[port]
+            if candidate is None:
+                if direction == self.stable[port]:
+                    return 1     # repeated edge
+                first = timestamp
+                cancelled = self.cancelled[port]
+                if cancelled is not None and cancelled[0] == direction and \
+                        timestamp - cancelled[2] < self.dwell:
+                    first = cancelled[1]    # same burst: keep the first edge
+                self.cancelled[port] = None
+                self.candidate[port] = (event, first, direction)
+                self.deadline = min(self.deadline, timestamp + self.dwell)
+            elif direction != candidate[2]:
+                # reverted within the dwell time: chatter
+                self.candidate[port] = None
+                self.cancelled[port] = (candidate[2], candidate[1], timestamp)
+                self._deadline()
+            return 1
+
+    def _deadline(self):
+        self.deadline = min([candidate[0][1] + self.dwell for candidate in self.candidate
+                             if candidate is not None] or [float('inf')])
+
+    def _commit(self, now):
+        '''
+        store the candidates whose dwell time ended by now, oldest first
+        '''
+        due = sorted((candidate[1], port) for port, candidate in enumerate(self.candidate)
+                     if candidate is not None and candidate[0][1] + self.dwell <= now)
+        for _, port in due:
+            event, first, direction = self.candidate[port]
+            self.candidate[port] = None
+            self.stable[port] = direction
+            event_id = IL + 2*port + (1 - direction)
+            self.stored[event_id] += 1
+            if first != event[1]:
+                event = (event[0], first) + tuple(event[2:])
+            self.store(event)
+        self._deadline()
+
+    def flush(self):
+        '''
+        store all candidates (end of the session)
+        '''
+        with self.lock:
+            self._commit(float('inf'))
+
+    def counts(self):
+        '''
+        {code: (raw edges, stored edges)}
+        '''
+        return dict((code, (self.raw[IL+i], self.stored[IL+i])) for i, code in enumerate(POKE_CODES))
+
+    def summary(self):
+        '''
+        raw/stored poke edges, for the report
+        '''
+        return '%d/%d' % (sum(self.raw), sum(self.stored))
@@ -0,0 +1,159 @@
+'''
+Columnar log of the raw event stream, in the order the events arrived, for
+the event log panel of the GUI.
+
+Every event is one row of three arrays: code (index into names), board
+ticks, and the trial it arrived in (the value of the last TN). The arrays
+grow by doubling. Per code, the rows of that code are kept as a sorted index,
+and the trial column never decreases, so the rows of some codes within a
+range of trials are found with np.searchsorted on the indexes; no scan over
+the log is needed.
+
+One writer (a Data listener in the serial thread) and any number of readers:
+rows are written before the length is published, and grown arrays replace
+the old ones only after the rows were copied, so a reader that took the
+length first finds every row below it.
+
+    log = EventLog()
+    data.listeners.append(log.on_event)
+    rows = log.select(codes=['IL', 'IR'], trials=(10, 20))
+    log.row(rows[0])      # (row, trial, code, ticks)
+'''
+import numpy as np
+
+TIMESTAMP_NONE = -1     # events without a time (decode errors)
+
+
+class GrowArray(object):
+    '''
+    append-only array, doubling its capacity
+    '''
+    def __init__(self, dtype, capacity=1024):
+        self.array = np.empty(capacity, dtype=dtype)
+        self.length = 0
+
+    def append(self, value):
+        array = self.array
+        if self.length == len(array):
+            grown = np.empty(2*len(array), dtype=array.dtype)
+            grown[:self.length] = array
+            self.array = array = grown
+        array[self.length] = value
+        self.length += 1
+
+    def view(self, length=None):
+        length = self.length if length is None else length
+        return self.array[:length]
+
+
+class EventLog(object):
+    '''
+    Rows of (code, ticks, trial) of every event, with an index of rows per code.
+    '''
+    def __init__(self, capacity=1 << 16):
+        self.names = []             # code index -> code string
+        self.code_index = {}        # code string -> code index
+        self.positions = []         # code index -> GrowArray of rows
+        self._state = (np.empty(capacity, dtype=np.uint16), np.empty(capacity, dtype=np.int64),
+                       np.empty(capacity, dtype=np.int32))
+        self.length = 0
+        self.trial = 0
+
+    def on_event(self, data_in):
+        '''
+        Data listener: (code, timestamp[, event ID])
+        '''
+        code = data_in[0]
+        timestamp = data_in[1] if len(data_in) > 1 else TIMESTAMP_NONE
+        index = self.code_index.get(code)
+        if index is None:
+            index = self._newCode(code)
+        if code == 'TN':
+            self.trial = timestamp
+        if not isinstance(timestamp, int):
+            timestamp = TIMESTAMP_NONE
+        row = self.length
+        codes, ticks, trials = self._state
+        if row == len(codes):
+            codes, ticks, trials = self._grow()
+        codes[row] = index
+        ticks[row] = timestamp
+        trials[row] = self.trial
+        self.positions[index].append(row)
+        self.length = row + 1
+
+    def _newCode(self, code):
+        index = len(self.names)
+        self.names.append(code)
+        self.positions.append(GrowArray(np.int64))
+        self.code_index[code] = index
+        return index
+
+    def _grow(self):
+        state = []
+        for array in self._state:
+            grown = np.empty(2*len(array), dtype=array.dtype)
+            grown[:self.length] = array[:self.length]
+            state.append(grown)
+        self._state = tuple(state)
+        return self._state
+
+    def __len__(self):
+        return self.length
+
+    def columns(self, length=None):
+        '''
+        (codes, ticks, trials) arrays of the first length rows
+        '''
+        length = self.length if length is None else length
+        codes, ticks, trials = self._state
+        return codes[:length], ticks[:length], trials[:length]
+
+    def rowRange(self, trials=None, length=None):
+        '''
+        [first, last) rows of the trials first..last (inclusive)
+        '''
+        length = self.length if length is None else length
+        if trials is None:
+            return 0, length
+        column = self.columns(length)[2]
+        # bounds of the column's type, or numpy converts the whole column
+        first, last = np.clip(trials, 0, np.iinfo(column.dtype).max).astype(column.dtype)
+        return (int(np.searchsorted(column, first, 'left')),
+                int(np.searchsorted(column, last, 'right')))
+
+    def select(self, codes=None, trials=None, start=0, length=None):
+        '''
+        sorted rows (from start on) of the given codes within the trial range
+        '''
+        length = self.length if length is None else length
+        low, high = self.rowRange(trials, length)
+        low = max(low, start)
+        if codes is None:
+            return np.arange(low, max(low, high), dtype=np.int64)
+        parts = []
+        for code in codes:
+            index = self.code_index.get(code)
+            if index is None:
+                continue
+            rows = self.positions[index].view()
+            bounds = np.searchsorted(rows, np.array([low, high], dtype=rows.dtype), 'left')
+            parts.append(rows[bounds[0]:bounds[1]])
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        if len(parts) == 1:
+            return parts[0].copy()
+        return np.sort(np.concatenate(parts), kind='mergesort')
+
+    def row(self, row):
+        '''
+        (row, trial, code, ticks) of one row
+        '''
+        codes, ticks, trials = self._state
+        return row, int(trials[row]), self.names[codes[row]], int(ticks[row])
+
+    def counts(self):
+        '''
+        {code: rows}
+        '''
+        return dict((name, self.positions[index].length) for index, name in enumerate(self.names))
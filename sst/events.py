@@ -0,0 +1,56 @@
+'''
+Event codes of the serial protocol as small integer IDs.
+
+A packet's 2-byte code is read as one little-endian 16-bit number and looked
+up in two precomputed 65,536-entry tables: EVENT_ID gives the ID that
+selects the store of Data, EVENT_NAME the (shared) code string passed to
+listeners. No bytes are decoded per packet.
+'''
+UNKNOWN = 0
+IL, OL, IM, OM, IR, OR = 1, 2, 3, 4, 5, 6
+SS, RS, TT, SD, TS, TN = 7, 8, 9, 10, 11, 12
+GE, SE, S_PLUS, S_MINUS = 13, 14, 15, 16
+SQ, SU, AK, NK = 17, 18, 19, 20
+LASER = 21              # 'L' + any byte
+VIDEO = 22              # 'V'/'v' + region, from the motion detector
+UNICODE_ERROR = 23      # code that is not valid text
+DATA_LENGTH_ERROR = 24
+N_EVENTS = 25
+
+CODES = {'IL': IL, 'OL': OL, 'IM': IM, 'OM': OM, 'IR': IR, 'OR': OR,
+         'SS': SS, 'RS': RS, 'TT': TT, 'SD': SD, 'TS': TS, 'TN': TN,
+         'GE': GE, 'SE': SE, 'S+': S_PLUS, 'S-': S_MINUS,
+         'SQ': SQ, 'SU': SU, 'AK': AK, 'NK': NK,
+         'UnicodeError': UNICODE_ERROR, 'DataLengthError': DATA_LENGTH_ERROR}
+
+
+def eventId(name):
+    '''
+    ID of a code string, for events that did not come through the decoder
+    '''
+    event_id = CODES.get(name)
+    if event_id is not None:
+        return event_id
+    if name[:1] == 'L':   # also the LH error 'LE', laser events were always matched first
+        return LASER
+    if name[:1] in ('V', 'v'):
+        return VIDEO
+    return UNKNOWN
+
+
+def _tables():
+    ids = [UNKNOWN]*65536
+    names = [None]*65536
+    for code in range(65536):
+        raw = bytes(bytearray([code & 255, code >> 8]))
+        try:
+            name = raw.decode()
+        except UnicodeDecodeError:
+            names[code] = 'UnicodeError'
+            ids[code] = UNICODE_ERROR
+            continue
+        names[code] = name
+        ids[code] = eventId(name)
+    return ids, names
+
+EVENT_ID, EVENT_NAME = _tables()
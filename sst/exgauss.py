@@ -0,0 +1,218 @@
+'''
+Ex-Gaussian fits of RT distributions and a parametric race-model SSRT.
+
+Many sessions are fitted at once: the RTs are padded into a (sessions x
+trials) matrix with a mask, the log-likelihood and its analytic gradient are
+evaluated for all sessions in one pass, and every session takes its own
+damped Newton (Levenberg-Marquardt) step per iteration. The parameters are
+optimised as (mu, log sigma, log tau) so sigma and tau stay positive.
+
+The parametric SSRT assumes a constant stop process racing the fitted go
+distribution: P(respond | SSD) = F_go(SSD + SSRT), and the SSRT is the value
+for which the mean of that over the stop trials equals the observed
+probability of responding.
+'''
+import numpy as np
+from scipy.special import log_ndtr, ndtr
+
+LOG_SQRT_2PI = 0.5*np.log(2*np.pi)
+
+
+def padRTs(samples):
+    '''
+    return (x, mask) with one row per session, padding with the row mean
+    '''
+    samples = [np.asarray(s, dtype=float) for s in samples]
+    width = max(len(s) for s in samples)
+    x = np.empty((len(samples), width))
+    mask = np.zeros((len(samples), width))
+    for i, s in enumerate(samples):
+        x[i, :len(s)] = s
+        x[i, len(s):] = s.mean() if len(s) else 0
+        mask[i, :len(s)] = 1
+    return x, mask
+
+
+def exgaussLogPdf(x, mu, sigma, tau):
+    z = (x-mu)/sigma - sigma/tau
+    return -np.log(tau) + (mu-x)/tau + sigma**2/(2*tau**2) + log_ndtr(z)
+
+
+def exgaussCdf(x, mu, sigma, tau):
+    u = (x-mu)/sigma
+    log_tail = -(x-mu)/tau + sigma**2/(2*tau**2) + log_ndtr(u - sigma/tau)
+    return ndtr(u) - np.exp(log_tail)
+
+
+def logLikelihood(theta, x, mask):
+    '''
+    log-likelihood of every session, theta is (sessions x 3) of
+    (mu, log sigma, log tau)
+    '''
+    mu, sigma, tau = theta[:, 0:1], np.exp(theta[:, 1:2]), np.exp(theta[:, 2:3])
+    return (exgaussLogPdf(x, mu, sigma, tau)*mask).sum(axis=1)
+
+
+def gradient(theta, x, mask):
+    '''
+    analytic gradient of logLikelihood with respect to theta, (sessions x 3)
+    '''
+    mu, sigma, tau = theta[:, 0:1], np.exp(theta[:, 1:2]), np.exp(theta[:, 2:3])
+    z = (x-mu)/sigma - sigma/tau
+    # inverse Mills ratio phi(z)/Phi(z), computed in logs for large -z
+    mills = np.exp(-0.5*z**2 - LOG_SQRT_2PI - log_ndtr(z))
+    d_mu = 1/tau - mills/sigma
+    d_sigma = sigma/tau**2 - mills*((x-mu)/sigma**2 + 1/tau)
+    d_tau = -1/tau + (x-mu)/tau**2 - sigma**2/tau**3 + mills*sigma/tau**2
+    grad = np.empty(theta.shape)
+    grad[:, 0] = (d_mu*mask).sum(axis=1)
+    grad[:, 1] = (d_sigma*mask).sum(axis=1)*sigma[:, 0]
+    grad[:, 2] = (d_tau*mask).sum(axis=1)*tau[:, 0]
+    return grad
+
+
+def momentsStart(x, mask):
+    '''
+    starting values from the method of moments
+    '''
+    n = mask.sum(axis=1)
+    mean = (x*mask).sum(axis=1)/n
+    dev = (x-mean[:, None])*mask
+    sd = np.sqrt((dev**2).sum(axis=1)/n)
+    skew = (dev**3).sum(axis=1)/n/sd**3
+    tau = sd*np.cbrt(np.clip(skew, 0.1, 1.9)/2)
+    sigma = np.sqrt(np.maximum(sd**2 - tau**2, (0.1*sd)**2))
+    return np.column_stack([mean-tau, np.log(sigma), np.log(tau)])
+
+
+def fitExGaussian(samples, max_iter=100, tol=1e-6):
+    '''
+    Fit an ex-Gaussian to every sample in one batch.
+
+    Parameters
+    ----------
+    samples: list of 1-D arrays of RTs (one per session, lengths may differ).
+    max_iter: maximum Newton iterations.
+    tol: stop when no parameter moves more than tol.
+
+    Returns
+    -------
+    fit: Dictionary
+        'mu', 'sigma', 'tau' arrays, 'logLik', 'converged' (bool array)
+        and 'iterations'.
+    '''
+    x, mask = padRTs(samples)
+    theta = momentsStart(x, mask)
+    n = len(theta)
+    damping = np.full(n, 1e-3)
+    converged = np.zeros(n, dtype=bool)
+    done = np.zeros(n, dtype=bool)
+    eye = np.eye(3)
+    steps = np.array([1e-4, 1e-5, 1e-5])
+    # trial steps far out overflow; they are rejected by the finite checks
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        ll = logLikelihood(theta, x, mask)
+        for iteration in range(max_iter):
+            active = ~done
+            if not active.any():
+                break
+            index = np.flatnonzero(active)
+            t, xa, ma = theta[active], x[active], mask[active]
+            g = gradient(t, xa, ma)
+            # Hessian from forward differences of the analytic gradient
+            h = steps*np.maximum(1, np.abs(t))
+            hess = np.empty((len(t), 3, 3))
+            for j in range(3):
+                shifted = t.copy()
+                shifted[:, j] += h[:, j]
+                hess[:, :, j] = (gradient(shifted, xa, ma) - g)/h[:, j:j+1]
+            hess = 0.5*(hess + hess.transpose(0, 2, 1))
+            finite = np.isfinite(g).all(axis=1) & np.isfinite(hess).all(axis=(1, 2))
+            done[index[~finite]] = True
+            g[~finite] = 0
+            hess[~finite] = -eye
+            # ascend: (lambda*scale*I - H) step = g
+            scale = np.maximum(1, np.abs(hess).max(axis=(1, 2)))
+            system = (damping[active]*scale)[:, None, None]*eye - hess
+            step = np.linalg.solve(system, g[:, :, None])[:, :, 0]
+            candidate = t + step
+            new_ll = logLikelihood(candidate, xa, ma)
+            better = finite & np.isfinite(new_ll) & (new_ll >= ll[active])
+            accepted = index[better]
+            theta[accepted] = candidate[better]
+            ll[accepted] = new_ll[better]
+            damping[accepted] = np.maximum(damping[accepted]/10, 1e-9)
+            damping[index[~better]] *= 10
+            small = finite & (np.abs(step).max(axis=1) < tol)
+            converged[index[small]] = True
+            done[index[small | (damping[index] > 1e9)]] = True
+
+    return {'mu': theta[:, 0], 'sigma': np.exp(theta[:, 1]), 'tau': np.exp(theta[:, 2]),
+            'logLik': ll, 'converged': converged, 'iterations': iteration+1}
+
+
+def raceSSRT(fit, ssds, p_respond, low=-1000.0, high=2000.0, iterations=60):
+    '''
+    Parametric SSRT of every session from its fitted go distribution.
+
+    fit: result of fitExGaussian on the go RTs.
+    ssds: list of SSD arrays of the stop trials, one per session.
+    p_respond: observed probability of responding on stop trials per session.
+    Returns an array of SSRTs (nan when p_respond is outside the range the
+    go distribution can reach).
+    '''
+    d, mask = padRTs(ssds)
+    mu, sigma, tau = fit['mu'][:, None], fit['sigma'][:, None], fit['tau'][:, None]
+    n = mask.sum(axis=1)
+    p_respond = np.asarray(p_respond, dtype=float)
+
+    def predicted(ssrt):
+        return (exgaussCdf(d + ssrt[:, None], mu, sigma, tau)*mask).sum(axis=1)/n
+
+    lo = np.full(len(n), low)
+    hi = np.full(len(n), high)
+    # the predicted probability grows with SSRT: bisect every session at once
+    for _ in range(iterations):
+        mid = 0.5*(lo+hi)
+        above = predicted(mid) > p_respond
+        hi = np.where(above, mid, hi)
+        lo = np.where(above, lo, mid)
+    ssrt = 0.5*(lo+hi)
+    reachable = (predicted(np.full(len(n), low)) <= p_respond) & (predicted(np.full(len(n), high)) >= p_respond)
+    return np.where(reachable, ssrt, np.nan)
+
+
+def sessionRTs(data, baseline=20, end=320):
+    '''
+    go RTs, signal-respond RTs, stop-trial SSDs and probability of
+    responding on stop trials from a DataFrame of preprocess.loadData
+    '''
+    data = data.iloc[baseline:end]
+    go = (data['TrialType']==1) & (data['IsRewarded']==1)
+    if data.loc[go, 'PokeInR'].iloc[0] > data.loc[go, 'PokeInL'].iloc[0]:
+        rt = data['PokeInR'] - data['PokeOutL']
+    else:
+        rt = data['PokeInL'] - data['PokeOutR']
+    stop = data['TrialType']==2
+    responded = stop & (data['IsRewarded']==0)
+    return (np.asarray(rt[go], dtype=float), np.asarray(rt[responded & (rt > 0)], dtype=float),
+            np.asarray(data.loc[stop, 'SSDs'], dtype=float),
+            float(responded.sum())/max(stop.sum(), 1))
+
+
+def fitSessions(sessions):
+    '''
+    Fit go and signal-respond RTs of many sessions and estimate the
+    parametric SSRT.
+
+    sessions: list of (go_rt, signal_respond_rt, ssd, p_respond), e.g. from
+    sessionRTs. Returns a dict with 'go' and 'signalRespond' fits and 'ssrt'.
+    Signal-respond fits of sessions with less than 3 RTs are nan.
+    '''
+    go = fitExGaussian([s[0] for s in sessions])
+    enough = np.array([len(s[1]) > 2 for s in sessions])
+    signal_respond = fitExGaussian([s[1] if len(s[1]) > 2 else s[0] for s in sessions])
+    for key in ['mu', 'sigma', 'tau', 'logLik']:
+        signal_respond[key] = np.where(enough, signal_respond[key], np.nan)
+    ssrt = raceSSRT(go, [s[2] for s in sessions], [s[3] for s in sessions])
+    return {'go': go, 'signalRespond': signal_respond, 'ssrt': ssrt}
@@ -4,6 +4,13 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
+# report keys written by sst_gui.saveData (Data.get) -> keys of older reports
+KEY_ALIASES = {'pokeInL':'PokeInL', 'pokeOutL':'PokeOutL', 'pokeInR':'PokeInR',
+               'pokeOutR':'PokeOutR', 'pokeInM':'PokeInM', 'pokeOutM':'PokeOutM',
+               'rewardStart':'RewardStart', 'stopSignalStart':'StopSignalStart',
+               'isRewarded':'IsRewarded', 'trialType':'TrialType',
+               'trialsSkipped':'Trials Skipped', 'laserOn':'Laser ON Timestamps'}
+
 def loadData(file_name):
     data = {}
     with open(file_name, 'r') as f:
@@ -14,11 +21,25 @@ def loadData(file_name):
         lines = f.readlines()
         for i in range(len(lines)):
             if i%2==0:
-                if len(lines[i+1])>2:
+                if len(lines[i+1].strip())>2:   # not '[]'
                     data[lines[i][:-1]] = [s.strip() for s in lines[i+1][1:-2].split(',')]
                 else:
                     data[lines[i][:-1]] = []
 
+    return_data = {'info':data['General Message'],
+                   'df':toDataFrame(data)}
+                   #'laser':np.array(data['Laser ON Timestamps'], dtype=float)}
+
+    return return_data
+
+def toDataFrame(data):
+    '''
+    one row per trial from the event lists of a report or of Data.get()
+    '''
+    data = dict(data)
+    for key, alias in KEY_ALIASES.items():
+        if key in data:
+            data[alias] = data.pop(key)
     df = pd.DataFrame({'PokeOutR':data['PokeOutR'], 'PokeInR':data['PokeInR'],
                         'PokeInL':data['PokeInL'], 'PokeOutL':data['PokeOutL'],
                         'IsRewarded':data['IsRewarded'],
@@ -30,28 +51,24 @@ def loadData(file_name):
                         dtype=float)
     if len(data['Trials Skipped'])>0:
         stop_skipped = np.array(data['Trials Skipped'], dtype=int)-1 # index starts from 0.
-        df.ix[stop_skipped, 'TrialType'] = 1
+        df.loc[stop_skipped, 'TrialType'] = 1
     if len(data['StopSignalStart'])>0:
-        df.ix[df['TrialType']==2, 'StopSignalStart'] = np.array(data['StopSignalStart'], dtype=float)
-        df.ix[df['TrialType']==2, 'SSDs'] = np.array(data['SSDs'], dtype=float)
-    return_data = {'info':data['General Message'],
-                   'df':df}
-                   #'laser':np.array(data['Laser ON Timestamps'], dtype=float)}
-
-    return return_data
+        df.loc[df['TrialType']==2, 'StopSignalStart'] = np.array(data['StopSignalStart'], dtype=float)
+        df.loc[df['TrialType']==2, 'SSDs'] = np.array(data['SSDs'], dtype=float)
+    return df
 
 def calCorRate(data, baseline=20, end=320):
     data = data.iloc[baseline:end]
-    total_go = sum(data.ix[data['TrialType']==1, 'TrialType'])
-    correct_go = sum(data.ix[(data['TrialType']==1) & (data['IsRewarded']==1), 'TrialType'])
-    total_stop = sum(data.ix[data['TrialType']==2, 'TrialType'])
-    correct_stop = sum(data.ix[(data['TrialType']==2) & (data['IsRewarded']==1), 'TrialType'])
+    total_go = sum(data.loc[data['TrialType']==1, 'TrialType'])
+    correct_go = sum(data.loc[(data['TrialType']==1) & (data['IsRewarded']==1), 'TrialType'])
+    total_stop = sum(data.loc[data['TrialType']==2, 'TrialType'])
+    correct_stop = sum(data.loc[(data['TrialType']==2) & (data['IsRewarded']==1), 'TrialType'])
     return (correct_go/total_go, correct_stop/total_stop)
 
 def calSSRT(data, baseline=20, end=320):#left-right-middle
     stopcorrect=calCorRate(data, baseline, end)[1]
     data = data.iloc[baseline:end]
-    correct_go = data.ix[(data['TrialType']==1) & (data['IsRewarded']==1)]
+    correct_go = data.loc[(data['TrialType']==1) & (data['IsRewarded']==1)]
 
     pokeR = pd.Series(correct_go['PokeInR'])
     pokeL = pd.Series(correct_go['PokeInL'])
@@ -78,6 +95,56 @@ def calSSRT2(data, baseline=20, block_length=100, block_num=3, isCorrect=False):
     ssrts = []
     # calculate SSRT block wise
     for i in range(block_num):
-        temp_data = data.ix[i*block_length:(i+1)*block_length]
+        temp_data = data.loc[i*block_length:(i+1)*block_length]
         ssrts.append(calSSRT(temp_data, baseline=0,end=block_length))
     return sum(ssrts)/len(ssrts)
+
+def calSSRTBulk(rt, trial_type, is_rewarded, ssd, baseline=20, end=320):
+    '''
+    calSSRT for many sessions at once.
+
+    rt, trial_type, is_rewarded, ssd: (sessions x trials) arrays, rt is the
+    go RT of the trial (any value where there is none), ssd is 0 on trials
+    without a stop signal. Returns an array of SSRTs, nan where calSSRT
+    would fail (no correct go or no stop trial).
+    '''
+    rt = np.asarray(rt, dtype=float)[:, baseline:end]
+    trial_type = np.asarray(trial_type)[:, baseline:end]
+    is_rewarded = np.asarray(is_rewarded)[:, baseline:end]
+    ssd = np.asarray(ssd, dtype=float)[:, baseline:end]
+
+    correct_go = (trial_type==1) & (is_rewarded==1)
+    stop = trial_type==2
+    n_stop = stop.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stop_correct = (stop & (is_rewarded==1)).sum(axis=1) / n_stop
+        has_ssd = ssd > 0
+        ssd_mean = np.where(has_ssd, ssd, 0).sum(axis=1) / has_ssd.sum(axis=1)
+
+    # correct go RTs sorted first in every row, the rest (inf) after them
+    gort = np.sort(np.where(correct_go, rt, np.inf), axis=1)
+    n_go = correct_go.sum(axis=1)
+    k = np.floor(n_go*(1-np.nan_to_num(stop_correct))).astype(np.int64)
+    k = np.clip(k, 0, np.maximum(n_go-1, 0))
+    T = gort[np.arange(len(gort)), k]
+    ssrt = T - ssd_mean
+    ssrt[(n_go == 0) | (n_stop == 0)] = np.nan
+    return ssrt
+
+def calSSRT2Bulk(rt, trial_type, is_rewarded, ssd, baseline=20, block_length=100, block_num=3):
+    '''
+    calSSRT2 for many sessions at once, arrays as in calSSRTBulk.
+
+    calSSRT2 selects blocks with label based .loc slicing on the original
+    trial index, so block i covers trials max(i*block_length, baseline)
+    up to (i+1)*block_length inclusive, cut to block_length trials. The
+    same blocks are used here.
+    '''
+    ssrts = []
+    for i in range(block_num):
+        start = max(i*block_length, baseline)
+        stop = min(start+block_length, (i+1)*block_length+1)
+        ssrts.append(calSSRTBulk(np.asarray(rt)[:, start:stop], np.asarray(trial_type)[:, start:stop],
+                                 np.asarray(is_rewarded)[:, start:stop], np.asarray(ssd)[:, start:stop],
+                                 baseline=0, end=block_length))
+    return sum(ssrts)/len(ssrts)
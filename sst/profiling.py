@@ -0,0 +1,396 @@
+'''
+Profiling of a running session: where the time of every thread goes and
+what keeps allocating memory.
+
+A sampling thread reads the stack of every other thread (sys._current_frames)
+at a fixed interval and charges the sample to the thread and to a subsystem,
+by the innermost frame of the package (see SUBSYSTEMS): serial, temp save,
+gui, gui redraw, video, collector, or idle for a thread waiting on a lock,
+a socket or a queue. Where threads have CPU clocks (Linux, macOS), the CPU
+time a thread used since the last sample is charged to the subsystem too,
+and a sample without CPU time counts as idle (a thread in time.sleep or a
+blocking read looks busy on its stack). The thread that starts the profiler (the GUI thread)
+also runs under cProfile, for exact call counts of trialEndUpdate and the
+redraws. tracemalloc snapshots are taken periodically together with the
+lengths of watched lists (the columns of Data), so growth shows up as the
+allocation sites and columns that keep getting bigger.
+
+stop(directory) writes the bundle:
+
+    summary.txt       subsystems and threads, top functions, memory growth
+    profile.json      the same as numbers, with the memory timeline
+    gui.prof          cProfile of the GUI thread (pstats.Stats('gui.prof'))
+    memory.snapshot   last tracemalloc snapshot (tracemalloc.Snapshot.load)
+
+    sst-gui --profile            # bundle next to each report
+    python -m sst.profiling --out prof sst.sst_collector:main -- --root D:/lab
+'''
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import argparse
+import importlib
+import threading
+import tracemalloc
+from collections import defaultdict, Counter
+
+PACKAGE = os.path.dirname(os.path.abspath(__file__))
+
+# (module, function or None for all) -> subsystem, checked from the
+# innermost frame of the package outwards
+SUBSYSTEMS = [(('Data', 'save'), 'temp save'), (('Data', 'clear_temp'), 'temp save'),
+              (('Data', None), 'serial'), (('SerialConnection', None), 'serial'),
+              (('SerialMonitor', None), 'serial'), (('sst_protocol', None), 'serial'),
+              (('schedule', None), 'serial'),
+              (('sst_gui', 'update_figure'), 'gui redraw'), (('sst_gui', 'reset'), 'gui redraw'),
+              (('psth', None), 'gui redraw'), (('sst_gui', None), 'gui'),
+              (('sst_server', None), 'video'), (('sst_recorder', None), 'video'),
+              (('sst_motion', None), 'video'), (('sst_video', None), 'video'),
+              (('sst_mosaic', None), 'video'), (('sst_collector', None), 'collector'),
+              (('sst_archive', None), 'collector')]
+# innermost frames of a thread that waits
+IDLE = set([('threading', 'wait'), ('threading', '_wait_for_tstate_lock'), ('selectors', 'select'),
+            ('socketserver', 'serve_forever'), ('socket', 'accept'), ('queue', 'get'),
+            ('sst_gui', 'main')])
+
+
+def moduleName(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def threadClock(ident):
+    '''
+    CPU clock of a thread, None where there are none (Windows)
+    '''
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError):
+        return None
+
+
+def subsystem(stack):
+    '''
+    subsystem of a stack of (module, function, in package) from the innermost
+    frame, 'idle' or 'other'
+    '''
+    if stack and stack[0][:2] in IDLE:
+        return 'idle'
+    rules = dict(SUBSYSTEMS)
+    for module, function, own in stack:
+        if own:
+            name = rules.get((module, function)) or rules.get((module, None))
+            if name is not None:
+                return name
+    return 'other'
+
+
+class SessionProfiler(object):
+    '''
+    Sample profiler of all threads with cProfile of the calling thread and
+    periodic tracemalloc snapshots.
+    '''
+    def __init__(self, interval=0.01, memory_interval=30.0, memory_frames=1, top=25):
+        self.interval = interval
+        self.memory_interval = memory_interval
+        self.memory_frames = memory_frames
+        self.top = top
+        self.watched = {}       # name -> callable returning {list name: length}
+        self.samples = 0
+        self.threads = defaultdict(Counter)     # thread -> subsystem -> samples
+        self.subsystems = Counter()
+        self.cpu = Counter()                    # subsystem -> CPU seconds
+        self.thread_cpu = Counter()             # thread -> CPU seconds
+        self.clocks = {}                        # ident -> (clock, CPU time at last sample)
+        self.self_counts = Counter()            # function -> busy samples as innermost frame
+        self.total_counts = Counter()           # function -> busy samples anywhere on the stack
+        self.function_subsystem = {}
+        self.memory = []                        # timeline of memory samples
+        self.first_snapshot = None
+        self.last_snapshot = None
+        self.profile = cProfile.Profile()
+        self.alive = False
+        self.thread = None
+        self.start_time = 0.0
+        self.sample_time = 0.0                  # CPU of the sampler itself
+        self.memory_time = 0.0                  # CPU of the memory snapshots
+
+    def watch(self, name, lengths):
+        '''
+        record lengths() ({name: length}) with every memory snapshot
+        '''
+        self.watched[name] = lengths
+
+    def watchData(self, data, name='Data'):
+        '''
+        watch the columns and listeners of a sst.Data
+        '''
+        def lengths():
+            result = dict((column, len(values)) for column, values in data.columns)
+            result['listeners'] = len(data.listeners)
+            return result
+        self.watch(name, lengths)
+
+    def start(self):
+        self.alive = True
+        self.start_time = time.time()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.memory_frames)
+        self._memorySample()
+        self.profile.enable()
+        self.thread = threading.Thread(target=self._run, name='SessionProfiler')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def _threadName(self, ident, frame, names):
+        name = names.get(ident)
+        if name is not None and not name.startswith('Dummy'):
+            return name
+        # threads not started by threading (QThread): outermost method of the package
+        outer = None
+        while frame is not None:
+            if frame.f_code.co_filename.startswith(PACKAGE):
+                outer = frame
+            frame = frame.f_back
+        if outer is None:
+            return 'thread-%d' % ident
+        owner = outer.f_locals.get('self')
+        function = outer.f_code.co_name
+        return '%s.%s' % (type(owner).__name__, function) if owner is not None else function
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            keys = []
+            leaf = frame
+            while frame is not None and len(stack) < 64:
+                code = frame.f_code
+                stack.append((moduleName(code.co_filename), code.co_name,
+                              code.co_filename.startswith(PACKAGE)))
+                keys.append('%s:%s:%d' % (moduleName(code.co_filename), code.co_name, code.co_firstlineno))
+                frame = frame.f_back
+            name = subsystem(stack)
+            thread = self._threadName(ident, leaf, names)
+            used = self._cpuUsed(ident)
+            if used is not None:
+                if used == 0:
+                    name = 'idle'
+                self.cpu[name] += used
+                self.thread_cpu[thread] += used
+            self.threads[thread][name] += 1
+            self.subsystems[name] += 1
+            if name != 'idle':
+                self.self_counts[keys[0]] += 1
+                for key in set(keys):
+                    self.total_counts[key] += 1
+                self.function_subsystem.setdefault(keys[0], name)
+        self.samples += 1
+
+    def _cpuUsed(self, ident):
+        '''
+        CPU seconds of a thread since its last sample, None without a clock
+        '''
+        clock, last = self.clocks.get(ident, (None, None))
+        if clock is None:
+            clock = threadClock(ident)
+            if clock is None:
+                self.clocks[ident] = (None, None)
+                return None
+        try:
+            now = time.clock_gettime(clock)
+        except OSError:   # thread ended
+            self.clocks.pop(ident, None)
+            return None
+        self.clocks[ident] = (clock, now)
+        return 0.0 if last is None else now - last
+
+    def _memorySample(self):
+        # statistics of a snapshot take seconds, so they are computed in stop();
+        # here only the snapshot, the traced size and the watched lengths
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        entry = {'time': time.time() - self.start_time, 'traced': current, 'peak': peak}
+        for name, lengths in self.watched.items():
+            entry[name] = lengths()
+        self.memory.append(entry)
+        if self.first_snapshot is None:
+            self.first_snapshot = snapshot
+        self.last_snapshot = snapshot
+
+    def _run(self):
+        next_sample = time.time()
+        next_memory = next_sample + self.memory_interval
+        cpu = getattr(time, 'thread_time', time.perf_counter)   # without waiting for the GIL
+        while self.alive:
+            start = cpu()
+            self._sample()
+            self.sample_time += cpu() - start
+            if time.time() >= next_memory:
+                start = cpu()
+                self._memorySample()
+                self.memory_time += cpu() - start
+                next_memory += self.memory_interval
+            next_sample += self.interval
+            delay = next_sample - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_sample = time.time()
+
+    def stop(self, directory=None):
+        '''
+        stop profiling; write the bundle to directory if given and return
+        the summary
+        '''
+        self.profile.disable()
+        self.alive = False
+        if self.thread is not None:
+            self.thread.join()
+        self._memorySample()
+        tracemalloc.stop()
+        result = self.result()
+        if directory is not None:
+            self.write(directory, result)
+        return result
+
+    @staticmethod
+    def _sites(statistics, top):
+        own = (tracemalloc.__file__, __file__)
+        return [stat for stat in statistics if stat.traceback[0].filename not in own][:top]
+
+    def growth(self):
+        '''
+        [(site, size difference, count difference)] between the first and
+        last memory snapshot, largest growth first
+        '''
+        if self.first_snapshot is None or self.last_snapshot is self.first_snapshot:
+            return []
+        return [(str(stat.traceback[0]), stat.size_diff, stat.count_diff)
+                for stat in self._sites(self.last_snapshot.compare_to(self.first_snapshot, 'lineno'), self.top)]
+
+    def sites(self):
+        '''
+        [(site, size, count)] of the largest allocations in the last snapshot
+        '''
+        if self.last_snapshot is None:
+            return []
+        return [(str(stat.traceback[0]), stat.size, stat.count)
+                for stat in self._sites(self.last_snapshot.statistics('lineno'), self.top)]
+
+    def result(self):
+        duration = time.time() - self.start_time
+        busy = dict((name, count) for name, count in self.subsystems.items() if name != 'idle')
+        return {'duration': duration, 'interval': self.interval, 'samples': self.samples,
+                'samplerOverhead': self.sample_time/max(duration, 1e-9),
+                'memoryOverhead': self.memory_time/max(duration, 1e-9),
+                'subsystems': dict(self.subsystems), 'busy': busy,
+                'cpu': dict(self.cpu), 'threadCpu': dict(self.thread_cpu),
+                'threads': dict((name, dict(counts)) for name, counts in self.threads.items()),
+                'selfTop': [(key, count, self.function_subsystem.get(key))
+                            for key, count in self.self_counts.most_common(self.top)],
+                'totalTop': self.total_counts.most_common(self.top),
+                'memory': self.memory, 'growth': self.growth(), 'sites': self.sites()}
+
+    def summary(self, result):
+        samples = max(result['samples'], 1)
+        cpu = result['cpu']
+        lines = ['Session profile: %.0f s, %d samples every %.0f ms (sampler %.1f%% CPU, '
+                 'memory snapshots %.1f%%)' % (result['duration'], result['samples'], 1e3*result['interval'],
+                                               100*result['samplerOverhead'], 100*result['memoryOverhead']),
+                 '', 'Subsystems (threads per sample%s):' % (', CPU seconds' if cpu else '')]
+        for name, count in sorted(result['subsystems'].items(), key=lambda item: -item[1]):
+            line = '  %-12s %6.2f  (%d samples)' % (name, count/float(samples), count)
+            if cpu and name != 'idle':
+                line += '  %8.2f s CPU' % cpu.get(name, 0.0)
+            lines.append(line)
+        lines += ['', 'Threads (share of samples):']
+        for thread, counts in sorted(result['threads'].items()):
+            total = sum(counts.values())
+            parts = ', '.join('%s %.0f%%' % (name, 100.0*count/total)
+                              for name, count in sorted(counts.items(), key=lambda item: -item[1]))
+            if thread in result['threadCpu']:
+                parts += '; %.2f s CPU' % result['threadCpu'][thread]
+            lines.append('  %-30s %s' % (thread, parts))
+        lines += ['', 'Top functions, innermost frame (busy samples):']
+        for key, count, name in result['selfTop']:
+            lines.append('  %6d  %-12s %s' % (count, name, key))
+        lines += ['', 'Top functions, anywhere on the stack (busy samples):']
+        for key, count in result['totalTop']:
+            lines.append('  %6d  %s' % (count, key))
+        memory = result['memory']
+        lines += ['', 'Memory: traced %.1f MB at start, %.1f MB at end, peak %.1f MB' % (
+            memory[0]['traced']/1e6, memory[-1]['traced']/1e6, memory[-1]['peak']/1e6)]
+        for name in self.watched:
+            first, last = memory[0].get(name, {}), memory[-1].get(name, {})
+            grown = ['%s %d->%d' % (key, first.get(key, 0), value)
+                     for key, value in sorted(last.items()) if value != first.get(key, 0)]
+            lines.append('  %s: %s' % (name, ', '.join(grown) or 'no growth'))
+        lines += ['', 'Allocation growth by site:']
+        for site, size, count in result['growth']:
+            lines.append('  %+10.1f kB %+8d blocks  %s' % (size/1e3, count, site))
+        lines += ['', 'Largest allocation sites at the end:']
+        for site, size, count in result['sites']:
+            lines.append('  %10.1f kB %8d blocks  %s' % (size/1e3, count, site))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory, result=None):
+        result = self.result() if result is None else result
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'summary.txt'), 'w') as f:
+            f.write(self.summary(result))
+            f.write('\nGUI thread (cProfile, cumulative):\n')
+            pstats.Stats(self.profile, stream=f).sort_stats('cumulative').print_stats(self.top)
+        with open(os.path.join(directory, 'profile.json'), 'w') as f:
+            json.dump(result, f, indent=1)
+        self.profile.dump_stats(os.path.join(directory, 'gui.prof'))
+        if self.last_snapshot is not None:
+            self.last_snapshot.dump(os.path.join(directory, 'memory.snapshot'))
+        return directory
+
+
+def profileBundleName(report_name):
+    '''
+    directory of the profile bundle of a report file
+    '''
+    return os.path.splitext(report_name)[0] + ' profile'
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if '--' in argv:
+        split = argv.index('--')
+        argv, target_args = argv[:split], argv[split+1:]
+    else:
+        target_args = []
+    parser = argparse.ArgumentParser(prog='python -m sst.profiling',
+                                     description='Run an entry point under the session profiler.')
+    parser.add_argument('target', metavar='MODULE:FUNCTION', help='e.g. sst.sst_collector:main')
+    parser.add_argument('--out', default=None, help='bundle directory (default sst_profile <date>)')
+    parser.add_argument('--interval', type=float, default=10.0, help='sample interval in ms')
+    parser.add_argument('--memory-interval', type=float, default=30.0,
+                        help='seconds between memory snapshots')
+    args = parser.parse_args(argv)
+    module, _, function = args.target.partition(':')
+    entry = getattr(importlib.import_module(module), function or 'main')
+    out = args.out or time.strftime('sst_profile %Y-%m-%d %H-%M')
+    profiler = SessionProfiler(args.interval/1000.0, args.memory_interval).start()
+    sys.argv = [args.target] + target_args   # entry points parse sys.argv
+    try:
+        return entry()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        profiler.stop(out)
+        print('Profile written to {0}'.format(out))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
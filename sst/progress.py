@@ -0,0 +1,315 @@
+'''
+Learning curves of every animal across training days, and the criteria for
+moving it to the next stage.
+
+Every session indexed by the archive is folded into the state of its
+animal: totals, totals per stage, the last WINDOW sessions at the current
+stage (rolling trials per minute, go and stop accuracy, LH and SSRT), and
+one streak per criterion. The state is one JSON row per animal, so a new
+session costs the same after years of training: read the state, update it,
+write it back with one row of the learning curve. Only a session older than
+the last one folded (or a report changed or removed) makes the animal's
+state be rebuilt, from its curve rows, without reading reports again.
+
+A criterion (Rule) holds at a session when all its bounds on the session's
+metrics hold at the rule's stage, and is met after `days` training days in
+a row on which it held (a failing session ends the streak; more sessions on
+one day count once). The default rules are the shaping steps of the
+README: two days of 100 trials within 30 min in stage 2, shortening the LH
+in stage 3 while the rat does 100 trials in 30 min, and the stop signal
+once it does so with an LH of 5 s.
+
+    progress = SessionArchive('sst_archive.db').progress
+    progress.fold(row)              # a row of the archive's sessions table
+    progress.flagged()              # [(animal, stage, rule, action, date)]
+'''
+import json
+import sqlite3
+
+import numpy as np
+
+from sst.codec import readReportColumns, TIME_COLUMNS, TRIAL_START
+
+WINDOW = 5              # sessions of the rolling aggregates
+FIRST_MINUTES = 30.0    # trials_30min: trials started in the first 30 min
+
+# per session; lh in ms, minutes from the start to the last event
+METRICS = ['trials', 'minutes', 'trials_per_min', 'trials_30min', 'go_correct', 'stop_correct',
+           'lh', 'ssrt']
+ROLLING = ['trials_per_min', 'go_correct', 'stop_correct', 'lh', 'ssrt']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS progress (
+    animal TEXT PRIMARY KEY,
+    last_date TEXT,
+    stage INTEGER,
+    flags TEXT,
+    state TEXT
+);
+CREATE TABLE IF NOT EXISTS progress_sessions (
+    path TEXT PRIMARY KEY,
+    animal TEXT,
+    date TEXT,
+    stage INTEGER,
+    trials INTEGER,
+    minutes REAL,
+    trials_per_min REAL,
+    trials_30min INTEGER,
+    go_correct REAL,
+    stop_correct REAL,
+    lh INTEGER,
+    ssrt REAL,
+    rolling_trials_per_min REAL,
+    rolling_go_correct REAL,
+    rolling_stop_correct REAL,
+    rolling_lh REAL,
+    rolling_ssrt REAL,
+    flags TEXT
+);
+CREATE INDEX IF NOT EXISTS progress_sessions_animal ON progress_sessions (animal, date);
+'''
+
+CURVE_COLUMNS = ['path', 'animal', 'date', 'stage'] + METRICS + \
+                ['rolling_' + metric for metric in ROLLING] + ['flags']
+
+
+class Rule(object):
+    '''
+    Stage criterion: bounds (min_<metric>, max_<metric>, inclusive) on the
+    sessions at stage, held on days training days in a row
+    '''
+    def __init__(self, name, stage, action, days=1, **bounds):
+        self.name = name
+        self.stage = stage
+        self.action = action
+        self.days = days
+        self.bounds = []
+        for key, value in sorted(bounds.items()):
+            kind, _, metric = key.partition('_')
+            if kind not in ('min', 'max') or metric not in METRICS:
+                raise ValueError('unknown bound %s of rule %s' % (key, name))
+            self.bounds.append((metric, kind == 'min', value))
+
+    def holds(self, session):
+        if session['stage'] != self.stage:
+            return False
+        for metric, lower, value in self.bounds:
+            actual = session.get(metric)
+            if actual is None or (actual < value if lower else actual > value):
+                return False
+        return True
+
+    def __repr__(self):
+        return 'Rule(%r, stage %d, %d days)' % (self.name, self.stage, self.days)
+
+
+DEFAULT_RULES = [
+    Rule('stage2-done', 2, 'advance to stage 3', days=2, min_trials_30min=100),
+    Rule('shorten-lh', 3, 'shorten the LH', min_trials_30min=100, min_lh=5001),
+    Rule('stage3-done', 3, 'advance to stage 4 (stop signal)', min_trials_30min=100, max_lh=5000),
+]
+
+
+def loadRules(path):
+    '''
+    rules from a JSON list of {"name", "stage", "action", "days", "min_<metric>", ...}
+    '''
+    with open(path) as f:
+        return [Rule(**item) for item in json.load(f)]
+
+
+def sessionMetrics(path):
+    '''
+    minutes and trials_30min of a report, from its event columns (reports
+    written before saveData put them in the General Message line)
+    '''
+    return columnMetrics(readReportColumns(path)[1])
+
+
+def columnMetrics(columns):
+    '''
+    minutes and trials_30min of the event columns of a session (ms)
+    '''
+    last = 0.0
+    for name in TIME_COLUMNS:
+        values = columns.get(name)
+        if isinstance(values, list) and values:
+            last = max(last, max(values))
+    starts = np.asarray(columns.get(TRIAL_START) or [], dtype=float)
+    return {'minutes': last/60000.0,
+            'trials_30min': int(np.count_nonzero(starts <= FIRST_MINUTES*60000.0))}
+
+
+def newState():
+    return {'sessions': 0, 'trials': 0, 'minutes': 0.0, 'last': None, 'stages': {},
+            'window': dict((metric, []) for metric in ROLLING), 'streaks': {}, 'met': {}}
+
+
+def mean(values):
+    values = [value for value in values if value is not None]
+    return sum(values)/len(values) if values else None
+
+
+class ProgressStore(object):
+    '''
+    Per-animal learning curves and criteria, in the archive's database
+    '''
+    def __init__(self, connection, rules=None):
+        self.connection = connection
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def session(self, row):
+        '''
+        metrics of a row of the archive's sessions table
+        '''
+        session = dict((key, row[key]) for key in ['path', 'animal', 'date', 'stage'])
+        session.update(dict.fromkeys(CURVE_COLUMNS[4:]))
+        session.update({'trials': row['trial_count'], 'go_correct': row['go_correct'],
+                        'stop_correct': row['stop_correct'], 'lh': row['lh'], 'ssrt': row['ssrt']})
+        if row.get('minutes') is not None and row.get('trials_30min') is not None:
+            # from the General Message line
+            session.update({'minutes': row['minutes'], 'trials_30min': row['trials_30min']})
+        else:
+            try:
+                session.update(sessionMetrics(row['path']))
+            except (OSError, UnicodeDecodeError, ValueError, TypeError) as e:
+                print('Can not read {0}: {1}'.format(row['path'], e))
+        if session['trials'] is not None and session['minutes']:
+            session['trials_per_min'] = session['trials']/session['minutes']
+        return session
+
+    def _state(self, animal):
+        row = self.connection.execute('SELECT state FROM progress WHERE animal = ?', (animal,)).fetchone()
+        return newState() if row is None else json.loads(row[0])
+
+    def _update(self, state, session):
+        '''
+        fold one session into state; return the rules met at it
+        '''
+        day = session['date'][:10]
+        stage = session['stage']
+        last = state['last']
+        if last is not None and last['stage'] != stage:
+            state['window'] = dict((metric, []) for metric in ROLLING)
+        state['sessions'] += 1
+        state['trials'] += session['trials'] or 0
+        state['minutes'] += session['minutes'] or 0.0
+        at_stage = state['stages'].setdefault(str(stage), {'sessions': 0, 'days': 0, 'trials': 0,
+                                                           'first': session['date'], 'lastDay': None})
+        at_stage['sessions'] += 1
+        at_stage['trials'] += session['trials'] or 0
+        if at_stage['lastDay'] != day:
+            at_stage['days'] += 1
+            at_stage['lastDay'] = day
+        for metric in ROLLING:
+            window = state['window'][metric]
+            window.append(session[metric])
+            del window[:-WINDOW]
+            session['rolling_' + metric] = mean(window)
+
+        flags = []
+        for rule in self.rules:
+            streak = state['streaks'].get(rule.name, [None, 0])
+            if not rule.holds(session):
+                streak = [None, 0]
+            elif streak[0] != day:
+                streak = [day, streak[1] + 1]
+            state['streaks'][rule.name] = streak
+            if streak[1] >= rule.days:
+                flags.append(rule.name)
+                state['met'].setdefault(rule.name, session['date'])
+        state['last'] = {'date': session['date'], 'path': session['path'], 'stage': stage, 'flags': flags}
+        session['flags'] = ' '.join(flags)
+        return flags
+
+    def _write(self, animal, state):
+        self.connection.execute('INSERT OR REPLACE INTO progress (animal, last_date, stage, flags, state) '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                (animal, state['last']['date'], state['last']['stage'],
+                                 ' '.join(state['last']['flags']), json.dumps(state)))
+
+    def _writeSession(self, session):
+        self.connection.execute('INSERT OR REPLACE INTO progress_sessions ({0}) VALUES ({1})'.format(
+            ', '.join(CURVE_COLUMNS), ', '.join('?'*len(CURVE_COLUMNS))),
+            [session[column] for column in CURVE_COLUMNS])
+
+    def fold(self, row):
+        '''
+        add the session of an archive row; return the rules its animal meets
+        '''
+        session = self.session(row)
+        animal = session['animal']
+        state = self._state(animal)
+        known = self.connection.execute('SELECT 1 FROM progress_sessions WHERE path = ?',
+                                        (session['path'],)).fetchone()
+        with self.connection:
+            if known or (state['last'] is not None and session['date'] < state['last']['date']):
+                self._writeSession(session)
+                state = self.rebuild(animal)
+            else:
+                self._update(state, session)
+                self._writeSession(session)
+                self._write(animal, state)
+        return state['last']['flags']
+
+    def rebuild(self, animal):
+        '''
+        state and curve of an animal from its stored sessions (out of order or
+        removed reports, changed rules)
+        '''
+        state = newState()
+        sessions = [dict(row) for row in self.connection.execute(
+            'SELECT * FROM progress_sessions WHERE animal = ? ORDER BY date, path', (animal,))]
+        for session in sessions:
+            self._update(state, session)
+            self._writeSession(session)
+        if state['last'] is None:
+            self.connection.execute('DELETE FROM progress WHERE animal = ?', (animal,))
+        else:
+            self._write(animal, state)
+        return state
+
+    def remove(self, paths):
+        '''
+        drop the sessions of removed reports
+        '''
+        animals = set()
+        with self.connection:
+            for path in paths:
+                row = self.connection.execute('SELECT animal FROM progress_sessions WHERE path = ?',
+                                              (path,)).fetchone()
+                if row is not None:
+                    animals.add(row[0])
+                    self.connection.execute('DELETE FROM progress_sessions WHERE path = ?', (path,))
+            for animal in animals:
+                self.rebuild(animal)
+
+    def curve(self, animal, stage=None):
+        '''
+        learning curve of an animal: its sessions in date order, as dicts
+        '''
+        sql = 'SELECT * FROM progress_sessions WHERE animal = ?'
+        args = [animal]
+        if stage is not None:
+            sql += ' AND stage = ?'
+            args.append(stage)
+        return [dict(zip(CURVE_COLUMNS, [row[column] for column in CURVE_COLUMNS]))
+                for row in self.connection.execute(sql + ' ORDER BY date, path', args)]
+
+    def state(self, animal):
+        return self._state(animal)
+
+    def flagged(self):
+        '''
+        (animal, stage, rule, action, date) of the criteria met at each animal's last session
+        '''
+        actions = dict((rule.name, rule.action) for rule in self.rules)
+        flagged = []
+        for animal, stage, flags, date in self.connection.execute(
+                "SELECT animal, stage, flags, last_date FROM progress WHERE flags != '' ORDER BY animal"):
+            for name in flags.split():
+                flagged.append((animal, stage, name, actions.get(name, ''), date))
+        return flagged
+
@@ -0,0 +1,137 @@
+'''
+Peri-event rasters and histograms: the timing of pokes, rewards and stop
+signals relative to an alignment event, across trials.
+
+Columns are sorted timestamps (ms), so the events around every alignment
+time are found with two np.searchsorted calls over the whole column, and
+the relative times of all trials are gathered in one indexing step; no loop
+runs over trials. A Raster keeps them in CSR form: the events of alignment
+i are times[offsets[i]:offsets[i+1]].
+
+    rasters = eventRasters(data.snapshot(), 'SS', window=(-500, 1500))
+    counts, edges = psth(rasters['IR'], bin_ms=20)
+    plotRaster(ax, rasters['IR'])      # one LineCollection
+'''
+import numpy as np
+from matplotlib.collections import LineCollection
+
+# event codes of the board -> columns of Data.get()
+CODE_COLUMNS = {'IL': 'pokeInL', 'OL': 'pokeOutL', 'IM': 'pokeInM', 'OM': 'pokeOutM',
+                'IR': 'pokeInR', 'OR': 'pokeOutR', 'SS': 'stopSignalStart',
+                'RS': 'rewardStart', 'L': 'laserOn'}
+
+
+class Raster(object):
+    '''
+    Event times relative to n alignment times, in CSR form.
+    '''
+    def __init__(self, times, offsets, align, window):
+        self.times = times        # relative times (ms), alignment by alignment
+        self.offsets = offsets    # n+1 starts into times
+        self.align = align        # alignment times (ms)
+        self.window = window
+
+    def __len__(self):
+        return len(self.align)
+
+    def __getitem__(self, i):
+        return self.times[self.offsets[i]:self.offsets[i+1]]
+
+    def counts(self):
+        return np.diff(self.offsets)
+
+    def rows(self):
+        '''
+        alignment index of every entry of times
+        '''
+        return np.repeat(np.arange(len(self.align)), self.counts())
+
+
+def sortedTimes(values):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) > 1 and (np.diff(values) < 0).any():
+        values = np.sort(values)
+    return values
+
+
+def periEvent(align, events, window=(-1000.0, 2000.0)):
+    '''
+    Raster of sorted event times within window (ms, inclusive) of every
+    alignment time
+    '''
+    align = np.asarray(align, dtype=np.float64)
+    events = sortedTimes(events)
+    low = np.searchsorted(events, align + window[0], 'left')
+    high = np.searchsorted(events, align + window[1], 'right')
+    counts = high - low
+    offsets = np.zeros(len(align)+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    # index into events of every entry: low of its row plus its rank in the row
+    index = np.arange(offsets[-1]) + np.repeat(low - offsets[:-1], counts)
+    times = events[index] - np.repeat(align, counts)
+    return Raster(times, offsets, align, window)
+
+
+def alignTimes(data, code):
+    '''
+    alignment times of an event code in data (Data.get() or a snapshot);
+    RS only when the trial was rewarded (unrewarded trials store 0)
+    '''
+    times = np.asarray(data[CODE_COLUMNS[code]], dtype=np.float64)
+    if code == 'RS':
+        times = times[np.asarray(data['isRewarded'], dtype=bool)[:len(times)]]
+    return times
+
+
+def eventRasters(data, align, codes=None, window=(-1000.0, 2000.0)):
+    '''
+    {code: Raster} of every code (default all in CODE_COLUMNS) around the
+    align events of data
+    '''
+    align_times = alignTimes(data, align)
+    codes = sorted(CODE_COLUMNS) if codes is None else codes
+    return dict((code, periEvent(align_times, alignTimes(data, code), window)) for code in codes)
+
+
+def psth(raster, bin_ms=20.0, rate=True):
+    '''
+    (values, edges) of the peri-event histogram: events/s per alignment if
+    rate, else counts
+    '''
+    edges = np.arange(raster.window[0], raster.window[1] + bin_ms, bin_ms)
+    counts = np.histogram(raster.times, edges)[0].astype(np.float64)
+    if rate:
+        counts *= 1000.0/(bin_ms*max(len(raster), 1))
+    return counts, edges
+
+
+def rasterSegments(raster, height=0.8):
+    '''
+    (n, 2, 2) array of one vertical tick per event, row i at y = i
+    '''
+    rows = raster.rows()
+    segments = np.empty((len(rows), 2, 2))
+    segments[:, :, 0] = raster.times[:, None]
+    segments[:, 0, 1] = rows - height/2
+    segments[:, 1, 1] = rows + height/2
+    return segments
+
+
+def plotRaster(ax, raster, color='k', linewidth=0.8, height=0.8):
+    '''
+    draw a raster as a single LineCollection; returns it
+    '''
+    lines = LineCollection(rasterSegments(raster, height), colors=color, linewidths=linewidth)
+    ax.add_collection(lines)
+    ax.set_xlim(raster.window)
+    ax.set_ylim(-0.5, max(len(raster), 1) - 0.5)
+    ax.axvline(0, color='r', linewidth=0.5)
+    return lines
+
+
+def plotPSTH(ax, raster, bin_ms=20.0, color='k'):
+    values, edges = psth(raster, bin_ms)
+    ax.step(edges[:-1], values, where='post', color=color)
+    ax.set_xlim(raster.window)
+    ax.axvline(0, color='r', linewidth=0.5)
+    return values, edges
@@ -0,0 +1,125 @@
+'''
+Stop trial schedules generated on the PC and streamed to the board.
+
+The board used to draw the stop trials itself into a 100 element array in
+the Uno's RAM. Now the PC draws the whole session and the board keeps only a
+small ring buffer of upcoming trials, asking for more with an "SQ" event
+(carrying the first trial number it is missing) whenever it runs low. Each
+answer is one framed command "<Q<first trial>:<kinds>>" with one digit per
+trial: 0 go, 1 stop, 2 noise (tone of another frequency, no stop required),
+or a MSG_SCHEDULE frame of sst_protocol.
+'''
+import numpy as np
+
+KIND_GO = 0
+KIND_STOP = 1
+KIND_NOISE = 2
+CHUNK = 16   # trials per command, keeps a command well inside the Uno's 64 byte serial buffer
+
+
+def constrainedPlacement(n_items, n_slots, max_run, rng, lead=0):
+    '''
+    Return a bool array of n_slots with n_items True at random positions and
+    no run of more than max_run consecutive True, counting lead True values
+    just before the array (the end of the previous block).
+
+    The n_slots-n_items False values split the array into gaps; each gap
+    gets max_run seats (the first one max_run-lead) and n_items seats are
+    drawn at once, so no gap can overflow and nothing has to be rejected or
+    repaired.
+    '''
+    n_gaps = n_slots - n_items + 1
+    first = max_run - min(lead, max_run)
+    if n_items > first + (n_gaps-1)*max_run:
+        raise ValueError('{0} stop trials in {1} trials can not keep runs of at most {2}'.format(
+            n_items, n_slots, max_run))
+    seats = rng.choice(first + (n_gaps-1)*max_run, n_items, replace=False)
+    gaps = np.where(seats < first, 0, (seats - first) // max_run + 1)
+    counts = np.bincount(gaps, minlength=n_gaps)
+    placement = np.ones(n_slots, dtype=bool)
+    placement[np.cumsum(counts[:-1]+1)-1] = False
+    return placement
+
+
+def trailingRun(kinds):
+    '''
+    number of stop/noise trials at the end of kinds
+    '''
+    go = np.flatnonzero(kinds == KIND_GO)
+    return len(kinds) - 1 - go[-1] if len(go) else len(kinds)
+
+
+def noiseNumber(n_stop, noise_proportion):
+    '''
+    noise trials added to n_stop stop trials, as the board does for stage 5
+    '''
+    if noise_proportion <= 0:
+        return 0
+    return int(np.floor(n_stop / (1/noise_proportion - 1)))
+
+
+def generateSchedule(baseline, block_length, block_number, stop_percent, noise_proportion=0.0,
+                     max_run=2, seed=None):
+    '''
+    Generate the kinds of all trials of a session.
+
+    Parameters
+    ----------
+    baseline: go trials before the first block.
+    block_length, block_number: blocks after the baseline.
+    stop_percent: share of stop trials in every block, balanced exactly.
+    noise_proportion: noise trials are added as on the board (0.33 there).
+    max_run: longest run of consecutive stop/noise trials, also across blocks.
+    seed: for a reproducible schedule.
+
+    Returns
+    -------
+    schedule: numpy.ndarray
+        kind of trial n at index n-1.
+    '''
+    rng = np.random.RandomState(seed)
+    n_stop = int(block_length*stop_percent)
+    n_noise = noiseNumber(n_stop, noise_proportion)
+    schedule = np.zeros(baseline + block_length*block_number, dtype=np.int8)
+    for b in range(block_number):
+        start = baseline + b*block_length
+        block = schedule[start:start+block_length]
+        lead = trailingRun(schedule[:start])
+        signal = np.flatnonzero(constrainedPlacement(n_stop+n_noise, block_length, max_run, rng, lead))
+        block[signal] = KIND_STOP
+        block[rng.choice(signal, n_noise, replace=False)] = KIND_NOISE
+    return schedule
+
+
+class ScheduleStreamer(object):
+    '''
+    Answer the board's schedule requests.
+
+    Registered as a listener on Data, so requests are answered from the
+    serial monitor thread as soon as they are decoded. With a
+    sst_protocol.CommandChannel the chunks go out as binary frames.
+    '''
+    def __init__(self, connection, schedule, chunk=CHUNK, channel=None):
+        self.connection = connection
+        self.schedule = schedule
+        self.chunk = chunk
+        self.channel = channel
+        self.text = ''.join(str(kind) for kind in schedule.tolist())
+        self.kinds = schedule.astype(np.uint8).tobytes()
+        self.requests = 0
+
+    def on_event(self, data_in):
+        if data_in[0] == 'SQ':
+            self.send(data_in[1])
+
+    def send(self, first):
+        '''
+        send the kinds of trials first, first+1, ... (trial numbers start at 1)
+        '''
+        if not 0 < first <= len(self.schedule):
+            return
+        self.requests += 1
+        if self.channel is not None:
+            self.channel.sendSchedule(first, self.kinds[first-1:first-1+self.chunk])
+        else:
+            self.connection.write('Q'+str(first)+':'+self.text[first-1:first-1+self.chunk])
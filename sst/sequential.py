@@ -0,0 +1,234 @@
+'''
+Sequential effects and inhibition functions of many sessions at once.
+
+The trials of all sessions are padded into (sessions x trials) arrays, and
+every trial gets an outcome: correct go, go error, successful stop, failed
+stop (-1 for padding). Effects of the previous trial are read with the
+arrays shifted by lag against each other, and grouped by (session, outcome
+of trial n-lag) with np.bincount on a flat index session*4 + outcome, so
+no Python code runs per trial:
+
+* RT of correct go trials after each outcome (mean and median), and from
+  them post-stop slowing (after a successful stop against after a correct
+  go), slowing after a failed stop and after a go error;
+* go and stop accuracy after each outcome.
+
+The inhibition function is P(respond | SSD), grouped by session and SSD bin
+the same way. A logistic function of SSD is fitted to the stop trials of
+every session in one batch: each Newton step solves the 2x2 systems of all
+sessions together, with a small ridge penalty so sessions where every stop
+succeeded or failed still give finite parameters.
+
+    tables = [trialTable(loadSession(path)['df']) for path in reports]
+    rt, trial_type, is_rewarded, ssd = stackTables(tables)
+    effects = sequentialEffects(rt, trial_type, is_rewarded)
+    fit = fitInhibition(trial_type, is_rewarded, ssd)
+'''
+import numpy as np
+from scipy.special import expit
+
+from sst.cache import loadSession
+
+GO_CORRECT, GO_ERROR, STOP_SUCCESS, STOP_FAILURE = 0, 1, 2, 3
+OUTCOMES = ['goCorrect', 'goError', 'stopSuccess', 'stopFailure']
+SSD_SCALE = 100.0   # ms, SSDs are fitted in this unit to keep the 2x2 systems well scaled
+
+
+def trialTable(data, baseline=20, end=320):
+    '''
+    (rt, trial_type, is_rewarded, ssd) per trial of a DataFrame of
+    preprocess.loadData, trials selected as in preprocess.calSSRT; rt is
+    the poke from the middle to the response side on every trial
+    '''
+    data = data.iloc[baseline:end]
+    go = (data['TrialType']==1) & (data['IsRewarded']==1)
+    if go.any() and data.loc[go, 'PokeInR'].iloc[0] > data.loc[go, 'PokeInL'].iloc[0]:
+        rt = data['PokeInR'] - data['PokeOutL']
+    else:
+        rt = data['PokeInL'] - data['PokeOutR']
+    return (np.asarray(rt, dtype=float), np.asarray(data['TrialType'], dtype=np.int64),
+            np.asarray(data['IsRewarded'], dtype=np.int64), np.asarray(data['SSDs'], dtype=float))
+
+
+def stackTables(tables):
+    '''
+    (rt, trial_type, is_rewarded, ssd) as (sessions x trials) arrays; padding
+    trials have type 0 and nan RT and SSD
+    '''
+    width = max(len(table[0]) for table in tables)
+    rt = np.full((len(tables), width), np.nan)
+    trial_type = np.zeros((len(tables), width), dtype=np.int64)
+    is_rewarded = np.zeros((len(tables), width), dtype=np.int64)
+    ssd = np.full((len(tables), width), np.nan)
+    for i, table in enumerate(tables):
+        n = len(table[0])
+        rt[i, :n], trial_type[i, :n], is_rewarded[i, :n], ssd[i, :n] = table
+    return rt, trial_type, is_rewarded, ssd
+
+
+def outcomes(trial_type, is_rewarded):
+    '''
+    outcome of every trial, -1 where there is no trial
+    '''
+    trial_type = np.asarray(trial_type)
+    rewarded = np.asarray(is_rewarded) == 1
+    return np.select([(trial_type==1) & rewarded, trial_type==1, (trial_type==2) & rewarded, trial_type==2],
+                     [GO_CORRECT, GO_ERROR, STOP_SUCCESS, STOP_FAILURE], -1)
+
+
+def groupMedians(groups, values, n_groups):
+    '''
+    median of values per group (nan for empty groups): sorted by value, then
+    stably by group (faster than np.lexsort)
+    '''
+    order = np.argsort(values)
+    order = order[np.argsort(groups[order], kind='stable')]
+    values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    medians = np.full(n_groups, np.nan)
+    some = counts > 0
+    low = starts[some] + (counts[some]-1)//2
+    high = starts[some] + counts[some]//2
+    medians[some] = 0.5*(values[low] + values[high])
+    return medians
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(denominator > 0, numerator/np.maximum(denominator, 1), np.nan)
+
+
+def sequentialEffects(rt, trial_type, is_rewarded, lag=1):
+    '''
+    Effects of the outcome of trial n-lag on trial n, per session.
+
+    rt, trial_type, is_rewarded: (sessions x trials) arrays, e.g. from
+    stackTables. Returns a dict of (sessions x 4) arrays, columns in the
+    order of OUTCOMES of the earlier trial: 'rt' (mean RT of correct go
+    trials), 'rtMedian', 'n' (their count), 'goAccuracy', 'stopAccuracy';
+    and per session 'postStopSlowing', 'postFailedStopSlowing' and
+    'postErrorSlowing' (mean RT after that outcome minus after a correct go).
+    '''
+    rt = np.asarray(rt, dtype=float)
+    outcome = outcomes(trial_type, is_rewarded)
+    sessions = len(outcome)
+    before = outcome[:, :-lag]
+    after = outcome[:, lag:]
+    after_rt = rt[:, lag:]
+    group = np.arange(sessions)[:, None]*4 + before
+    has_before = before >= 0
+    n_groups = sessions*4
+
+    timed = has_before & (after == GO_CORRECT) & np.isfinite(after_rt)
+    index = group[timed]
+    values = after_rt[timed]
+    n = np.bincount(index, minlength=n_groups)
+    mean_rt = _ratio(np.bincount(index, values, n_groups), n)
+    median_rt = groupMedians(index, values, n_groups)
+
+    go = has_before & ((after == GO_CORRECT) | (after == GO_ERROR))
+    go_correct = np.bincount(group[go], after[go] == GO_CORRECT, n_groups)
+    stop = has_before & ((after == STOP_SUCCESS) | (after == STOP_FAILURE))
+    stop_success = np.bincount(group[stop], after[stop] == STOP_SUCCESS, n_groups)
+
+    shape = (sessions, 4)
+    mean_rt = mean_rt.reshape(shape)
+    return {'rt': mean_rt, 'rtMedian': median_rt.reshape(shape), 'n': n.reshape(shape),
+            'goAccuracy': _ratio(go_correct, np.bincount(group[go], minlength=n_groups)).reshape(shape),
+            'stopAccuracy': _ratio(stop_success, np.bincount(group[stop], minlength=n_groups)).reshape(shape),
+            'postStopSlowing': mean_rt[:, STOP_SUCCESS] - mean_rt[:, GO_CORRECT],
+            'postFailedStopSlowing': mean_rt[:, STOP_FAILURE] - mean_rt[:, GO_CORRECT],
+            'postErrorSlowing': mean_rt[:, GO_ERROR] - mean_rt[:, GO_CORRECT]}
+
+
+def inhibitionFunction(trial_type, is_rewarded, ssd, edges=np.arange(0, 1001, 50)):
+    '''
+    P(respond | SSD) per session and SSD bin [edges[i], edges[i+1]).
+
+    Returns (bin centers, (sessions x bins) stop trial counts, (sessions x
+    bins) probability of responding, nan for empty bins).
+    '''
+    edges = np.asarray(edges, dtype=float)
+    bins = len(edges) - 1
+    stop = np.asarray(trial_type) == 2
+    responded = stop & (np.asarray(is_rewarded) == 0)
+    ssd = np.asarray(ssd, dtype=float)
+    which = np.searchsorted(edges, np.where(stop, ssd, np.nan), 'right') - 1
+    counted = stop & (which >= 0) & (which < bins)
+    index = (np.arange(len(stop))[:, None]*bins + which)[counted]
+    n = np.bincount(index, minlength=len(stop)*bins)
+    p = _ratio(np.bincount(index, responded[counted], len(stop)*bins), n)
+    return 0.5*(edges[:-1] + edges[1:]), n.reshape(-1, bins), p.reshape(-1, bins)
+
+
+def fitInhibition(trial_type, is_rewarded, ssd, ridge=1e-3, max_iter=50, tol=1e-8):
+    '''
+    Fit P(respond | SSD) = 1/(1 + exp(-(intercept + slope*SSD))) to the stop
+    trials of every session in one batch.
+
+    Returns a dict of per-session arrays: 'intercept', 'slope' (per ms),
+    'ssd50' (the SSD of 50 % responding, nan unless slope > 0), 'n' (stop
+    trials), 'logLik', 'converged' and 'iterations'. Sessions without stop
+    trials are nan.
+    '''
+    ssd = np.asarray(ssd, dtype=float)
+    mask = ((np.asarray(trial_type) == 2) & np.isfinite(ssd)).astype(float)
+    y = ((np.asarray(is_rewarded) == 0)*mask)
+    x = np.where(mask > 0, ssd, 0.0)/SSD_SCALE
+    n = mask.sum(axis=1)
+    sessions = len(mask)
+    theta = np.zeros((sessions, 2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p0 = np.clip(y.sum(axis=1)/n, 0.05, 0.95)
+    theta[:, 0] = np.where(n > 0, np.log(p0/(1-p0)), 0.0)
+    converged = np.zeros(sessions, dtype=bool)
+    eye = np.eye(2)
+    for iteration in range(max_iter):
+        active = np.flatnonzero(~converged)
+        if len(active) == 0:
+            break
+        t, xa, ya, ma = theta[active], x[active], y[active], mask[active]
+        p = expit(t[:, 0:1] + t[:, 1:2]*xa)
+        residual = (ya - p)*ma
+        g = np.column_stack([residual.sum(axis=1), (residual*xa).sum(axis=1)]) - ridge*t
+        w = p*(1-p)*ma
+        wx = (w*xa).sum(axis=1)
+        info = np.empty((len(active), 2, 2))
+        info[:, 0, 0] = w.sum(axis=1)
+        info[:, 0, 1] = info[:, 1, 0] = wx
+        info[:, 1, 1] = (w*xa*xa).sum(axis=1)
+        info += ridge*eye
+        step = np.linalg.solve(info, g[:, :, None])[:, :, 0]
+        # the penalized likelihood is concave; long first steps are only capped
+        step *= np.minimum(1.0, 5.0/np.maximum(np.abs(step).max(axis=1), 1e-300))[:, None]
+        theta[active] = t + step
+        converged[active[np.abs(step).max(axis=1) < tol]] = True
+
+    eta = theta[:, 0:1] + theta[:, 1:2]*x
+    log_lik = -(mask*(y*np.logaddexp(0, -eta) + (1-y)*np.logaddexp(0, eta))).sum(axis=1)
+    intercept = theta[:, 0]
+    slope = theta[:, 1]/SSD_SCALE
+    none = n == 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ssd50 = np.where(slope > 0, -intercept/slope, np.nan)
+    return {'intercept': np.where(none, np.nan, intercept), 'slope': np.where(none, np.nan, slope),
+            'ssd50': np.where(none, np.nan, ssd50), 'n': n, 'logLik': np.where(none, np.nan, log_lik),
+            'converged': converged & ~none, 'iterations': iteration+1}
+
+
+def analyseSessions(sessions, baseline=20, end=320, lag=1, edges=np.arange(0, 1001, 50)):
+    '''
+    Sequential effects, inhibition functions and their logistic fits of many
+    sessions.
+
+    sessions: report file names (loaded through sst.cache) or DataFrames of
+    preprocess.loadData. Returns {'sequential', 'inhibition': (centers, n, p),
+    'fit'} as the functions above.
+    '''
+    tables = [trialTable(loadSession(session)['df'] if isinstance(session, str) else session,
+                         baseline, end) for session in sessions]
+    rt, trial_type, is_rewarded, ssd = stackTables(tables)
+    return {'sequential': sequentialEffects(rt, trial_type, is_rewarded, lag),
+            'inhibition': inhibitionFunction(trial_type, is_rewarded, ssd, edges),
+            'fit': fitInhibition(trial_type, is_rewarded, ssd)}
@@ -0,0 +1,164 @@
+'''
+Monte Carlo simulation of the stop signal task under the independent race
+model, to measure the bias and variance of the project's SSRT estimators.
+
+Sessions follow the stage 5 design: baseline go trials, then blocks with a
+fixed share of stop trials at random positions. The first SSD is the median
+go RT of the baseline (as sent by the GUI) and the board's staircase moves it
+by 50 ms: up after a successful stop, down after a failed or skipped one
+(a response before the stop signal turns the trial into a rewarded go trial).
+Go responses slower than the limited hold are omissions.
+
+All sessions of a chunk are simulated together as (sessions x trials)
+arrays; only the staircase walks over trials. Chunks run in a process pool.
+
+    python -m sst.simulate --sessions 1000000
+'''
+import sys
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from sst.preprocess import calSSRTBulk, calSSRT2Bulk
+
+DEFAULT_DESIGN = {'baseline': 20, 'blockLength': 100, 'blockNumber': 3, 'stopPercent': 0.25,
+                  'lh': 1500.0, 'ssdStep': 50.0}
+DEFAULT_MODEL = {'goMu': 300.0, 'goSigma': 40.0, 'goTau': 100.0,
+                 'ssrtMean': 200.0, 'ssrtSD': 30.0}
+ESTIMATORS = [('calSSRT', lambda s, d: calSSRTBulk(s['rt'], s['trialType'], s['isRewarded'], s['ssd'],
+                                                   d['baseline'], d['baseline']+d['blockLength']*d['blockNumber'])),
+              ('calSSRT2', lambda s, d: calSSRT2Bulk(s['rt'], s['trialType'], s['isRewarded'], s['ssd'],
+                                                     d['baseline'], d['blockLength'], d['blockNumber']))]
+CHUNK = 20000   # sessions simulated together
+
+
+def simulateSessions(n, design=None, model=None, rng=None):
+    '''
+    Simulate n sessions.
+
+    Returns
+    -------
+    sessions: Dictionary of (n x trials) arrays
+        'rt' (go finishing time), 'trialType' (1 go, 2 stop), 'isRewarded'
+        and 'ssd' (0 when no stop signal was played).
+    '''
+    design = dict(DEFAULT_DESIGN, **(design or {}))
+    model = dict(DEFAULT_MODEL, **(model or {}))
+    rng = np.random.RandomState() if rng is None else rng
+    baseline = design['baseline']
+    block_length = design['blockLength']
+    trials = baseline + block_length*design['blockNumber']
+
+    rt = rng.normal(model['goMu'], model['goSigma'], (n, trials)) + \
+         rng.exponential(model['goTau'], (n, trials))
+    ssrt = rng.normal(model['ssrtMean'], model['ssrtSD'], (n, trials))
+
+    # stop trials at random positions in every block
+    n_stop = int(round(block_length*design['stopPercent']))
+    is_stop = np.zeros((n, trials), dtype=bool)
+    for b in range(design['blockNumber']):
+        keys = rng.rand(n, block_length)
+        start = baseline + b*block_length
+        is_stop[:, start:start+block_length] = keys.argsort(axis=1).argsort(axis=1) < n_stop
+
+    trial_type = np.ones((n, trials), dtype=np.int8)
+    rewarded = (rt <= design['lh']).astype(np.int8)
+    ssd_played = np.zeros((n, trials))
+    ssd = np.median(rt[:, :baseline], axis=1)
+    step = design['ssdStep']
+    lh = design['lh']
+    for t in range(baseline, trials):
+        stop = is_stop[:, t]
+        if not stop.any():
+            continue
+        # responded before the stop signal: the stop is skipped
+        skipped = stop & (rt[:, t] < ssd)
+        played = stop & ~skipped
+        responded = played & (rt[:, t] < ssd + ssrt[:, t]) & (rt[:, t] <= lh)
+        inhibited = played & ~responded
+        trial_type[played, t] = 2
+        ssd_played[played, t] = ssd[played]
+        rewarded[played, t] = inhibited[played]
+        rewarded[skipped, t] = 1
+        ssd = np.where(inhibited, np.minimum(ssd+step, lh),
+                       np.where(responded | skipped, np.maximum(ssd-step, 0), ssd))
+    return {'rt': rt, 'trialType': trial_type, 'isRewarded': rewarded, 'ssd': ssd_played}
+
+
+def _simulateChunk(args):
+    n, design, model, seed = args
+    rng = np.random.RandomState(seed)
+    sessions = simulateSessions(n, design, model, rng)
+    design = dict(DEFAULT_DESIGN, **(design or {}))
+    stats = {}
+    for name, estimator in ESTIMATORS:
+        estimate = estimator(sessions, design)
+        valid = np.isfinite(estimate)
+        stats[name] = (int(valid.sum()), float(estimate[valid].sum()),
+                       float((estimate[valid]**2).sum()), int((~valid).sum()))
+    return stats
+
+
+def evaluate(n_sessions, design=None, model=None, seed=0, processes=None, chunk=CHUNK):
+    '''
+    Simulate n_sessions and return, per estimator, a dict of mean, bias,
+    sd, rmse and the number of sessions where it failed.
+    '''
+    model_ = dict(DEFAULT_MODEL, **(model or {}))
+    tasks = [(min(chunk, n_sessions-start), design, model, seed+i)
+             for i, start in enumerate(range(0, n_sessions, chunk))]
+    if processes == 1:
+        chunks = [_simulateChunk(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunks = pool.map(_simulateChunk, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    table = {}
+    for name, _ in ESTIMATORS:
+        n = sum(c[name][0] for c in chunks)
+        total = sum(c[name][1] for c in chunks)
+        squares = sum(c[name][2] for c in chunks)
+        mean = total/n if n else float('nan')
+        var = squares/n - mean**2 if n else float('nan')
+        bias = mean - model_['ssrtMean']
+        table[name] = {'mean': mean, 'bias': bias, 'sd': np.sqrt(max(var, 0)),
+                       'rmse': np.sqrt(max(var, 0) + bias**2),
+                       'failed': sum(c[name][3] for c in chunks)}
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sst.simulate',
+                                     description='Bias and variance of the SSRT estimators.')
+    parser.add_argument('--sessions', type=int, default=100000, help='sessions per condition')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ssrt', type=float, nargs='+', default=[150.0, 200.0, 250.0],
+                        help='true mean SSRTs (ms)')
+    parser.add_argument('--tau', type=float, nargs='+', default=[50.0, 100.0, 200.0],
+                        help='exponential component of the go RTs (ms)')
+    args = parser.parse_args(argv)
+
+    print('%8s %6s  %-9s %9s %8s %8s %8s %7s' % ('SSRT', 'tau', 'estimator', 'mean', 'bias', 'sd', 'rmse', 'failed'))
+    start = time.perf_counter()
+    total = 0
+    for ssrt in args.ssrt:
+        for tau in args.tau:
+            model = {'ssrtMean': ssrt, 'goTau': tau}
+            table = evaluate(args.sessions, model=model, seed=args.seed, processes=args.processes)
+            total += args.sessions
+            for name, row in sorted(table.items()):
+                print('%8.0f %6.0f  %-9s %9.1f %8.1f %8.1f %8.1f %7d' % (
+                    ssrt, tau, name, row['mean'], row['bias'], row['sd'], row['rmse'], row['failed']))
+    elapsed = time.perf_counter() - start
+    print('%d sessions in %.1f s (%.0f sessions/s)' % (total, elapsed, total/elapsed))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+'''
+Append-only columns with a bounded number of items in memory, for very long
+sessions (free exploration, overnight habituation).
+
+A SpillColumn keeps the newest items in a list (the hot window) and appends
+older ones, window items at a time, to a binary file of fixed width numbers.
+Reads of spilled items go through a read-only memory map of that file, so
+they cost no resident memory beyond the pages the kernel keeps cached. The
+column behaves as the list it replaces in Data: append, len, indexing,
+slicing (to lists), iteration, and toarray for numpy.
+
+As in Data, there is one writer and any number of readers without locks:
+the spilled count and the hot list are replaced together as one tuple, and
+a hot list is never changed after it was replaced, so a reader holding an
+old state still sees the items it counted.
+
+    column = SpillColumn('sst_spill/pokeInL.bin', float, window=4096)
+'''
+import os
+
+import numpy as np
+
+
+class SpillColumn(object):
+    '''
+    List of numbers with at most 2*window of them in memory.
+    '''
+    def __init__(self, path, dtype=float, window=4096):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.window = window
+        self._file = open(path, 'wb')
+        self._state = (0, [])       # (items in the file, newer items)
+        self._map = (0, None)       # (items mapped, memmap)
+
+    def append(self, value):
+        hot = self._state[1]
+        hot.append(value)
+        if len(hot) >= 2*self.window:
+            self._spill()
+
+    def _spill(self):
+        spilled, hot = self._state
+        self._file.write(np.asarray(hot[:self.window], dtype=self.dtype).tobytes())
+        self._file.flush()
+        self._state = (spilled + self.window, hot[self.window:])
+
+    def _cold(self, spilled):
+        '''
+        memmap of at least the first spilled items of the file
+        '''
+        mapped, array = self._map
+        if mapped < spilled:
+            array = np.memmap(self.path, self.dtype, 'r', shape=(spilled,))
+            self._map = (spilled, array)
+        elif array is None:
+            array = np.empty(0, dtype=self.dtype)
+        return array
+
+    def __len__(self):
+        spilled, hot = self._state
+        return spilled + len(hot)
+
+    def __getitem__(self, index):
+        spilled, hot = self._state
+        length = spilled + len(hot)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(length)
+            if step != 1:
+                return [self._item(spilled, hot, i) for i in range(start, stop, step)]
+            if stop <= start:
+                return []
+            items = self._cold(spilled)[start:min(stop, spilled)].tolist() if start < spilled else []
+            return items + hot[max(start - spilled, 0):max(stop - spilled, 0)]
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('column index out of range')
+        return self._item(spilled, hot, index)
+
+    def _item(self, spilled, hot, index):
+        if index < spilled:
+            return self._cold(spilled)[index].item()
+        return hot[index - spilled]
+
+    def __iter__(self):
+        spilled, hot = self._state
+        cold = self._cold(spilled)
+        for start in range(0, spilled, 65536):
+            for item in cold[start:min(start + 65536, spilled)].tolist():
+                yield item
+        for item in hot:
+            yield item
+
+    def toarray(self, length=None, dtype=None):
+        '''
+        the first length items as one array
+        '''
+        spilled, hot = self._state
+        length = spilled + len(hot) if length is None else length
+        cold = self._cold(spilled)[:min(length, spilled)]
+        recent = np.asarray(hot[:max(length - spilled, 0)], dtype=self.dtype)
+        return np.concatenate([cold, recent]).astype(dtype or self.dtype, copy=False)
+
+    def tail(self, length):
+        '''
+        (offset, items) of the part of the first length items still in memory
+        '''
+        spilled, hot = self._state
+        if length <= spilled:
+            return length, []
+        return spilled, hot[:length - spilled]
+
+    def spilled(self):
+        return self._state[0]
+
+    def close(self):
+        self._map = (0, None)
+        self._file.close()
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,345 @@
+'''
+Session archive: an SQLite index of the report files.
+
+Scanning is incremental: a report whose size and modification time did not
+change since the last scan is skipped, and of the others only the General
+Message line (the second line) is read. That line also carries the session
+length and the trials in the first 30 min for the learning curves; only
+reports written before it did are read in full for them. The animal of a session is taken from the name of the directory holding the
+report, so keep one directory per animal.
+
+Every new session is folded into the learning curve of its animal and
+checked against the stage criteria (sst.progress).
+
+    sst-archive scan D:/reports
+    sst-archive query --animal rat12 --stage 5
+    sst-archive progress --animal rat12
+    sst-archive criteria
+'''
+import os
+import re
+import sys
+import time
+import sqlite3
+import argparse
+import datetime
+
+from sst.progress import ProgressStore, loadRules
+
+DEFAULT_DB = 'sst_archive.db'
+REPORT_PATTERN = re.compile(r'^SST Report (\d{4}-\d{2}-\d{2} \d{2}-\d{2})( new)*\.txt$')
+HEADER_ITEM = re.compile(r'(\w+): (\S+)')
+
+# header key -> (column, type)
+HEADER_COLUMNS = {'trialNum': ('trial_count', int),
+                  'stage': ('stage', int),
+                  'direction': ('direction', str),
+                  'lh': ('lh', int),
+                  'sessionLength': ('session_length', int),
+                  'baseline': ('baseline', int),
+                  'stopPercent': ('stop_percent', float),
+                  'blockLength': ('block_length', int),
+                  'blockNumber': ('block_number', int),
+                  'isLaser': ('is_laser', int),
+                  'goCorrect': ('go_correct', float),
+                  'stopCorrect': ('stop_correct', float),
+                  'ssrt': ('ssrt', float)}
+
+# header key -> (item, type) of the learning curve (sst.progress), not indexed
+SUMMARY_ITEMS = {'minutes': ('minutes', float),
+                 'trials30min': ('trials_30min', int)}
+
+COLUMNS = ['path', 'directory', 'animal', 'file_name', 'date', 'size', 'mtime'] + \
+          sorted(column for column, _ in HEADER_COLUMNS.values()) + ['header']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    path TEXT PRIMARY KEY,
+    directory TEXT,
+    animal TEXT,
+    file_name TEXT,
+    date TEXT,
+    size INTEGER,
+    mtime REAL,
+    baseline INTEGER,
+    block_length INTEGER,
+    block_number INTEGER,
+    direction TEXT,
+    go_correct REAL,
+    is_laser INTEGER,
+    lh INTEGER,
+    session_length INTEGER,
+    ssrt REAL,
+    stage INTEGER,
+    stop_correct REAL,
+    stop_percent REAL,
+    trial_count INTEGER,
+    header TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_animal ON sessions (animal, stage, date);
+CREATE INDEX IF NOT EXISTS sessions_stage ON sessions (stage, date);
+CREATE INDEX IF NOT EXISTS sessions_date ON sessions (date);
+CREATE INDEX IF NOT EXISTS sessions_directory ON sessions (directory);
+'''
+
+
+def parseHeader(line):
+    '''
+    return the columns (and summary items) found in the General Message
+    line of a report
+    '''
+    info = {}
+    for key, value in HEADER_ITEM.findall(line):
+        if key in HEADER_COLUMNS or key in SUMMARY_ITEMS:
+            column, kind = HEADER_COLUMNS.get(key) or SUMMARY_ITEMS[key]
+            try:
+                info[column] = kind(value)
+            except ValueError:
+                info[column] = None
+    return info
+
+
+def reportDate(file_name, mtime):
+    match = REPORT_PATTERN.match(file_name)
+    if match:
+        return datetime.datetime.strptime(match.group(1), '%Y-%m-%d %H-%M').strftime('%Y-%m-%d %H:%M')
+    return datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M')
+
+
+def iterReports(directory):
+    '''
+    yield os.DirEntry of every report below directory
+    '''
+    stack = [directory]
+    while stack:
+        for entry in os.scandir(stack.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif REPORT_PATTERN.match(entry.name):
+                yield entry
+
+
+class SessionArchive(object):
+    '''
+    SQLite index of the sessions.
+    '''
+    def __init__(self, db_path=DEFAULT_DB, rules=None):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        self.progress = ProgressStore(self.connection, rules)
+
+    def close(self):
+        self.connection.close()
+
+    def readSession(self, path, size, mtime):
+        with open(path, 'r') as f:
+            f.readline()
+            header = f.readline().strip()
+        directory = os.path.dirname(os.path.abspath(path))
+        row = dict.fromkeys(COLUMNS)
+        row.update(parseHeader(header))
+        row.update({'path': os.path.abspath(path),
+                    'directory': directory,
+                    'animal': os.path.basename(directory),
+                    'file_name': os.path.basename(path),
+                    'date': reportDate(os.path.basename(path), mtime),
+                    'size': size,
+                    'mtime': mtime,
+                    'header': header})
+        return row
+
+    def scan(self, directories):
+        '''
+        index new and changed reports below directories and drop the ones
+        that were removed; return (added or updated, unchanged, removed)
+        '''
+        if isinstance(directories, str):
+            directories = [directories]
+        known = {}
+        for row in self.connection.execute('SELECT path, size, mtime FROM sessions'):
+            known[row['path']] = (row['size'], row['mtime'])
+
+        rows = []
+        seen = set()
+        unchanged = 0
+        for directory in directories:
+            for entry in iterReports(directory):
+                path = os.path.abspath(entry.path)
+                stat = entry.stat()
+                seen.add(path)
+                if known.get(path) == (stat.st_size, stat.st_mtime):
+                    unchanged += 1
+                    continue
+                try:
+                    rows.append(self.readSession(path, stat.st_size, stat.st_mtime))
+                except (OSError, UnicodeDecodeError) as e:
+                    print('Can not read {0}: {1}'.format(path, e))
+
+        roots = [os.path.join(os.path.abspath(d), '') for d in directories]
+        removed = [(path,) for path in known
+                   if path not in seen and any(path.startswith(root) for root in roots)]
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO sessions ({0}) VALUES ({1})'.format(
+                    ', '.join(COLUMNS), ', '.join('?'*len(COLUMNS))),
+                [[row[column] for column in COLUMNS] for row in rows])
+            self.connection.executemany('DELETE FROM sessions WHERE path = ?', removed)
+        self.progress.remove([path for path, in removed])
+        for row in sorted(rows, key=lambda row: (row['date'], row['path'])):
+            self.progress.fold(row)
+        return (len(rows), unchanged, len(removed))
+
+    def addReport(self, path):
+        '''
+        index (or re-index) one report, e.g. one just received by the collector;
+        return the stage criteria its animal meets
+        '''
+        stat = os.stat(path)
+        row = self.readSession(path, stat.st_size, stat.st_mtime)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO sessions ({0}) VALUES ({1})'.format(
+                ', '.join(COLUMNS), ', '.join('?'*len(COLUMNS))), [row[column] for column in COLUMNS])
+        return self.progress.fold(row)
+
+    def query(self, animal=None, stage=None, direction=None, since=None, until=None,
+              min_trials=None, laser=None, order='date'):
+        '''
+        return the matching sessions as a list of sqlite3.Row
+        since/until: 'YYYY-MM-DD' dates, inclusive
+        '''
+        conditions = []
+        args = []
+        if animal is not None:
+            conditions.append('animal = ?')
+            args.append(animal)
+        if stage is not None:
+            conditions.append('stage = ?')
+            args.append(stage)
+        if direction is not None:
+            conditions.append('direction = ?')
+            args.append(direction)
+        if since is not None:
+            conditions.append('date >= ?')
+            args.append(since)
+        if until is not None:
+            conditions.append('date < ?')
+            args.append(until + ' 99')
+        if min_trials is not None:
+            conditions.append('trial_count >= ?')
+            args.append(min_trials)
+        if laser is not None:
+            conditions.append('is_laser = ?')
+            args.append(int(laser))
+        sql = 'SELECT * FROM sessions'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        if order in COLUMNS:
+            sql += ' ORDER BY ' + order
+        return self.connection.execute(sql, args).fetchall()
+
+    def animals(self):
+        return [row[0] for row in self.connection.execute(
+            'SELECT DISTINCT animal FROM sessions ORDER BY animal')]
+
+    def count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+
+def formatValue(value, digits=2):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return format(value, '.'+str(digits)+'f')
+    return str(value)
+
+
+def printSessions(sessions, show_path=False):
+    print('%-16s %-12s %5s %4s %6s %6s %6s %6s %8s' % (
+        'date', 'animal', 'stage', 'dir', 'LH', 'trials', 'go', 'stop', 'SSRT'))
+    for s in sessions:
+        print('%-16s %-12s %5s %4s %6s %6s %6s %6s %8s' % (
+            s['date'], s['animal'][:12], formatValue(s['stage']), formatValue(s['direction']),
+            formatValue(s['lh']), formatValue(s['trial_count']), formatValue(s['go_correct']),
+            formatValue(s['stop_correct']), formatValue(s['ssrt'], 1)))
+        if show_path:
+            print('    ' + s['path'])
+
+
+def printCurve(curve):
+    print('%-16s %5s %6s %6s %6s %6s %6s %6s %8s  %s' % (
+        'date', 'stage', 'LH', 'trials', '30min', '/min', 'go', 'stop', 'SSRT', 'criteria'))
+    for s in curve:
+        print('%-16s %5s %6s %6s %6s %6s %6s %6s %8s  %s' % (
+            s['date'], formatValue(s['stage']), formatValue(s['lh']), formatValue(s['trials']),
+            formatValue(s['trials_30min']), formatValue(s['trials_per_min'], 1),
+            formatValue(s['go_correct']), formatValue(s['stop_correct']), formatValue(s['ssrt'], 1),
+            s['flags'] or ''))
+        print('%-16s %5s %6s %6s %6s %6s %6s %6s %8s' % (
+            '  rolling', '', formatValue(s['rolling_lh'], 0), '', '', formatValue(s['rolling_trials_per_min'], 1),
+            formatValue(s['rolling_go_correct']), formatValue(s['rolling_stop_correct']),
+            formatValue(s['rolling_ssrt'], 1)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='sst-archive', description='Index and search session reports.')
+    parser.add_argument('--db', default=DEFAULT_DB, help='index file (default %(default)s)')
+    parser.add_argument('--rules', default=None, help='stage criteria as JSON (default: the README shaping)')
+    commands = parser.add_subparsers(dest='command')
+    scan = commands.add_parser('scan', help='index new and changed reports')
+    scan.add_argument('directories', nargs='+')
+    query = commands.add_parser('query', help='list sessions')
+    query.add_argument('--animal')
+    query.add_argument('--stage', type=int)
+    query.add_argument('--direction', choices=['l', 'r'])
+    query.add_argument('--since', help='YYYY-MM-DD')
+    query.add_argument('--until', help='YYYY-MM-DD')
+    query.add_argument('--min-trials', type=int)
+    query.add_argument('--laser', type=int, choices=[0, 1])
+    query.add_argument('--paths', action='store_true', help='show report paths')
+    commands.add_parser('animals', help='list animals')
+    progress = commands.add_parser('progress', help='learning curve of an animal')
+    progress.add_argument('--animal', required=True)
+    progress.add_argument('--stage', type=int)
+    commands.add_parser('criteria', help='animals meeting a stage criterion at their last session')
+    commands.add_parser('rebuild', help='recompute learning curves and criteria (after changing the rules)')
+    args = parser.parse_args(argv)
+
+    archive = SessionArchive(args.db, loadRules(args.rules) if args.rules else None)
+    start = time.perf_counter()
+    if args.command == 'scan':
+        updated, unchanged, removed = archive.scan(args.directories)
+        print('%d indexed, %d unchanged, %d removed in %.2f s (%d sessions)' % (
+            updated, unchanged, removed, time.perf_counter()-start, archive.count()))
+    elif args.command == 'query':
+        sessions = archive.query(args.animal, args.stage, args.direction, args.since,
+                                 args.until, args.min_trials, args.laser)
+        elapsed = time.perf_counter() - start
+        printSessions(sessions, args.paths)
+        print('%d sessions in %.1f ms' % (len(sessions), 1000*elapsed))
+    elif args.command == 'animals':
+        print('\n'.join(archive.animals()))
+    elif args.command == 'progress':
+        printCurve(archive.progress.curve(args.animal, args.stage))
+        state = archive.progress.state(args.animal)
+        for stage, at_stage in sorted(state['stages'].items()):
+            print('stage %s: %d sessions on %d days since %s' % (
+                stage, at_stage['sessions'], at_stage['days'], at_stage['first']))
+        for name, date in sorted(state['met'].items(), key=lambda item: item[1]):
+            print('%s first met %s' % (name, date))
+    elif args.command == 'criteria':
+        for animal, stage, name, action, date in archive.progress.flagged():
+            print('%-12s stage %s  %-12s %s (%s)' % (animal, stage, name, action, date))
+    elif args.command == 'rebuild':
+        with archive.connection:
+            for animal in archive.animals():
+                archive.progress.rebuild(animal)
+        print('%d animals in %.2f s' % (len(archive.animals()), time.perf_counter()-start))
+    else:
+        parser.print_help()
+    archive.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,475 @@
+'''
+Lab collector: rig PCs push their live event streams and finished reports to
+one central service, which merges them into one archive and index.
+
+Rig side, RigUploader (a Data listener) batches the events it sees. Every
+batch and every finished report becomes a numbered message, written to a
+local spool directory first and deleted only when the collector has
+acknowledged it. The connection is kept open and re-opened with back-off,
+so nothing is lost while the collector or the network is down. After a
+reconnect the unacknowledged messages are sent again, and the collector
+drops the ones it already has.
+
+Collector side, CollectorServer writes for every rig:
+
+    <root>/<rig>/<report files>              indexed in <root>/sst_archive.db
+    <root>/<rig>/events/<session>.events     the live event stream
+
+Each event stream is a sequence of batches: a header (host time, number of
+events), then that many (2-byte code, 4-byte board timestamp) records, as on
+the serial line (see readEventLog).
+
+    sst-collector --root D:/lab --port 9998
+    sst-gui --collector labserver:9998 --rig rig07
+'''
+import os
+import re
+import sys
+import glob
+import json
+import time
+import zlib
+import queue
+import select
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+from collections import deque
+
+from sst.sst_archive import SessionArchive
+
+DEFAULT_PORT = 9998
+HEADER = struct.Struct('<BII')     # type, seq, payload length
+BATCH = struct.Struct('<dHI')      # host time, session name length, events
+LOG_BATCH = struct.Struct('<dI')   # host time, events
+RECORD = struct.Struct('<2sl')     # code, board timestamp
+
+HELLO = 1    # {"rig": name}; answered with ACK of the last seq the collector has
+EVENTS = 2   # zlib(BATCH + session + records)
+REPORT = 3   # zlib(name length + name + file)
+ACK = 4      # seq, cumulative
+
+RIG_NAME = re.compile(r'[^\w.-]')
+
+
+def sendMessage(sock, kind, seq, payload=b''):
+    sock.sendall(HEADER.pack(kind, seq, len(payload)) + payload)
+
+
+def recvExact(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def readMessage(sock):
+    kind, seq, length = HEADER.unpack(recvExact(sock, HEADER.size))
+    return kind, seq, recvExact(sock, length) if length else b''
+
+
+def encodeEvents(session, events, host_time):
+    '''
+    events: (code, timestamp) of the board; codes longer than 2 characters
+    (decoder errors) are left out. Float timestamps (video events of the
+    motion detector, in board ticks) are rounded to whole ticks
+    '''
+    records = [RECORD.pack(code.encode('latin-1'), int(round(timestamp))) for code, timestamp in events
+               if len(code) == 2]
+    name = session.encode()
+    return zlib.compress(BATCH.pack(host_time, len(name), len(records)) + name + b''.join(records))
+
+
+def decodeEvents(payload):
+    '''
+    return (session, host time, number of events, raw records)
+    '''
+    raw = zlib.decompress(payload)
+    host_time, name_length, n = BATCH.unpack_from(raw)
+    start = BATCH.size + name_length
+    return raw[BATCH.size:start].decode(), host_time, n, raw[start:start+n*RECORD.size]
+
+
+def encodeReport(name, data):
+    name = name.encode()
+    return zlib.compress(struct.pack('<H', len(name)) + name + data)
+
+
+def decodeReport(payload):
+    raw = zlib.decompress(payload)
+    length = struct.unpack_from('<H', raw)[0]
+    return raw[2:2+length].decode(), raw[2+length:]
+
+
+def readEventLog(path):
+    '''
+    yield (host time, code, board timestamp) of an event stream
+    '''
+    with open(path, 'rb') as f:
+        raw = f.read()
+    pos = 0
+    while pos < len(raw):
+        host_time, n = LOG_BATCH.unpack_from(raw, pos)
+        pos += LOG_BATCH.size
+        for code, timestamp in RECORD.iter_unpack(raw[pos:pos+n*RECORD.size]):
+            yield host_time, code.decode('latin-1'), timestamp
+        pos += n*RECORD.size
+
+
+class RigUploader(threading.Thread):
+    '''
+    Rig side: spool and push events and reports to the collector.
+    '''
+    def __init__(self, host, port=DEFAULT_PORT, rig=None, spool_dir='sst_spool',
+                 batch_interval=0.25, batch_size=512, window=64):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.address = (host, port)
+        self.rig = rig or socket.gethostname()
+        self.spool_dir = spool_dir
+        self.batch_interval = batch_interval
+        self.batch_size = batch_size
+        self.window = window   # unacknowledged messages in flight
+        self.events = deque()
+        self.session = 'unknown'
+        self.alive = True
+        self.sock = None
+        self.sent = 0
+        self.acked = 0
+        self.reconnects = 0
+        self.lock = threading.Lock()   # seq and pending, spooled from the GUI and this thread
+        # events popped and spooled as one step, so batches keep their order
+        # between the GUI and this thread, and stay before a report or new session
+        self.flush_lock = threading.RLock()
+        if not os.path.isdir(spool_dir):
+            os.makedirs(spool_dir)
+        self.pending = deque(self._spooled())   # (seq, kind, path) not acknowledged yet
+        self.seq = self.pending[-1][0] if self.pending else 0
+
+    def on_event(self, data_in):
+        '''
+        listener registered on Data
+        '''
+        self.events.append((data_in[0], data_in[1]))
+
+    def startSession(self, session):
+        with self.flush_lock:
+            self._flushEvents()
+            self.session = session
+
+    def sendReport(self, path):
+        '''
+        queue a finished report
+        '''
+        with open(path, 'rb') as f:
+            payload = encodeReport(os.path.basename(path), f.read())
+        with self.flush_lock:
+            self._flushEvents()
+            self._spool(REPORT, payload)
+
+    def stop(self, timeout=5.0):
+        '''
+        flush, then wait up to timeout for the collector to take the spool;
+        what is left is sent on the next start
+        '''
+        self._flushEvents()
+        deadline = time.time() + timeout
+        while self.pending and self.sock is not None and time.time() < deadline:
+            time.sleep(0.01)
+        self.alive = False
+        self.join()
+
+    def _spooled(self):
+        messages = []
+        for path in glob.glob(os.path.join(self.spool_dir, '*.msg')):
+            seq, kind = os.path.basename(path)[:-4].split('_')
+            messages.append((int(seq), int(kind), path))
+        return sorted(messages)
+
+    def _spool(self, kind, payload):
+        with self.lock:
+            self.seq += 1
+            path = os.path.join(self.spool_dir, '%012d_%d.msg' % (self.seq, kind))
+            with open(path + '.tmp', 'wb') as f:
+                f.write(payload)
+            os.replace(path + '.tmp', path)
+            self.pending.append((self.seq, kind, path))
+
+    def _flushEvents(self):
+        with self.flush_lock:
+            while self.events:
+                events = []
+                while self.events and len(events) < self.batch_size:
+                    events.append(self.events.popleft())
+                self._spool(EVENTS, encodeEvents(self.session, events, time.time()))
+
+    def _acknowledged(self, seq):
+        while True:
+            with self.lock:
+                if not self.pending or self.pending[0][0] > seq:
+                    break
+                path = self.pending.popleft()[2]
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.acked = max(self.acked, seq)
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=2.0)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sendMessage(sock, HELLO, 0, json.dumps({'rig': self.rig}).encode())
+            kind, seq, _ = readMessage(sock)
+            if kind != ACK:
+                raise OSError('unexpected answer to hello')
+        except (OSError, EOFError):
+            sock.close()
+            raise
+        sock.setblocking(False)
+        self.sock = sock
+        self._acknowledged(seq)
+
+    def _disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    def run(self):
+        backoff = 0.1
+        last_flush = time.time()
+        received = bytearray()
+        next_seq = 0   # first seq not sent on this connection
+        while self.alive:
+            now = time.time()
+            if now - last_flush >= self.batch_interval or len(self.events) >= self.batch_size:
+                self._flushEvents()
+                last_flush = now
+            if self.sock is None:
+                try:
+                    self._connect()
+                    backoff = 0.1
+                    next_seq = self.acked + 1
+                    received = bytearray()
+                except (OSError, EOFError):
+                    time.sleep(backoff)
+                    backoff = min(backoff*2, 5.0)
+                    self.reconnects += 1
+                    continue
+            try:
+                with self.lock:
+                    unsent = [message for message in self.pending if message[0] >= next_seq]
+                for seq, kind, path in unsent[:max(0, self.window - (next_seq - 1 - self.acked))]:
+                    with open(path, 'rb') as f:
+                        payload = f.read()
+                    self.sock.setblocking(True)
+                    sendMessage(self.sock, kind, seq, payload)
+                    self.sock.setblocking(False)
+                    next_seq = seq + 1
+                    self.sent += 1
+                # collect ACKs until the next batch is due
+                timeout = max(0.0, min(0.05, self.batch_interval - (time.time() - last_flush)))
+                if select.select([self.sock], [], [], timeout)[0]:
+                    chunk = self.sock.recv(65536)
+                    if not chunk:
+                        raise EOFError('collector closed the connection')
+                    received += chunk
+                    acked = None
+                    while len(received) >= HEADER.size:
+                        kind, seq, length = HEADER.unpack_from(received)
+                        if len(received) < HEADER.size + length:
+                            break
+                        del received[:HEADER.size + length]
+                        if kind == ACK:
+                            acked = seq
+                    if acked is not None:
+                        self._acknowledged(acked)
+            except (OSError, EOFError):
+                self._disconnect()
+        self._disconnect()
+
+
+class CollectorHandler(socketserver.BaseRequestHandler):
+    '''
+    one connection of one rig
+    '''
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server = self.server
+        rig = None
+        with server.locks_lock:
+            if server.closed:
+                return
+            server.connections.add(sock)
+        try:
+            while True:
+                kind, seq, payload = readMessage(sock)
+                if kind == HELLO:
+                    rig = RIG_NAME.sub('_', json.loads(payload.decode())['rig']) or 'rig'
+                    sendMessage(sock, ACK, server.lastSeq(rig))
+                elif rig is None:
+                    return
+                elif kind in (EVENTS, REPORT):
+                    server.store(rig, kind, seq, payload)
+                    sendMessage(sock, ACK, seq)
+        except (OSError, EOFError, ValueError, zlib.error):
+            pass
+        finally:
+            with server.locks_lock:
+                server.connections.discard(sock)
+
+
+class CollectorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    '''
+    Central collector. Messages of one rig are stored in order under a
+    per-rig lock; the SQLite index is written by a single thread.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, address=('0.0.0.0', DEFAULT_PORT)):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.last_seq = {}
+        self.connections = set()
+        self.closed = False
+        self.index_queue = queue.Queue()
+        self.events_received = 0
+        self.reports_received = 0
+        self.indexer = threading.Thread(target=self._index)
+        self.indexer.daemon = True
+        self.indexer.start()
+        socketserver.TCPServer.__init__(self, address, CollectorHandler)
+
+    def rigLock(self, rig):
+        with self.locks_lock:
+            return self.locks.setdefault(rig, threading.Lock())
+
+    def _seqFile(self, rig):
+        return os.path.join(self.root, rig, '.last_seq')
+
+    def _lastSeq(self, rig):
+        if rig not in self.last_seq:
+            try:
+                with open(self._seqFile(rig)) as f:
+                    self.last_seq[rig] = int(f.read())
+            except (OSError, ValueError):
+                self.last_seq[rig] = 0
+        return self.last_seq[rig]
+
+    def lastSeq(self, rig):
+        with self.rigLock(rig):
+            return self._lastSeq(rig)
+
+    def store(self, rig, kind, seq, payload):
+        with self.rigLock(rig):
+            last = self._lastSeq(rig)
+            if seq <= last:
+                return   # sent again after a reconnect
+            if seq != last + 1:
+                # an older connection of the rig is still delivering; the rig
+                # sends again from its last ACK after reconnecting
+                raise EOFError('seq {0} of {1} after {2}'.format(seq, rig, last))
+            directory = os.path.join(self.root, rig)
+            if kind == EVENTS:
+                session, host_time, n, records = decodeEvents(payload)
+                events_dir = os.path.join(directory, 'events')
+                if not os.path.isdir(events_dir):
+                    os.makedirs(events_dir)
+                with open(os.path.join(events_dir, RIG_NAME.sub('_', session) + '.events'), 'ab') as f:
+                    f.write(LOG_BATCH.pack(host_time, n) + records)
+                with self.locks_lock:
+                    self.events_received += n
+                self.index_queue.put(('events', rig, session, n, host_time))
+            else:
+                name, data = decodeReport(payload)
+                path = os.path.join(directory, os.path.basename(name))
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                with open(path, 'wb') as f:
+                    f.write(data)
+                with self.locks_lock:
+                    self.reports_received += 1
+                self.index_queue.put(('report', path))
+            self.last_seq[rig] = seq
+            with open(self._seqFile(rig) + '.tmp', 'w') as f:
+                f.write(str(seq))
+            os.replace(self._seqFile(rig) + '.tmp', self._seqFile(rig))
+
+    def _index(self):
+        archive = SessionArchive(os.path.join(self.root, 'sst_archive.db'))
+        archive.connection.execute('''CREATE TABLE IF NOT EXISTS streams (
+            rig TEXT, session TEXT, batches INTEGER, events INTEGER, last_time REAL,
+            PRIMARY KEY (rig, session))''')
+        while True:
+            item = self.index_queue.get()
+            if item is None:
+                break
+            items = [item]
+            while not self.index_queue.empty() and len(items) < 1000:
+                items.append(self.index_queue.get())
+            with archive.connection:
+                for item in items:
+                    if item is None:
+                        continue
+                    if item[0] == 'events':
+                        _, rig, session, n, host_time = item
+                        archive.connection.execute(
+                            'INSERT OR IGNORE INTO streams VALUES (?, ?, 0, 0, 0)', (rig, session))
+                        archive.connection.execute(
+                            'UPDATE streams SET batches = batches + 1, events = events + ?, last_time = ? '
+                            'WHERE rig = ? AND session = ?', (n, host_time, rig, session))
+            for item in items:
+                if item is not None and item[0] == 'report':
+                    try:
+                        archive.addReport(item[1])
+                    except (OSError, UnicodeDecodeError) as e:
+                        print('Can not index {0}: {1}'.format(item[1], e))
+            if None in items:
+                break
+        archive.close()
+
+    def server_close(self):
+        socketserver.TCPServer.server_close(self)
+        with self.locks_lock:
+            self.closed = True
+            connections = list(self.connections)
+        for sock in connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.index_queue.put(None)
+        self.indexer.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='sst-collector', description='Collect sessions from the rigs.')
+    parser.add_argument('--root', default='sst_collector', help='archive directory (default %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+    server = CollectorServer(args.root, ('0.0.0.0', args.port))
+    print('Collecting into {0} on port {1}'.format(os.path.abspath(args.root), args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
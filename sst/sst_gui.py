@@ -6,10 +6,12 @@ import os
 import time
 import random
 import datetime
+import logging
+import argparse
 import threading
 from pkg_resources import resource_stream
-from PyQt5.QtWidgets import QApplication, QMainWindow, QDialog, QSizePolicy, QMessageBox
-from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication, QMainWindow, QDialog, QSizePolicy, QMessageBox, QDockWidget
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QPixmap, QValidator, QIntValidator
 import pygame as pg
 
@@ -19,18 +21,34 @@ matplotlib.use("Qt5Agg")
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 
-from sst.sst_summary import calCR, calRT, returnSSRT
+from sst.sst_summary import calCR, calRT, returnSSRT, sessionSSRT
 from sst.sst_mainwindow import Ui_MainWindow
 from sst.sst_newTraining import Ui_Dialog
 from sst.SerialConnection import SerialConnection
 from sst.SerialMonitor import SerialMonitor
 from sst.Data import Data
-from sst.sst_server import ThreadedTCPServer, MyTCPHandler
+from sst.sst_server import ThreadedTCPServer, MyTCPHandler, CameraStream, frameSource
+from sst.sst_recorder import VideoRecorder, videoFileName
+from sst.sst_motion import MotionDetector
+from sst.schedule import generateSchedule, ScheduleStreamer
+from sst.sst_protocol import CommandChannel
+from sst.sst_collector import RigUploader, DEFAULT_PORT
+from sst.codec import writeSession
+from sst.psth import eventRasters, plotRaster, plotPSTH
 from sst.sst_video import displayVideo
+from sst.profiling import SessionProfiler, profileBundleName
+from sst.debounce import PokeDebouncer
+from sst.eventlog import EventLog
+from sst.sst_logview import EventLogPanel
+from sst.traces import SessionTraces, TracePlot
+from sst.progress import columnMetrics
 
 
 class mainWindow(QMainWindow, Ui_MainWindow):
-    def __init__(self, port='com3', baudrate=115200):
+    def __init__(self, port='com3', baudrate=115200, camera=None, recordVideo=False,
+                 detectMotion=False, scheduleSeed=None, boardSchedule=False, textCommands=False,
+                 uploader=None, rasterAlign=None, profile=False, hotWindow=None, debounceMs=None,
+                 eventLog=False):
         QMainWindow.__init__(self)
         Ui_MainWindow.__init__(self)
         self.setupUi(self)
@@ -42,11 +60,49 @@ class mainWindow(QMainWindow, Ui_MainWindow):
         self.isRunning=False
         self.histPlot = MyHistCanvas()
         self.rtDisplay.addWidget(self.histPlot)
+        # rolling go/stop accuracy, RT and SSD of every trial
+        self.tracePlot = MyTraceCanvas()
+        self.rtDisplay.addWidget(self.tracePlot)
+        # pokes around an event of every trial, e.g. the stop signal
+        self.rasterAlign = rasterAlign
+        self.rasterPlot = None
+        if rasterAlign is not None:
+            self.rasterPlot = MyRasterCanvas(rasterAlign)
+            self.rtDisplay.addWidget(self.rasterPlot)
         self.resultSaved = True
         self.port = port
         self.baudrate=baudrate
         self.connection = SerialConnection(self.port, self.baudrate)
+        # acknowledged binary commands, or the old text commands
+        self.channel = None if textCommands else CommandChannel(self.connection)
         self.serialMonitor=None
+        self.camera = camera
+        self.recordVideo = recordVideo
+        self.recorder = None
+        self.detectMotion = detectMotion
+        self.motionDetector = None
+        self.scheduleSeed = scheduleSeed
+        self.boardSchedule = boardSchedule
+        self.schedule = None
+        # events and reports pushed to the lab collector
+        self.uploader = uploader
+        # per-session profile bundle next to the report
+        self.profile = profile
+        self.profiler = None
+        # events per column kept in memory, older ones spilled to disk
+        self.hotWindow = hotWindow
+        # poke chatter shorter than debounceMs is coalesced before storing
+        self.debounceMs = debounceMs
+        self.debouncer = None
+        # raw event stream of the session in a dock, kept after the session ends
+        self.eventLog = None
+        self.eventLogPanel = None
+        if eventLog:
+            self.eventLog = EventLog()
+            self.eventLogPanel = EventLogPanel(self.eventLog)
+            dock = QDockWidget('Event log', self)
+            dock.setWidget(self.eventLogPanel)
+            self.addDockWidget(Qt.BottomDockWidgetArea, dock)
         self.testReward_button.setEnabled(False)
         self.testStopSignal_button.setEnabled(False)
         # new training setting window
@@ -99,6 +155,21 @@ class mainWindow(QMainWindow, Ui_MainWindow):
 
 
     def sessionStart(self):
+        # stop trials are drawn here and streamed to the board on request;
+        # parameters that no schedule satisfies do not start the session
+        self.schedule = None
+        params = self.getParams()
+        if params['stage'] in (4, 5) and not self.boardSchedule:
+            try:
+                self.schedule = generateSchedule(int(params['baseline']), int(params['blockLength']),
+                                                 int(params['blockNumber']), float(params['stopPercent']),
+                                                 0.33 if params['stage'] == 5 else 0.0,
+                                                 seed=self.scheduleSeed)
+            except ValueError as error:
+                QMessageBox.warning(self, "Invalid Schedule", "No stop trial schedule fits the parameters:\n"
+                                    + str(error))
+                return
+
         self.isRunning = True
         self.start_button.setEnabled(False)
         self.end_button.setEnabled(True)
@@ -116,13 +187,56 @@ class mainWindow(QMainWindow, Ui_MainWindow):
 
         #start serial monitor
         if self.serialMonitor is None:
-           self.serialMonitor = SerialMonitor(Data(), self.connection)
+           data = Data(self.hotWindow)
+           self.debouncer = None
+           if self.debounceMs:
+               self.debouncer = PokeDebouncer(data.write, self.debounceMs)
+           self.serialMonitor = SerialMonitor(data, self.connection,
+                                              None if self.debouncer is None else self.debouncer.write)
+           if self.eventLogPanel is not None:
+               self.eventLog = EventLog()
+               data.listeners.append(self.eventLog.on_event)
+               self.eventLogPanel.setLog(self.eventLog)
         self.serialMonitor.STATE.connect(self.trialEndUpdate)
 
         self.serialMonitor.start()
 
+        if self.profile:
+            self.profiler = SessionProfiler()
+            self.profiler.watchData(self.serialMonitor.get_data())
+            self.profiler.start()
+
+        # record the camera stream with a trial/event index
+        if self.recordVideo and self.camera is not None and self.camera.isOpened():
+            createdTime = datetime.datetime.now().strftime("%Y-%m-%d %H-%M")
+            self.recorder = VideoRecorder(self.camera, videoFileName(createdTime))
+            self.serialMonitor.get_data().listeners.append(self.recorder.on_event)
+            self.recorder.start()
+
+        # motion in the port regions as video events
+        if self.detectMotion and self.camera is not None and self.camera.isOpened():
+            data = self.serialMonitor.get_data()
+            self.motionDetector = MotionDetector(data.writeVideo)
+            data.listeners.append(self.motionDetector.on_event)
+            self.camera.addConsumer(self.motionDetector.on_frame)
+
+        if self.channel is not None:
+            self.serialMonitor.get_data().listeners.append(self.channel.on_event)
+
+        if self.uploader is not None:
+            self.uploader.startSession(datetime.datetime.now().strftime("%Y-%m-%d %H-%M"))
+            if self.uploader.on_event not in self.serialMonitor.get_data().listeners:
+                self.serialMonitor.get_data().listeners.append(self.uploader.on_event)
+
+        if self.schedule is not None:
+            streamer = ScheduleStreamer(self.connection, self.schedule, channel=self.channel)
+            self.serialMonitor.get_data().listeners.append(streamer.on_event)
+
         # send session parameters to arduino
         self.sendParams()
+        if self.motionDetector is not None:
+            # the board clock starts when the parameters arrive
+            self.motionDetector.setClock(time.time())
 
         # initialize mainwindow display
         self.trialNumLabel.setText('0')
@@ -132,6 +246,7 @@ class mainWindow(QMainWindow, Ui_MainWindow):
         self.ssrtLabel.setText('0 ms')
         # reset the histogram in rtDisplay
         self.histPlot.reset()
+        self.tracePlot.reset(self.getParams()['direction'])
 
         params = self.getParams()
         if params['direction'] == 'l':
@@ -153,16 +268,23 @@ class mainWindow(QMainWindow, Ui_MainWindow):
             stopNum = int((int(params['blockLength'])*float(params['stopPercent']))*int(params['blockNumber']))
         else:
             stopNum = int((int(params['sessionLength'])-int(params['baseline']))*float(params['stopPercent']))
-        if stopNum > 100:
+        if stopNum > 100 and self.schedule is None:
             stopNum = 100 # stop number should be less than 100.
             while stopNum%int(params['blockNumber']) != 0:
                 stopNum -= 1
 
+        scheduleLength = 0 if self.schedule is None else len(self.schedule)
+        if self.channel is not None:
+            self.channel.sendParams(params, stopNum, scheduleLength)
+            self.setParams(params)
+            return
+
         paramsToSend = str(params['stage'])+','+params['direction']+','+params['lh']+','\
                            +params['sessionLength']+','+params['baseline']+','+str(stopNum)+','\
                            +params['punishment']+','+params['blockLength']+','+params['blockNumber']+','\
                            +params['reward']+','+params['blinkerFreq']+','+params['isLaser']+','\
-                           +params['laserFreq']+','+params['pulseDur']+','+params['laserDur']+','+'\n'
+                           +params['laserFreq']+','+params['pulseDur']+','+params['laserDur']+','\
+                           +str(scheduleLength)+','+'\n'
         self.connection.write(paramsToSend, append_headers=False)
         self.setParams(params)
 
@@ -179,7 +301,9 @@ class mainWindow(QMainWindow, Ui_MainWindow):
             self.runingLabel.setVisible(True)
 
     def trialEndUpdate(self):
-        data = self.serialMonitor.get_data().get()
+        session = self.serialMonitor.get_data().snapshot()
+        # live statistics over the last trials in memory in a bounded session
+        data = session if self.hotWindow is None else session.lastTrials(self.hotWindow)
         stage = self.getParams()['stage']
 
         self.trialNum += 1
@@ -191,7 +315,10 @@ class mainWindow(QMainWindow, Ui_MainWindow):
                 rt = calRT(data['pokeOutL'],data['pokeInR'])
             # cal initial ssd and send to control program
             if self.trialNum == int(self.getParams()['baseline']) and stage == 5:
-                if np.median(rt) > 0:
+                if self.channel is not None:
+                    # no go RTs yet: the median is nan, send 0 as the text command did
+                    self.channel.sendSSD(max(np.median(rt), 0) if np.size(rt) else 0)
+                elif np.median(rt) > 0:
                     self.connection.write(str(np.median(rt))+'\n', append_headers=False)
                 else:# If median of rt was less than 0, then stop delay will be set to zero
                     self.connection.write('0\n', append_headers=False)
@@ -201,7 +328,10 @@ class mainWindow(QMainWindow, Ui_MainWindow):
             self.stopPerfLabel.setText(str(float(cr['StopTrial'])*100)+'%')
             if len(rt)>0:
                 self.histPlot.update_figure(rt)
-            self.serialMonitor.get_data().save()  # save a temp data in case of program corrupt or power off.
+            if self.rasterPlot is not None:
+                self.rasterPlot.update_figure(data)
+            self.tracePlot.update_figure(session)
+            self.serialMonitor.get_data().save(snapshot=session)  # save a temp data in case of program corrupt or power off.
 
             # play STOP alert
             if self.trialNum>int(self.getParams()['sessionLength']):
@@ -210,7 +340,9 @@ class mainWindow(QMainWindow, Ui_MainWindow):
 
     def sessionEnd(self):
         # restart arduino
-        if self.getParams()['stage'] == '5':
+        if self.channel is not None:
+            self.channel.restart()
+        elif self.getParams()['stage'] == '5':
             self.connection.write('r')
         else:
             self.connection.write('r', append_headers=False)
@@ -230,13 +362,31 @@ class mainWindow(QMainWindow, Ui_MainWindow):
         self.trialNum = 0
 
         # save data to txt file
+        if self.debouncer is not None:
+            self.debouncer.flush()
         filename = self.saveData()
         self.resultSaved = True
+        if self.uploader is not None:
+            self.uploader.sendReport(filename)
+        if self.profiler is not None:
+            self.profiler.stop(profileBundleName(filename))
+            print('Profile saved: '+profileBundleName(filename))
+            self.profiler = None
 
         #if self.getParams()['stage']==5:
         #    ssrt = str(self.getSSRT(filename))
         #    self.ssrtLabel.setText(ssrt)
 
+        if self.motionDetector is not None:
+            self.camera.removeConsumer(self.motionDetector.on_frame)
+            self.motionDetector = None
+
+        # stop video recording
+        if self.recorder is not None:
+            self.recorder.stop()
+            print('Video saved: '+self.recorder.file_name)
+            self.recorder = None
+
         # close serial monitor
         if self.serialMonitor is not None:
             self.serialMonitor.get_data().clear_temp()   # clear temp file 
@@ -278,11 +428,34 @@ class mainWindow(QMainWindow, Ui_MainWindow):
                     v = int(int(v)/1.024)
                 v = str(v)
                 f.write(k+': '+v+ ' ')
-            f.write(str(self.sendParams()))
+            # session summary, so the archive index only needs this line
+            cr = calCR(data['trialType'], data['isRewarded'])
+            f.write('goCorrect: '+str(cr['GoTrial'])+' stopCorrect: '+str(cr['StopTrial'])+' ')
+            metrics = columnMetrics(data)   # learning curve of sst.progress
+            f.write('minutes: '+format(metrics['minutes'], '.2f')+' trials30min: '
+                    +str(metrics['trials_30min'])+' ')
+            if self.debouncer is not None:
+                f.write('pokeEdges: '+self.debouncer.summary()+' ')   # raw/stored
+            ssrt = sessionSSRT(data)
+            if ssrt is not None:
+                f.write('ssrt: '+format(ssrt, '.1f')+' ')
+            # The baseline wrote str(self.sendParams()) here, which also sent the
+            # parameters again to the board it had just restarted. They are no
+            # longer sent; the 'None' it returned stays as the last token of the
+            # line so that readers of the header see the same format.
+            f.write('None')
             for name, value in data.items():
                 f.write('\n'+name+'\n')
                 f.write(str(value))
+            if self.schedule is not None:
+                # trial kinds as streamed: 0 go, 1 stop, 2 noise
+                f.write('\nschedule\n')
+                f.write(str(self.schedule.tolist()))
             f.write('\n')
+        # the same columns as exact ticks, compressed, for long-term storage
+        meta = {'params': dict((k, str(v)) for k, v in self.getParams().items()), 'createdTime': createdTime,
+                'schedule': None if self.schedule is None else self.schedule.tolist()}
+        writeSession(fileName[:-4] + '.sstz', data, meta)
         # f.write('\nPokeInL\n')
         # f.write(str(data['pokeInL']))   ####line 4
         # f.write('\nPokeOutL\n')
@@ -335,20 +508,26 @@ This program is a simple system for neuroscience research of behavior inhibition
 It may be used and modified with no restriction."""
 )
 
+    def sendTestCommand(self, command):
+        if self.channel is not None:
+            self.channel.sendTest(command)
+        else:
+            self.connection.write(command)
+
     def testRewardStart(self):
-        self.connection.write('t')
+        self.sendTestCommand('t')
 
     def testRewardEnd(self):
-        self.connection.write('s')
+        self.sendTestCommand('s')
 
     def testStopSignal(self):
-        self.connection.write('f')
+        self.sendTestCommand('f')
 
     def testLaserOn(self):
-        self.connection.write('l')
+        self.sendTestCommand('l')
 
     def testLaserOff(self):
-        self.connection.write('x')
+        self.sendTestCommand('x')
 
     def getCurrentTrialNum(self):
         return self.trialNum
@@ -530,18 +709,120 @@ class MyHistCanvas(FigureCanvas):
         self.axes.plot(list(range(10)),x)
         self.draw()
 
+
+class MyTraceCanvas(FigureCanvas):
+    '''
+    rolling performance of the session, trial by trial (sst.traces)
+    '''
+    def __init__(self, parent=None, width=5, height=4, dpi=70):
+        fig = Figure(figsize=(width, height), dpi=dpi)
+        self.traces = SessionTraces()
+        self.plot = TracePlot(fig, self.traces)
+        FigureCanvas.__init__(self, fig)
+        self.setParent(parent)
+        FigureCanvas.setSizePolicy(self, QSizePolicy.Expanding, QSizePolicy.Expanding)
+        FigureCanvas.updateGeometry(self)
+
+    def update_figure(self, data):
+        # only the trials since the last update are read
+        if self.traces.update(data):
+            self.plot.update()
+            self.draw()
+
+    def reset(self, direction='l'):
+        self.traces = SessionTraces(direction)
+        self.plot.setTraces(self.traces)
+        self.draw()
+
+
+class MyRasterCanvas(FigureCanvas):
+    '''
+    raster and PSTH of the pokes around one event of every trial
+    '''
+    CODES = [('IL', 'b'), ('IM', 'g'), ('IR', 'm')]
+
+    def __init__(self, align, window=(-1000, 2000), parent=None, width=5, height=4, dpi=70):
+        fig = Figure(figsize=(width, height), dpi=dpi)
+        self.rasterAxes = fig.add_subplot(211)
+        self.psthAxes = fig.add_subplot(212, sharex=self.rasterAxes)
+        self.align = align
+        self.window = window
+        FigureCanvas.__init__(self, fig)
+        self.setParent(parent)
+        FigureCanvas.setSizePolicy(self, QSizePolicy.Expanding, QSizePolicy.Expanding)
+        FigureCanvas.updateGeometry(self)
+
+    def update_figure(self, data):
+        rasters = eventRasters(data, self.align, [code for code, _ in self.CODES], self.window)
+        self.rasterAxes.clear()
+        self.psthAxes.clear()
+        for code, color in self.CODES:
+            plotRaster(self.rasterAxes, rasters[code], color=color)
+            plotPSTH(self.psthAxes, rasters[code], bin_ms=50, color=color)
+        self.rasterAxes.set_ylabel(self.align + ' #')
+        self.psthAxes.set_xlabel('Time from ' + self.align + ' (ms)')
+        self.psthAxes.set_ylabel('events/s')
+        self.draw()
+
 # main entry point of the script
 def main():
     speed = 115200   # communication speed
     port = 'COM4'   # port used for communication
 
-    app = QApplication(sys.argv)
-    window = mainWindow(port, speed)
+    parser = argparse.ArgumentParser(prog='sst-gui')
+    parser.add_argument('--record', action='store_true',
+                        help='record the camera stream with a trial/event index')
+    parser.add_argument('--motion', action='store_true',
+                        help='detect motion in the port regions of the camera feed')
+    parser.add_argument('--schedule-seed', type=int, default=None,
+                        help='seed of the stop trial schedule, for a reproducible session')
+    parser.add_argument('--board-schedule', action='store_true',
+                        help='let the board draw the stop trials (firmware without schedule streaming)')
+    parser.add_argument('--text-commands', action='store_true',
+                        help='send parameters and commands as text (firmware without binary commands)')
+    parser.add_argument('--collector', default=None, metavar='HOST[:PORT]',
+                        help='push events and reports to the lab collector')
+    parser.add_argument('--raster', default=None, choices=['SS', 'RS', 'IM', 'IL', 'IR'],
+                        help='show pokes aligned to this event of every trial')
+    parser.add_argument('--camera', default='0',
+                        help="camera device number, video file, image directory or 'synthetic'")
+    parser.add_argument('--rig', default=None,
+                        help='name of this rig at the collector (default: host name)')
+    parser.add_argument('--profile', action='store_true',
+                        help='profile threads and memory of each session, saved next to the report')
+    parser.add_argument('--hot-window', type=int, default=None, metavar='N',
+                        help='keep the last N events of each kind in memory and spill older ones '
+                             'to sst_spill/ (very long sessions)')
+    parser.add_argument('--debounce', type=float, default=None, metavar='MS',
+                        help='coalesce nose-poke chatter shorter than MS milliseconds')
+    parser.add_argument('--event-log', action='store_true',
+                        help='show the raw event stream of the session in a filterable table')
+    parser.add_argument('--log-level', default='WARNING',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='DEBUG logs every event from the board to the console')
+    args, qt_args = parser.parse_known_args()
+    logging.basicConfig(level=getattr(logging, args.log_level),
+                        format='%(asctime)s %(name)s %(message)s')
+
+    app = QApplication(sys.argv[:1]+qt_args)
+
+    # camera shared by the video server and the recorder
+    camera = CameraStream(frameSource(args.camera))
+    camera.start()
+    uploader = None
+    if args.collector:
+        host, _, collectorPort = args.collector.partition(':')
+        uploader = RigUploader(host, int(collectorPort or DEFAULT_PORT), args.rig)
+        uploader.start()
+    window = mainWindow(port, speed, camera, args.record, args.motion, args.schedule_seed,
+                        args.board_schedule, args.text_commands, uploader, args.raster,
+                        args.profile, args.hot_window, args.debounce, args.event_log)
 
     # host and port for server
     HOST, PORT = "0.0.0.0", 9999
     # server
     server = ThreadedTCPServer((HOST, PORT),MyTCPHandler)
+    server.camera = camera
     server.getTrialNum = window.getCurrentTrialNum
     server.getTimeSinceStart = window.getTimeSinceStart
     video_server = threading.Thread(target=server.serve_forever)
@@ -0,0 +1,225 @@
+'''
+Event log panel of the GUI: the raw event stream of a session as a table.
+
+EventLogModel is a QAbstractTableModel over an sst.eventlog.EventLog. It
+holds only an array of log rows (all rows, or the rows of a filter) and
+formats a cell when the view asks for it, so the view draws the visible
+rows whatever the length of the session. Rows come into the model in
+batches through canFetchMore/fetchMore as the view scrolls down; refresh()
+(on a timer) appends the rows that arrived since the last refresh with one
+beginInsertRows, without a reset. Filters by event code and trial range go
+through the indexes of the log (np.searchsorted), not a scan of the rows.
+
+    log = EventLog()
+    data.listeners.append(log.on_event)
+    dock = QDockWidget('Event log')
+    dock.setWidget(EventLogPanel(log))
+    window.addDockWidget(Qt.BottomDockWidgetArea, dock)
+'''
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QVariant, QTimer
+from PyQt5.QtWidgets import (QWidget, QTableView, QLineEdit, QSpinBox, QCheckBox, QLabel,
+                             QHBoxLayout, QVBoxLayout, QHeaderView, QAbstractItemView)
+
+from sst.events import eventId, IL, OL, IM, OM, IR, OR, SS, RS, SD, LASER, VIDEO
+from sst.eventlog import TIMESTAMP_NONE
+
+# events whose value is a board time (ticks at 1024 Hz); the others carry a
+# number (trial number, trial type, count)
+TIMED = frozenset([IL, OL, IM, OM, IR, OR, SS, RS, SD, LASER, VIDEO])
+COLUMNS = ['Row', 'Trial', 'Event', 'Value', 'Time (ms)']
+FETCH_BATCH = 10000
+
+
+class EventLogModel(QAbstractTableModel):
+    '''
+    Table of the rows of an EventLog, optionally filtered
+    '''
+    def __init__(self, log, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self.log = log
+        self.codes = None       # None: all codes
+        self.trials = None      # (first, last) or None
+        self.follow = True      # fetch everything new, for a view that sticks to the end
+        self.rows = np.empty(0, dtype=np.int64)     # log rows matching the filter
+        self.fetched = 0        # rows given to the view
+        self.seen = 0           # log length at the last refresh
+        self.timed = {}         # code -> value is a time
+
+    def setLog(self, log):
+        self.log = log
+        self.setFilter(self.codes, self.trials)
+
+    def setFilter(self, codes=None, trials=None):
+        '''
+        show only the given codes and trials first..last (None: all)
+        '''
+        self.beginResetModel()
+        self.codes = list(codes) if codes else None
+        self.trials = trials
+        self.seen = len(self.log)
+        self.rows = self.log.select(self.codes, self.trials, length=self.seen)
+        self.fetched = len(self.rows) if self.follow else min(len(self.rows), FETCH_BATCH)
+        self.endResetModel()
+
+    def refresh(self):
+        '''
+        append the matching rows logged since the last refresh
+        '''
+        length = len(self.log)
+        if length == self.seen:
+            return 0
+        new = self.log.select(self.codes, self.trials, start=self.seen, length=length)
+        self.seen = length
+        if len(new) == 0:
+            return 0
+        fetched = self.fetched
+        self.rows = np.concatenate([self.rows, new])
+        if self.follow or fetched == len(self.rows) - len(new):
+            # everything was fetched: the new rows are shown at once
+            self.beginInsertRows(QModelIndex(), fetched, len(self.rows) - 1)
+            self.fetched = len(self.rows)
+            self.endInsertRows()
+        return len(new)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.fetched
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.fetched < len(self.rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        more = min(FETCH_BATCH, len(self.rows) - self.fetched)
+        if more <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.fetched, self.fetched + more - 1)
+        self.fetched += more
+        self.endInsertRows()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section]
+        return QVariant()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignLeft | Qt.AlignVCenter if index.column() == 2 else Qt.AlignRight | Qt.AlignVCenter
+        if role != Qt.DisplayRole or not index.isValid() or index.row() >= self.fetched:
+            return QVariant()
+        row, trial, code, value = self.log.row(int(self.rows[index.row()]))
+        column = index.column()
+        if column == 0:
+            return str(row)
+        if column == 1:
+            return str(trial)
+        if column == 2:
+            return code
+        if value == TIMESTAMP_NONE:
+            return ''
+        if column == 3:
+            return str(value)
+        if self._isTimed(code) and value != 0:
+            return '%.1f' % (value/1.024)
+        return ''
+
+    def _isTimed(self, code):
+        timed = self.timed.get(code)
+        if timed is None:
+            timed = self.timed[code] = eventId(code) in TIMED
+        return timed
+
+
+class EventLogPanel(QWidget):
+    '''
+    Filter controls above a table view of an EventLogModel
+    '''
+    def __init__(self, log, interval_ms=500, parent=None):
+        QWidget.__init__(self, parent)
+        self.model = EventLogModel(log, self)
+
+        self.codesEdit = QLineEdit()
+        self.codesEdit.setPlaceholderText('codes, e.g. IL IR SS (empty: all)')
+        self.firstTrial = QSpinBox()
+        self.lastTrial = QSpinBox()
+        for box in (self.firstTrial, self.lastTrial):
+            box.setRange(0, 1 << 30)
+            box.setSpecialValueText('-')    # 0: no bound
+        self.followBox = QCheckBox('follow')
+        self.followBox.setChecked(True)
+        self.countLabel = QLabel()
+
+        self.view = QTableView()
+        self.view.setModel(self.model)
+        self.view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.view.setAlternatingRowColors(True)
+        self.view.setWordWrap(False)
+        # fixed row heights: the view never measures rows it does not draw
+        vertical = self.view.verticalHeader()
+        vertical.setSectionResizeMode(QHeaderView.Fixed)
+        vertical.setDefaultSectionSize(self.view.fontMetrics().height() + 4)
+        vertical.setVisible(False)
+        self.view.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.view.horizontalHeader().setStretchLastSection(True)
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.codesEdit, 1)
+        controls.addWidget(QLabel('trials'))
+        controls.addWidget(self.firstTrial)
+        controls.addWidget(QLabel('to'))
+        controls.addWidget(self.lastTrial)
+        controls.addWidget(self.followBox)
+        controls.addWidget(self.countLabel)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(controls)
+        layout.addWidget(self.view)
+
+        self.codesEdit.editingFinished.connect(self.applyFilter)
+        self.firstTrial.editingFinished.connect(self.applyFilter)
+        self.lastTrial.editingFinished.connect(self.applyFilter)
+        self.followBox.toggled.connect(self.setFollow)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(interval_ms)
+
+    def setLog(self, log):
+        '''
+        show another log (a new session)
+        '''
+        self.model.setLog(log)
+        self.updateCount()
+
+    def applyFilter(self):
+        codes = self.codesEdit.text().replace(',', ' ').split()
+        first, last = self.firstTrial.value(), self.lastTrial.value()
+        trials = None
+        if first or last:
+            trials = (first, last or (1 << 30))
+        if codes == (self.model.codes or []) and trials == self.model.trials:
+            return
+        self.model.setFilter(codes, trials)
+        self.updateCount()
+        if self.model.follow:
+            self.view.scrollToBottom()
+
+    def setFollow(self, follow):
+        self.model.follow = follow
+        if follow:
+            while self.model.canFetchMore():
+                self.model.fetchMore()
+            self.view.scrollToBottom()
+
+    def refresh(self):
+        if self.model.refresh():
+            self.updateCount()
+            if self.model.follow:
+                self.view.scrollToBottom()
+
+    def updateCount(self):
+        self.countLabel.setText('%d of %d' % (len(self.model.rows), len(self.model.log)))
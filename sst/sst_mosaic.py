@@ -0,0 +1,296 @@
+'''
+Mosaic of many rig video streams for the supervisor.
+
+The service connects to the video server of every rig (sst_server, port
+9999), lays the rigs out as tiles of one composite frame with the rig name,
+trial number and a mark on rigs without video, and streams the composite at a fixed rate to any
+number of supervisors in the same format as a rig. One connection and one
+JPEG decode per frame on the supervisor side:
+
+    sst-mosaic --rig rig01=10.0.0.11 --rig rig02=10.0.0.12:9999 --port 9996
+    python -c "from sst.sst_video import displayVideo; displayVideo('labserver', 9996)"
+
+Tiles are updated incrementally: the feed threads only keep the newest JPEG
+of their rig, and the compositor decodes and scales a rig only when it sent
+a new frame since the last composite (at a reduced JPEG scale when the tile
+is much smaller than the frame). Unchanged tiles are left as they are.
+'''
+import sys
+import time
+import pickle
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+
+import cv2
+import numpy as np
+
+from sst.sst_server import sendQueueDepth, clientClosed
+
+DEFAULT_PORT = 9996
+STALE = 2.0   # seconds without a frame before a tile is marked stale
+
+
+def recvExact(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1 << 16))
+        if not chunk:
+            raise EOFError('stream closed')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+class RigFeed(threading.Thread):
+    '''
+    Keeps the newest frame (still JPEG) and trial number of one rig.
+    '''
+    def __init__(self, name, host, port=9999, C_TYPE_FORMAT='I'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.name = name
+        self.address = (host, port)
+        self.header = struct.Struct(C_TYPE_FORMAT)
+        self.alive = True
+        self.lock = threading.Lock()
+        self.jpg = None
+        self.trial_num = 0
+        self.frame_time = 0
+        self.version = 0     # frames received
+        self.connected = False
+
+    def latest(self):
+        with self.lock:
+            return self.version, self.jpg, self.trial_num, self.frame_time
+
+    def _message(self, sock):
+        size = self.header.unpack(recvExact(sock, self.header.size))[0]
+        return pickle.loads(recvExact(sock, size))
+
+    def run(self):
+        backoff = 0.5
+        while self.alive:
+            try:
+                with socket.create_connection(self.address, timeout=5.0) as sock:
+                    self.connected = True
+                    backoff = 0.5
+                    while self.alive:
+                        jpg = self._message(sock)
+                        trial_num = self._message(sock)
+                        with self.lock:
+                            self.jpg = jpg
+                            self.trial_num = trial_num
+                            self.frame_time = time.time()
+                            self.version += 1
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+            self.connected = False
+            if self.alive:
+                time.sleep(backoff)
+                backoff = min(2*backoff, 10.0)
+
+    def stop(self):
+        self.alive = False
+
+
+class Mosaic(object):
+    '''
+    Composite frame of tiles, redrawn tile by tile.
+    '''
+    def __init__(self, feeds, tile=(320, 240), columns=None):
+        self.feeds = feeds
+        self.tile = tile
+        self.columns = columns or int(np.ceil(np.sqrt(len(feeds))))
+        rows = int(np.ceil(len(feeds)/float(self.columns)))
+        width, height = tile
+        self.frame = np.zeros((rows*height, self.columns*width, 3), dtype=np.uint8)
+        self.drawn = [None]*len(feeds)     # (version, stale) shown in each tile
+        self.frame_widths = [0]*len(feeds)
+        self.tiles_updated = 0
+        self.decode_time = 0.0
+
+    def tileView(self, i):
+        width, height = self.tile
+        row, column = divmod(i, self.columns)
+        return self.frame[row*height:(row+1)*height, column*width:(column+1)*width]
+
+    def _decode(self, i, jpg):
+        # let the JPEG decoder downscale when the tile is much smaller than
+        # the frames of this rig (known after one full decode)
+        width = self.tile[0]
+        flag = cv2.IMREAD_COLOR
+        if self.frame_widths[i] >= 4*width:
+            flag = cv2.IMREAD_REDUCED_COLOR_4
+        elif self.frame_widths[i] >= 2*width:
+            flag = cv2.IMREAD_REDUCED_COLOR_2
+        image = cv2.imdecode(jpg, flag)
+        if image is not None:
+            scale = {cv2.IMREAD_COLOR: 1, cv2.IMREAD_REDUCED_COLOR_2: 2, cv2.IMREAD_REDUCED_COLOR_4: 4}[flag]
+            self.frame_widths[i] = image.shape[1]*scale
+        return image
+
+    def update(self, now=None, force=False):
+        '''
+        redraw the tiles of rigs with a new frame (or that turned stale);
+        return the number of tiles redrawn
+        '''
+        now = time.time() if now is None else now
+        updated = 0
+        for i, feed in enumerate(self.feeds):
+            version, jpg, trial_num, frame_time = feed.latest()
+            stale = jpg is None or now - frame_time > STALE
+            if not force and self.drawn[i] == (version, stale):
+                continue
+            self.drawn[i] = (version, stale)
+            tile = self.tileView(i)
+            image = None
+            if jpg is not None:
+                start = time.perf_counter()
+                image = self._decode(i, jpg)
+                self.decode_time += time.perf_counter() - start
+            if image is None:
+                tile[:] = 0
+            else:
+                cv2.resize(image, self.tile, dst=tile, interpolation=cv2.INTER_AREA)
+            color = (0, 0, 255) if stale else (255, 255, 255)
+            cv2.putText(tile, feed.name, (5, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.45, color, 1, cv2.LINE_AA)
+            cv2.putText(tile, 'trial %s' % trial_num, (5, 32), cv2.FONT_HERSHEY_SIMPLEX, 0.45, color, 1,
+                        cv2.LINE_AA)
+            if stale:
+                cv2.putText(tile, 'no video' if jpg is None else 'stale',
+                            (5, 49), cv2.FONT_HERSHEY_SIMPLEX, 0.45, color, 1, cv2.LINE_AA)
+            updated += 1
+        self.tiles_updated += updated
+        return updated
+
+
+class MosaicHandler(socketserver.BaseRequestHandler):
+    '''
+    one supervisor: the newest composite packet, skipped while it is behind
+    '''
+    def handle(self):
+        server = self.server
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 18)
+        last = -1
+        while server.alive:
+            with server.condition:
+                if server.packet_num == last:
+                    server.condition.wait(1.0)
+                if server.packet_num == last or server.packet is None:
+                    continue
+                last, packet = server.packet_num, server.packet
+            if sendQueueDepth(self.request) > len(packet):
+                if clientClosed(self.request):
+                    break
+                continue
+            try:
+                self.request.sendall(packet)
+            except OSError:
+                break
+
+
+class MosaicServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    '''
+    composes the mosaic at fps and serves it to supervisors
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, feeds, address=('0.0.0.0', DEFAULT_PORT), fps=10, tile=(320, 240), columns=None,
+                 quality=60, C_TYPE_FORMAT='I'):
+        self.feeds = feeds
+        self.mosaic = Mosaic(feeds, tile, columns)
+        self.fps = fps
+        self.quality = quality
+        self.header = struct.Struct(C_TYPE_FORMAT)
+        self.condition = threading.Condition()
+        self.packet = None
+        self.packet_num = 0
+        self.alive = True
+        self.compose_time = 0.0
+        self.composites = 0
+        socketserver.TCPServer.__init__(self, address, MosaicHandler)
+        self.compositor = threading.Thread(target=self._compose)
+        self.compositor.daemon = True
+
+    def start(self):
+        for feed in self.feeds:
+            feed.start()
+        self.compositor.start()
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def _pack(self, jpg):
+        # frame then a number, as a rig: here the number of rigs with video
+        frame_data = pickle.dumps(jpg)
+        live = pickle.dumps(sum(1 for feed in self.feeds if feed.connected))
+        return (self.header.pack(len(frame_data)) + frame_data +
+                self.header.pack(len(live)) + live)
+
+    def _compose(self):
+        next_time = time.time()
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        while self.alive:
+            start = time.perf_counter()
+            updated = self.mosaic.update()
+            if updated or self.packet is None:
+                r, jpg = cv2.imencode('.jpg', self.mosaic.frame, params)
+                packet = self._pack(jpg)
+                with self.condition:
+                    self.packet = packet
+                    self.packet_num += 1
+                    self.condition.notify_all()
+            self.compose_time += time.perf_counter() - start
+            self.composites += 1
+            next_time += 1.0/self.fps
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.time()
+
+    def stop(self):
+        self.alive = False
+        for feed in self.feeds:
+            feed.stop()
+        self.shutdown()
+        self.server_close()
+
+
+def parseRig(value):
+    '''
+    name=host[:port] -> (name, host, port)
+    '''
+    name, _, address = value.partition('=')
+    if not address:
+        name, address = value, value
+    host, _, port = address.partition(':')
+    return name, host, int(port or 9999)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='sst-mosaic', description='One video stream of many rigs.')
+    parser.add_argument('--rig', action='append', required=True, metavar='NAME=HOST[:PORT]')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--fps', type=float, default=10)
+    parser.add_argument('--tile', default='320x240', help='tile size (default %(default)s)')
+    parser.add_argument('--columns', type=int, default=None)
+    args = parser.parse_args(argv)
+    tile = tuple(int(v) for v in args.tile.split('x'))
+    feeds = [RigFeed(*parseRig(value)) for value in args.rig]
+    server = MosaicServer(feeds, ('0.0.0.0', args.port), args.fps, tile, args.columns)
+    server.start()
+    print('Mosaic of {0} rigs on port {1}'.format(len(feeds), args.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
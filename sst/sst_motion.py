@@ -0,0 +1,156 @@
+'''
+Region-of-interest motion detection on the camera feed.
+
+Frames are downsampled, converted to grayscale and differenced against the
+previous frame. The fraction of changed pixels in every region is read from
+one integral image, so the cost does not grow with the size or number of the
+regions. A region becomes active after min_frames frames above on_fraction
+and inactive after min_frames frames below off_fraction.
+
+Onsets are emitted as 'V'+region and offsets as 'v'+region, with the
+timestamp converted to board ticks so the events line up with the nose pokes
+in Data.
+'''
+import time
+
+import numpy as np
+import cv2
+
+# name: (x, y, width, height) relative to the frame size.
+# The defaults suit a side view of the box with the three ports near the
+# floor; 'U' covers the upper wall (rearing) and 'X' the door of the chamber.
+DEFAULT_REGIONS = {'L': (0.05, 0.55, 0.2, 0.3),
+                   'M': (0.4, 0.55, 0.2, 0.3),
+                   'R': (0.75, 0.55, 0.2, 0.3),
+                   'U': (0.0, 0.0, 1.0, 0.25),
+                   'X': (0.9, 0.0, 0.1, 1.0)}
+
+TICKS_PER_SECOND = 1024.0
+POKE_EVENTS = ('IL', 'OL', 'IM', 'OM', 'IR', 'OR')
+
+
+class MotionDetector(object):
+    '''
+    Detect motion in regions of the frame and emit events.
+
+    Parameters
+    ----------
+    emit: called with (code, timestamp in board ticks), usually Data.writeVideo.
+    regions: dict of region name to relative (x, y, width, height).
+    budget: processing time allowed per frame in seconds. The downsampling
+        is made coarser while the detector runs over budget and finer again
+        when it has time to spare.
+    threshold: gray level change counted as motion.
+    on_fraction, off_fraction: fraction of changed pixels to switch a region
+        on and off.
+    min_frames: consecutive frames needed to switch state.
+    '''
+    def __init__(self, emit, regions=None, budget=0.004, scale=4, threshold=25,
+                 on_fraction=0.05, off_fraction=0.02, min_frames=2):
+        self.emit = emit
+        self.regions = dict(DEFAULT_REGIONS if regions is None else regions)
+        self.names = sorted(self.regions)
+        self.budget = budget
+        self.min_scale = scale
+        self.scale = scale
+        self.threshold = threshold
+        self.on_fraction = on_fraction
+        self.off_fraction = off_fraction
+        self.min_frames = min_frames
+        self.active = np.zeros(len(self.names), dtype=bool)
+        self.counter = np.zeros(len(self.names), dtype=np.int64)
+        self.fraction = np.zeros(len(self.names))
+        self.process_time = 0
+        self.frames = 0
+        self.previous = None
+        self.shape = None
+        self.clock = None  # (host time, board ticks)
+
+    def setClock(self, host_time, ticks=0):
+        '''
+        anchor host time to the board clock, e.g. when the session starts
+        '''
+        self.clock = (host_time, ticks)
+
+    def boardTime(self, host_time):
+        if self.clock is None:
+            return None
+        return self.clock[1] + (host_time - self.clock[0])*TICKS_PER_SECOND
+
+    def on_event(self, data_in):
+        '''
+        listener registered on Data; every timestamped poke refines the
+        host to board clock mapping
+        '''
+        event, timestamp = data_in[0], data_in[1]
+        if event in POKE_EVENTS and timestamp > 0:
+            self.clock = (time.time(), timestamp)
+
+    def on_frame(self, frame_num, host_time, frame):
+        '''
+        consumer registered on the camera stream
+        '''
+        start = time.perf_counter()
+        changes = self.process(frame)
+        for name, onset in changes:
+            ticks = self.boardTime(host_time)
+            if ticks is not None:
+                self.emit(('V'+name if onset else 'v'+name, ticks))
+        self._keep_budget(time.perf_counter()-start)
+
+    def _setup(self, shape):
+        # pixel boxes of the regions on the downsampled frame, as index
+        # arrays into the integral image
+        height, width = shape
+        boxes = np.array([self.regions[name] for name in self.names], dtype=float)
+        x0 = np.clip(np.round(boxes[:, 0]*width), 0, width).astype(np.int64)
+        y0 = np.clip(np.round(boxes[:, 1]*height), 0, height).astype(np.int64)
+        x1 = np.clip(np.round((boxes[:, 0]+boxes[:, 2])*width), 0, width).astype(np.int64)
+        y1 = np.clip(np.round((boxes[:, 1]+boxes[:, 3])*height), 0, height).astype(np.int64)
+        self.box = (x0, y0, x1, y1)
+        self.area = np.maximum((x1-x0)*(y1-y0), 1)
+        self.shape = shape
+        self.previous = None
+
+    def process(self, frame):
+        '''
+        update the regions with a new frame, return a list of
+        (region name, onset) for regions that switched state
+        '''
+        height = frame.shape[0] // self.scale
+        width = frame.shape[1] // self.scale
+        small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_LINEAR)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.shape != small.shape:
+            self._setup(small.shape)
+        previous, self.previous = self.previous, small
+        self.frames += 1
+        if previous is None:
+            return []
+
+        moving = (cv2.absdiff(small, previous) > self.threshold).astype(np.uint8)
+        integral = cv2.integral(moving)
+        x0, y0, x1, y1 = self.box
+        changed = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        self.fraction = changed / self.area
+
+        # hysteresis: count frames that disagree with the current state
+        disagree = np.where(self.active, self.fraction < self.off_fraction,
+                            self.fraction > self.on_fraction)
+        self.counter = np.where(disagree, self.counter+1, 0)
+        switch = self.counter >= self.min_frames
+        if not switch.any():
+            return []
+        self.active[switch] = ~self.active[switch]
+        self.counter[switch] = 0
+        return [(self.names[i], bool(self.active[i])) for i in np.flatnonzero(switch)]
+
+    def _keep_budget(self, elapsed):
+        self.process_time += 0.2*(elapsed - self.process_time)
+        if self.process_time > self.budget and self.scale < 8*self.min_scale:
+            self.scale *= 2
+            self.process_time = self.budget / 2
+        elif self.process_time < self.budget / 4 and self.scale > self.min_scale:
+            self.scale //= 2
+            self.process_time = self.budget / 2
@@ -0,0 +1,187 @@
+'''
+Binary command channel from the PC to the board.
+
+Every command is one frame
+
+    0xAA 0x55 length seq type payload[length] crc(low) crc(high)
+
+with a CRC-16/CCITT-FALSE over length..payload. The board answers each
+valid frame with an "AK" event carrying seq and each corrupt one with "NK",
+on the same serial event stream as the pokes. A command is sent again when
+it is NACKed or no ACK arrives in time, and the board applies a repeated seq
+only once, so a dropped byte costs a retry instead of a misconfigured session.
+
+The ACKs are read by the SerialMonitor thread; register
+CommandChannel.on_event as a Data listener before sending.
+'''
+import struct
+import threading
+
+SYNC = b'\xaa\x55'
+MAX_PAYLOAD = 40
+
+MSG_PARAMS = 1
+MSG_SSD = 2
+MSG_TEST = 3
+MSG_RESTART = 4
+MSG_SCHEDULE = 5
+
+# stage, side, lh, sessionLength, baseline, stopNum, punishment, blockLength,
+# blockNumber, reward, blinkerFreq, isLaser, laserFreq, pulseDur, laserDur,
+# schedule length
+PARAMS_FORMAT = struct.Struct('<BcHHHHHHHHHBHHIH')
+TEST_COMMANDS = 'tsflx'   # reward on/off, stop signal, laser on/off
+
+
+def _crcTable():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        table.append(crc & 0xFFFF)
+    return table
+
+CRC_TABLE = _crcTable()
+
+
+def crc16(data, crc=0xFFFF):
+    '''
+    CRC-16/CCITT-FALSE of bytes
+    '''
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+def encodeFrame(seq, kind, payload=b''):
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError('payload of {0} bytes is longer than {1}'.format(len(payload), MAX_PAYLOAD))
+    body = bytes(bytearray([len(payload), seq, kind])) + payload
+    return SYNC + body + struct.pack('<H', crc16(body))
+
+
+class FrameDecoder(object):
+    '''
+    Frame parser of the board, for emulators and tests.
+
+    feed() returns a list of (seq, kind, payload), with kind None for a frame
+    that failed the CRC.
+    '''
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                del self.buffer[:-1]
+                return frames
+            del self.buffer[:start]
+            if len(self.buffer) < 3:
+                return frames
+            length = self.buffer[2]
+            if length > MAX_PAYLOAD:
+                del self.buffer[:1]
+                continue
+            if len(self.buffer) < length + 7:
+                return frames
+            body = bytes(self.buffer[2:length+5])
+            crc = struct.unpack('<H', bytes(self.buffer[length+5:length+7]))[0]
+            if crc16(body) == crc:
+                del self.buffer[:length+7]
+                frames.append((body[1], body[2], body[3:]))
+            else:
+                # a lost byte pulled in the start of the next frame: look for it
+                del self.buffer[:2]
+                frames.append((body[1], None, b''))
+
+
+def packParams(params, stop_num, schedule_length=0):
+    '''
+    payload of MSG_PARAMS from the parameters of the new training dialog
+    '''
+    return PARAMS_FORMAT.pack(int(params['stage']), params['direction'].encode(), int(params['lh']),
+                              int(params['sessionLength']), int(params['baseline']), int(stop_num),
+                              int(params['punishment']), int(params['blockLength']),
+                              int(params['blockNumber']), int(params['reward']),
+                              int(params['blinkerFreq']), int(params['isLaser']),
+                              int(params['laserFreq']), int(params['pulseDur']),
+                              int(params['laserDur']), int(schedule_length))
+
+
+class CommandChannel(object):
+    '''
+    Acknowledged commands over a SerialConnection.
+    '''
+    def __init__(self, connection, timeout=0.05, retries=5):
+        self.connection = connection
+        self.timeout = timeout
+        self.retries = retries
+        self.seq = 0
+        self.condition = threading.Condition()
+        self.replies = {}   # seq -> 'AK' or 'NK'
+        self.sent = 0
+        self.retransmissions = 0
+        self.failures = 0
+
+    def on_event(self, data_in):
+        if data_in[0] in ('AK', 'NK'):
+            with self.condition:
+                self.replies[data_in[1]] = data_in[0]
+                self.condition.notify_all()
+
+    def _nextSeq(self):
+        with self.condition:
+            self.seq = (self.seq + 1) % 256
+            self.replies.pop(self.seq, None)
+            return self.seq
+
+    def send(self, kind, payload=b'', wait=True):
+        '''
+        Send a command and, if wait, block until it is acknowledged.
+        Returns False when all retries failed. Commands sent from the
+        SerialMonitor thread must not wait, it is the one reading the ACKs.
+        '''
+        seq = self._nextSeq()
+        frame = encodeFrame(seq, kind, payload)
+        self.sent += 1
+        if not wait:
+            self.connection.writeBytes(frame)
+            return True
+        for attempt in range(self.retries+1):
+            if attempt:
+                self.retransmissions += 1
+            self.connection.writeBytes(frame)
+            with self.condition:
+                if seq not in self.replies:
+                    self.condition.wait(self.timeout)
+                reply = self.replies.pop(seq, None)
+            if reply == 'AK':
+                return True
+        self.failures += 1
+        print('Command {0} (seq {1}) was not acknowledged'.format(kind, seq))
+        return False
+
+    def sendParams(self, params, stop_num, schedule_length=0):
+        return self.send(MSG_PARAMS, packParams(params, stop_num, schedule_length))
+
+    def sendSSD(self, ssd):
+        return self.send(MSG_SSD, struct.pack('<H', max(0, min(int(ssd), 0xFFFF))))
+
+    def sendTest(self, command):
+        if command not in TEST_COMMANDS:
+            raise ValueError('unknown test command {0!r}'.format(command))
+        return self.send(MSG_TEST, command.encode())
+
+    def restart(self):
+        return self.send(MSG_RESTART)
+
+    def sendSchedule(self, first, kinds, wait=False):
+        '''
+        kinds: bytes of trial kinds from trial first on; lost chunks are
+        requested again by the board, so by default this does not wait
+        '''
+        return self.send(MSG_SCHEDULE, struct.pack('<H', first) + bytes(kinds), wait)
@@ -0,0 +1,240 @@
+'''
+Record the shared camera stream to disk with a per-frame trial/event index.
+
+The video is written as motion JPEG: the JPEG frames are simply concatenated,
+so any frame can be read back by seeking to its byte offset without decoding
+the rest of the file. A sidecar index (same name, ".idx") stores one line per
+frame:
+
+    frame  offset  length  host_time  trial  events
+
+where events is a comma separated list of "code:timestamp" received from the
+board since the previous frame ("-" when there is none).
+'''
+import os
+import time
+import threading
+from collections import deque
+from queue import Queue, Full
+
+import numpy as np
+import cv2
+
+INDEX_SUFFIX = '.idx'
+INDEX_HEADER = 'frame\toffset\tlength\thost_time\ttrial\tevents\n'
+
+
+class VideoRecorder(threading.Thread):
+    '''
+    Background writer for the shared camera stream.
+
+    The capture thread only puts frames in a bounded queue; encoding and disk
+    writes happen in this thread. If the disk can not keep up, frames are
+    dropped (and counted) instead of stalling the capture.
+
+    Parameters
+    ----------
+    camera: sst_server.CameraStream to record from.
+    file_name: path of the video file, the index goes to file_name + '.idx'.
+    quality: JPEG quality of the recorded frames.
+    max_queue: frames waiting for encoding before frames get dropped.
+    '''
+    def __init__(self, camera, file_name, quality=70, max_queue=64):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.camera = camera
+        self.file_name = file_name
+        self.index_name = file_name + INDEX_SUFFIX
+        self.quality = quality
+        self.frames = Queue(max_queue)
+        self.events = deque()
+        self.trial_num = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+
+    def on_frame(self, frame_num, host_time, frame):
+        '''
+        consumer registered on the camera stream
+        '''
+        if self.frames.full():
+            self.frames_dropped += 1
+            return
+        try:
+            # the camera reuses its frame buffers, keep a copy until encoded
+            self.frames.put_nowait((frame_num, host_time, frame.copy()))
+        except Full:
+            self.frames_dropped += 1
+
+    def on_event(self, data_in):
+        '''
+        listener registered on Data, stamps board events with host time
+        '''
+        self.events.append((time.time(), data_in))
+
+    def start(self):
+        self.camera.addConsumer(self.on_frame)
+        threading.Thread.start(self)
+
+    def stop(self):
+        '''
+        stop recording, flush the remaining frames and close the files
+        '''
+        self.camera.removeConsumer(self.on_frame)
+        self.frames.put(None)
+        self.join()
+
+    def _frame_events(self, host_time):
+        # collect events that arrived before this frame was captured
+        codes = []
+        while self.events and self.events[0][0] <= host_time:
+            event, timestamp = self.events.popleft()[1][:2]
+            if event == 'TN':
+                self.trial_num = timestamp
+            codes.append(event + ':' + str(timestamp).replace(',', ';'))
+        return ','.join(codes) if codes else '-'
+
+    def run(self):
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        with open(self.file_name, 'wb') as video, open(self.index_name, 'w') as index:
+            index.write(INDEX_HEADER)
+            while True:
+                item = self.frames.get()
+                if item is None:
+                    break
+                frame_num, host_time, frame = item
+                r, jpg = cv2.imencode('.jpg', frame, params)
+                if not r:
+                    continue
+                offset = video.tell()
+                video.write(jpg.tobytes())
+                events = self._frame_events(host_time)
+                index.write('%d\t%d\t%d\t%.4f\t%d\t%s\n' % (frame_num, offset, len(jpg),
+                                                           host_time, self.trial_num, events))
+                self.frames_written += 1
+            # events after the last frame are still worth keeping
+            events = self._frame_events(float('inf'))
+            if events != '-':
+                index.write('%d\t%d\t%d\t%.4f\t%d\t%s\n' % (-1, video.tell(), 0,
+                                                           time.time(), self.trial_num, events))
+
+
+class RecordingIndex(object):
+    '''
+    Query a recording through its sidecar index.
+
+    Only the index is parsed; frames are read by seeking to their offsets.
+    '''
+    def __init__(self, file_name):
+        if file_name.endswith(INDEX_SUFFIX):
+            file_name = file_name[:-len(INDEX_SUFFIX)]
+        self.file_name = file_name
+        frame, offset, length, host_time, trial = [], [], [], [], []
+        self.events = []
+        with open(file_name + INDEX_SUFFIX, 'r') as f:
+            f.readline()
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                frame.append(int(fields[0]))
+                offset.append(int(fields[1]))
+                length.append(int(fields[2]))
+                host_time.append(float(fields[3]))
+                trial.append(int(fields[4]))
+                if fields[5] != '-':
+                    for code in fields[5].split(','):
+                        event, timestamp = code.split(':', 1)
+                        self.events.append((len(frame)-1, event, timestamp))
+        self.frame = np.array(frame, dtype=np.int64)
+        self.offset = np.array(offset, dtype=np.int64)
+        self.length = np.array(length, dtype=np.int64)
+        self.host_time = np.array(host_time)
+        self.trial = np.array(trial, dtype=np.int64)
+
+    def trials_with_event(self, event):
+        '''
+        return the sorted trial numbers in which event was received
+        e.g. 'SE' stop error, 'GE' go error, 'LE' limited hold error
+        '''
+        return sorted(set(int(self.trial[row]) for row, code, _ in self.events if code == event))
+
+    def stop_error_trials(self):
+        return self.trials_with_event('SE')
+
+    def go_error_trials(self):
+        return self.trials_with_event('GE')
+
+    def clip(self, trial, pre=0, post=0):
+        '''
+        return (trial, first_row, last_row, start_offset, end_offset) of a
+        trial, extended by pre/post seconds of host time
+        '''
+        rows = np.flatnonzero((self.trial == trial) & (self.length > 0))
+        if len(rows) == 0:
+            return None
+        start_time = self.host_time[rows[0]] - pre
+        end_time = self.host_time[rows[-1]] + post
+        first = np.searchsorted(self.host_time, start_time, side='left')
+        last = np.searchsorted(self.host_time, end_time, side='right') - 1
+        while last > first and self.length[last] == 0:
+            last -= 1
+        return (trial, int(first), int(last), int(self.offset[first]),
+                int(self.offset[last] + self.length[last]))
+
+    def clips(self, trials, pre=0, post=0):
+        clips = [self.clip(trial, pre, post) for trial in trials]
+        return [c for c in clips if c is not None]
+
+    def stop_error_clips(self, pre=1, post=1):
+        '''
+        clips for all stop-error trials
+        '''
+        return self.clips(self.stop_error_trials(), pre, post)
+
+    def read_frame(self, row):
+        '''
+        return the JPEG bytes of one frame (row of the index)
+        '''
+        with open(self.file_name, 'rb') as video:
+            video.seek(int(self.offset[row]))
+            return video.read(int(self.length[row]))
+
+    def iter_clip(self, clip):
+        '''
+        yield (frame_num, host_time, jpeg bytes) of a clip
+        '''
+        _, first, last, start, end = clip
+        with open(self.file_name, 'rb') as video:
+            video.seek(start)
+            buf = video.read(end - start)
+        for row in range(first, last+1):
+            if self.length[row] > 0:
+                begin = self.offset[row] - start
+                yield (int(self.frame[row]), float(self.host_time[row]),
+                       buf[begin:begin+self.length[row]])
+
+    def export_clip(self, clip, file_name):
+        '''
+        copy the bytes of a clip to a standalone motion JPEG file
+        '''
+        _, _, _, start, end = clip
+        with open(self.file_name, 'rb') as video, open(file_name, 'wb') as out:
+            video.seek(start)
+            out.write(video.read(end - start))
+        return file_name
+
+    def decode(self, jpg):
+        return cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), 1)
+
+    def duration(self):
+        if len(self.host_time) == 0:
+            return 0
+        return self.host_time[-1] - self.host_time[0]
+
+
+def videoFileName(created_time):
+    '''
+    video file name matching the report name of a session
+    '''
+    file_name = 'SST Video ' + created_time + '.mjpeg'
+    while os.path.exists(file_name):
+        file_name = file_name[0:-6] + ' new' + '.mjpeg'
+    return file_name
@@ -1,11 +1,410 @@
 '''
 A server for remote monitor of behavior.
 '''
+import os
+import socket
 import socketserver
+import select
+import threading
 import pickle
 import struct
+import time
+import numpy as np
 import cv2
-import imutils
+try:
+    import fcntl
+    import termios
+except ImportError:   # Windows
+    fcntl = None
+
+
+def sendQueueDepth(sock):
+    '''
+    return the bytes still waiting in the send buffer of a socket,
+    0 where the platform can not tell
+    '''
+    if fcntl is None:
+        return 0
+    try:
+        buf = fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b'\0\0\0\0')
+        return struct.unpack('i', buf)[0]
+    except (OSError, AttributeError):
+        return 0
+
+
+def clientClosed(sock):
+    '''
+    the viewer never sends anything, a readable socket means it has gone
+    '''
+    readable, _, _ = select.select([sock], [], [], 0)
+    if readable:
+        try:
+            return sock.recv(1, socket.MSG_PEEK) == b''
+        except OSError:
+            return True
+    return False
+
+
+class AdaptiveEncoder(object):
+    '''
+    JPEG encoder adapting resolution, quality and frame rate to one client.
+
+    After every frame the handler reports how long sendall blocked and how
+    many bytes are still queued in the socket. From these the encoder keeps a
+    running estimate of the link throughput and of the latency a new frame
+    would see, and steps through LEVELS to keep that latency under
+    target_latency. It also steps down when encoding alone eats more than half
+    of the frame interval (slow CPU). While the queued bytes alone exceed the
+    target latency the handler skips frames.
+
+    The resize buffer and the packet buffer are allocated once and reused
+    across frames.
+    '''
+    # (width, jpeg quality, frames per second), from best to cheapest
+    LEVELS = [(640, 70, 30), (480, 50, 25), (480, 30, 20), (360, 30, 15),
+              (320, 25, 10), (240, 20, 5), (160, 15, 2)]
+    SMOOTHING = 0.2
+    SEND_BUFFER = 65536   # a small socket buffer keeps stale frames from piling up
+
+    def __init__(self, target_latency=0.25, level=2, adaptive=True):
+        self.target_latency = target_latency
+        self.level = level
+        self.adaptive = adaptive
+        self.throughput = 0     # bytes per second drained from the socket
+        self.latency = 0        # estimated seconds before a new frame is received
+        self.encode_time = 0    # seconds to resize, overlay and encode a frame
+        self.queued = 0
+        self.last_report = None
+        self.window_bytes = 0
+        self.window_time = 0
+        self.good_frames = 0
+        self.frames_at_level = 0
+        self.encoded = 0
+        self.resized = None
+        self.packet = bytearray(1 << 16)
+
+    def settings(self):
+        return self.LEVELS[self.level]
+
+    def frameInterval(self):
+        return 1.0 / self.LEVELS[self.level][2]
+
+    def encode(self, frame, overlay=None):
+        '''
+        resize frame into the preallocated buffer, draw overlay and encode
+        '''
+        start = time.perf_counter()
+        width, quality, _ = self.LEVELS[self.level]
+        height = int(frame.shape[0] * width / float(frame.shape[1]))
+        if self.resized is None or self.resized.shape[:2] != (height, width):
+            self.resized = np.empty((height, width)+frame.shape[2:], dtype=frame.dtype)
+        cv2.resize(frame, (width, height), dst=self.resized, interpolation=cv2.INTER_AREA)
+        if overlay is not None:
+            overlay(self.resized)
+        r, jpg = cv2.imencode('.jpg', self.resized, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        # the first frames include warm-up of the encoder
+        self.encoded += 1
+        if self.encoded > 3:
+            self._smooth('encode_time', time.perf_counter()-start)
+        return (r, jpg)
+
+    def pack(self, frame, trialNum, C_TYPE_FORMAT='I'):
+        '''
+        pack frame and trial number the way pack_data does, into the reused
+        packet buffer; return a memoryview of the packet
+        '''
+        frame_data = pickle.dumps(frame)
+        trial_data = pickle.dumps(trialNum)
+        header_size = struct.calcsize(C_TYPE_FORMAT)
+        size = 2*header_size + len(frame_data) + len(trial_data)
+        if len(self.packet) < size:
+            self.packet = bytearray(2*size)
+        struct.pack_into(C_TYPE_FORMAT, self.packet, 0, len(frame_data))
+        end = header_size + len(frame_data)
+        self.packet[header_size:end] = frame_data
+        struct.pack_into(C_TYPE_FORMAT, self.packet, end, len(trial_data))
+        self.packet[end+header_size:size] = trial_data
+        return memoryview(self.packet)[:size]
+
+    def report(self, sent, send_time, queued):
+        '''
+        update the link estimates after sending sent bytes
+        '''
+        now = time.perf_counter()
+        if self.last_report is not None:
+            # bytes that left the socket buffer since the last report,
+            # averaged over windows of half a second
+            self.window_bytes += max(self.queued + sent - queued, 0)
+            self.window_time += now - self.last_report
+            if self.window_time >= 0.5:
+                self._smooth('throughput', self.window_bytes / self.window_time)
+                self.window_bytes = 0
+                self.window_time = 0
+        self.last_report = now
+        self.queued = queued
+        if queued > 0 and self.throughput > 0:
+            latency = send_time + (queued+sent) / self.throughput
+        else:
+            latency = send_time
+        self._smooth('latency', latency)
+        if self.adaptive:
+            self._adapt()
+
+    def backlog(self, queued):
+        '''
+        seconds the client needs to receive what is already queued
+        '''
+        if self.throughput > 0:
+            return queued / self.throughput
+        # link not measured yet, do not queue more than one frame
+        if queued > 0:
+            return float('inf')
+        return 0
+
+    def _smooth(self, name, value):
+        old = getattr(self, name)
+        if old == 0:
+            setattr(self, name, value)
+        else:
+            setattr(self, name, old + self.SMOOTHING*(value-old))
+
+    def _adapt(self):
+        self.frames_at_level += 1
+        # give the estimates a few frames to settle after a change
+        if self.frames_at_level < 5:
+            return
+        too_slow = self.encode_time > 0.5*self.frameInterval()
+        if (self.latency > self.target_latency or too_slow) and self.level < len(self.LEVELS)-1:
+            self.level += 1
+            self.good_frames = 0
+            self.frames_at_level = 0
+        elif self.latency < 0.5*self.target_latency and self.level > 0:
+            self.good_frames += 1
+            # step up after about two seconds of good latency
+            if self.good_frames >= 2*self.LEVELS[self.level][2]:
+                self.level -= 1
+                self.good_frames = 0
+                self.frames_at_level = 0
+        else:
+            self.good_frames = 0
+
+
+class FrameSource(object):
+    '''
+    Where CameraStream gets its frames from.
+
+    read(buffer) stores the next BGR frame in buffer (an array of shape, as
+    returned by a previous read) and returns it, or returns a new array when
+    buffer is None; it returns None when no frame is available. Sources with
+    an fps pace read() to that rate, fps None reads as fast as possible.
+    '''
+    fps = None
+    shape = None
+    _next = None   # perf_counter time of the next frame at fps
+
+    def isOpened(self):
+        return True
+
+    def read(self, buffer=None):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def _pace(self):
+        if self.fps:
+            now = time.perf_counter()
+            if self._next is None or now - self._next > 1.0:
+                self._next = now
+            elif self._next > now:
+                time.sleep(self._next - now)
+            self._next += 1.0/self.fps
+
+
+class DeviceSource(FrameSource):
+    '''
+    live camera (cv2.VideoCapture device), paced by the device
+    '''
+    def __init__(self, device=0):
+        self.capture = cv2.VideoCapture(device)
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def read(self, buffer=None):
+        ret, frame = self.capture.read(buffer)
+        if not ret:
+            return None
+        self.shape = frame.shape
+        return frame
+
+    def release(self):
+        self.capture.release()
+
+
+class FileSource(FrameSource):
+    '''
+    video file, or directory of images played in name order, at fps (None:
+    as fast as possible), from the start again at the end if loop
+    '''
+    IMAGE_TYPES = ('.jpg', '.jpeg', '.png', '.bmp')
+
+    def __init__(self, path, fps=None, loop=True):
+        self.fps = fps
+        self.loop = loop
+        self.capture = None
+        self.images = None
+        self.position = 0
+        if os.path.isdir(path):
+            self.images = sorted(os.path.join(path, name) for name in os.listdir(path)
+                                 if name.lower().endswith(self.IMAGE_TYPES))
+        else:
+            self.capture = cv2.VideoCapture(path)
+
+    def isOpened(self):
+        return bool(self.images) or (self.capture is not None and self.capture.isOpened())
+
+    def read(self, buffer=None):
+        self._pace()
+        if self.images is not None:
+            if self.position == len(self.images):
+                if not self.loop or not self.images:
+                    return None
+                self.position = 0
+            image = cv2.imread(self.images[self.position])
+            self.position += 1
+            if image is None:
+                return None
+            self.shape = image.shape
+            if buffer is None or buffer.shape != image.shape:
+                return image
+            np.copyto(buffer, image)
+            return buffer
+        ret, frame = self.capture.read(buffer)
+        if not ret and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read(buffer)
+        if not ret:
+            return None
+        self.shape = frame.shape
+        return frame
+
+    def release(self):
+        if self.capture is not None:
+            self.capture.release()
+
+
+class SyntheticSource(FrameSource):
+    '''
+    moving gradient with fixed noise and a bright square crossing the frame,
+    drawn with NumPy into the buffer; reproducible for a seed
+    '''
+    def __init__(self, width=640, height=480, fps=30, seed=0):
+        self.fps = fps
+        self.shape = (height, width, 3)
+        y, x = np.mgrid[0:height, 0:2*width]
+        self.base = ((x+y) % 256).astype(np.uint8)   # twice as wide, shifted by slicing
+        self.noise = np.random.RandomState(seed).randint(0, 40, (height, width)).astype(np.uint8)
+        self.frame_num = 0
+
+    def read(self, buffer=None):
+        self._pace()
+        height, width = self.shape[:2]
+        if buffer is None:
+            buffer = np.empty(self.shape, dtype=np.uint8)
+        shift = (self.frame_num*4) % width
+        gray = buffer[:, :, 0]
+        np.add(self.base[:, shift:shift+width], self.noise, out=gray)
+        size = height//8
+        left = (self.frame_num*8) % (width - size)
+        gray[height//2-size//2:height//2+size//2, left:left+size] = 255
+        buffer[:, :, 1] = gray
+        buffer[:, :, 2] = gray
+        self.frame_num += 1
+        return buffer
+
+
+def frameSource(spec, fps=None):
+    '''
+    FrameSource of a command line value: a device number, 'synthetic', a
+    video file or an image directory
+    '''
+    if isinstance(spec, FrameSource):
+        return spec
+    if isinstance(spec, int) or str(spec).isdigit():
+        return DeviceSource(int(spec))
+    if spec == 'synthetic':
+        return SyntheticSource(fps=fps or 30)
+    return FileSource(spec, fps=fps or 30)
+
+
+class CameraStream(threading.Thread):
+    '''
+    Capture frames from the camera in one thread and share them.
+
+    Every connection of the server and every registered consumer (e.g. the
+    video recorder) gets the same frames, so the camera is only opened once.
+    Consumers are called in the capture thread with
+    (frame_num, host_time, frame) and must return quickly.
+
+    source is a FrameSource or a device number. Frames are read into a ring
+    of `buffers` preallocated arrays, so a frame is overwritten `buffers`
+    frames later; consumers that keep frames longer must copy them.
+    '''
+    def __init__(self, source=0, buffers=4):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.source = frameSource(source)
+        self.buffers = [None]*buffers
+        self.alive = True
+        self.frame = None
+        self.frame_num = -1
+        self.frame_time = 0
+        self.consumers = []
+        self.condition = threading.Condition()
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    def addConsumer(self, consumer):
+        self.consumers.append(consumer)
+
+    def removeConsumer(self, consumer):
+        if consumer in self.consumers:
+            self.consumers.remove(consumer)
+
+    def run(self):
+        while self.alive and self.source.isOpened():
+            slot = (self.frame_num + 1) % len(self.buffers)
+            frame = self.source.read(self.buffers[slot])
+            if frame is None:
+                time.sleep(0.01)
+                continue
+            self.buffers[slot] = frame
+            frame_time = time.time()
+            with self.condition:
+                self.frame = frame
+                self.frame_num += 1
+                self.frame_time = frame_time
+                frame_num = self.frame_num
+                self.condition.notify_all()
+            for consumer in list(self.consumers):
+                consumer(frame_num, frame_time, frame)
+        self.source.release()
+
+    def read(self, last_num=-1, timeout=1.0):
+        '''
+        return (frame_num, host_time, frame) of a frame newer than last_num,
+        or the latest one if no new frame arrived within timeout.
+        '''
+        with self.condition:
+            if self.frame_num <= last_num:
+                self.condition.wait(timeout)
+            return (self.frame_num, self.frame_time, self.frame)
+
+    def stop(self):
+        self.alive = False
+
 
 class MyTCPHandler(socketserver.BaseRequestHandler):
     """
@@ -16,7 +415,9 @@ class MyTCPHandler(socketserver.BaseRequestHandler):
     client.
     """
     def __init__(self, request, client_address, server, C_TYPE_FORMAT='I'):
-        self.myCamera = cv2.VideoCapture(0)
+        self.myCamera = server.camera
+        self.frame_num = -1
+        self.encoder = AdaptiveEncoder(server.target_latency, adaptive=server.adaptive)
         self.C_TYPE_FORMAT = C_TYPE_FORMAT
         print('Connection Established')
         self.start_time = 0
@@ -24,20 +425,20 @@ class MyTCPHandler(socketserver.BaseRequestHandler):
         socketserver.BaseRequestHandler.__init__(self, request, client_address, server)
 
     def captureVideo(self, trialNum=0, current_time=0):
-        # read frame from the camera
+        # read frame from the shared camera stream
         if(self.myCamera.isOpened()):
-            ret, frame = self.myCamera.read()
-
-            # resize the frame to 480 width while keeping the ratio
-            frame = imutils.resize(frame, width=480)
-            # print trial number on the screen
-            cv2.putText(frame, 'Trial Finished: '+str(trialNum), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA )
-            # transform seconds to minutes and print it on the screen
-            current_time = current_time // 60
-            cv2.putText(frame, 'Time Elapsed: '+str(current_time)+' min', (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA )
-            # image compression
-            r, frame = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 30])
-            return((r, frame))
+            self.frame_num, _, frame = self.myCamera.read(self.frame_num)
+            if frame is None:
+                return((False, None))
+
+            # resize, print trial number and time, and compress the frame.
+            # Resolution and quality follow the link of this client.
+            def overlay(frame):
+                cv2.putText(frame, 'Trial Finished: '+str(trialNum), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA )
+                # transform seconds to minutes and print it on the screen
+                cv2.putText(frame, 'Time Elapsed: '+str(current_time // 60)+' min', (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA )
+            return self.encoder.encode(frame, overlay)
+        return((False, None))
 
     def captureTrialNum(self):
         pass
@@ -54,14 +455,46 @@ class MyTCPHandler(socketserver.BaseRequestHandler):
 
     def handle(self):
         # request handler
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.encoder.SEND_BUFFER)
+        next_time = time.time()
         while True:
+            # skip frames while the client is still behind
+            queued = sendQueueDepth(self.request)
+            if self.encoder.backlog(queued) > self.encoder.target_latency:
+                if clientClosed(self.request):
+                    break
+                self.encoder.report(0, 0, queued)
+                time.sleep(self.encoder.frameInterval())
+                next_time = time.time()
+                continue
             # get the data to send
             trialNum = self.server.getTrialNum()
             timeElapsed = self.server.getTimeSinceStart()
             r, frame = self.captureVideo(trialNum, timeElapsed)
-            data_to_send = self.pack_data(frame) + self.pack_data(trialNum)
-            self.request.sendall(data_to_send)
+            if not r:
+                # no frame yet (camera starting up): wait while the stream runs
+                if not (self.myCamera.alive and self.myCamera.isOpened()) or clientClosed(self.request):
+                    break
+                next_time = time.time()
+                continue
+            data_to_send = self.encoder.pack(frame, trialNum, self.C_TYPE_FORMAT)
+            start = time.time()
+            try:
+                self.request.sendall(data_to_send)
+            except OSError:
+                break   # client disconnected
+            self.encoder.report(len(data_to_send), time.time()-start,
+                                sendQueueDepth(self.request))
+            # keep the frame rate of the current level
+            next_time += self.encoder.frameInterval()
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.time()
 
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    pass
+    camera = None
+    target_latency = 0.25   # seconds, per client
+    adaptive = True
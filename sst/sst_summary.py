@@ -11,7 +11,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 from scipy.interpolate import UnivariateSpline
 from scipy.stats import skewtest
-from sst.preprocess import loadData, calSSRT2
+from sst.preprocess import toDataFrame, calSSRT2
+from sst.cache import loadSession
 #from pandas import DataFrame
 
 
@@ -139,8 +140,9 @@ def plotRTD(rt,baseline=20, col='green', num_bins=30):
 
 def returnSSRT(filename):
     '''
+    SSRT of a report (parsed once per process, see sst.cache)
     '''
-    data = loadData(filename)['df']
+    data = loadSession(filename)['df']
     if data.shape[0] > 320:
         ssrt = calSSRT2(data)
         return ssrt
@@ -148,6 +150,20 @@ def returnSSRT(filename):
         return 0
 
 
+def sessionSSRT(data):
+    '''
+    SSRT of a session still in memory (the dictionary of Data.get()),
+    None if it can not be calculated.
+    '''
+    try:
+        df = toDataFrame(data)
+        if df.shape[0] > 320:
+            return calSSRT2(df)
+    except (KeyError, ValueError, IndexError, ZeroDivisionError):
+        pass
+    return None
+
+
 def median(list1):
     '''
     Calculate the median of a list array.
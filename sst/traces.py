@@ -0,0 +1,209 @@
+'''
+Trial-by-trial performance traces of a running session: rolling go and stop
+accuracy, RT and SSD, drawn at the same cost at trial 10 and trial 10,000.
+
+* RollingMean keeps the last window values in a ring with their sum, so a
+  new value costs O(1).
+* MinMaxTrace is an append-only series reduced to at most `budget` buckets
+  of equal width in x, each kept as its minimum and maximum point. When the
+  buckets are full, neighbours are merged in pairs and the width doubles,
+  so appending is O(1) amortized and a redraw gets at most 2*budget points,
+  however long the session is; peaks and dips of the full series stay
+  visible. (LTTB would need the whole series at every redraw.)
+* SessionTraces folds the trials completed since the last update from a
+  snapshot of Data into the rolling means and traces.
+* TracePlot draws the traces into a matplotlib figure. Its lines are created
+  once and only get new data, and the axis limits come from running bounds.
+
+    traces = SessionTraces(direction='l')
+    plot = TracePlot(figure, traces)
+    traces.update(data.snapshot())     # at the end of every trial
+    plot.update()
+'''
+import numpy as np
+
+BUDGET = 400            # buckets per trace, about the width of the plot in pixels
+WINDOW = 20             # trials of the rolling means
+
+
+class RollingMean(object):
+    '''
+    mean of the last window values
+    '''
+    def __init__(self, window=WINDOW):
+        self.values = np.zeros(window)
+        self.window = window
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        slot = self.count % self.window
+        if self.count >= self.window:
+            self.total -= self.values[slot]
+        self.values[slot] = value
+        self.total += value
+        self.count += 1
+        # the running sum drifts; it is summed again once per window
+        if slot == self.window - 1:
+            self.total = float(self.values.sum())
+        return self.mean()
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total/min(self.count, self.window)
+
+
+class MinMaxTrace(object):
+    '''
+    (x, y) series kept as the min and max point of at most budget buckets
+    '''
+    def __init__(self, budget=BUDGET):
+        self.budget = budget
+        self.width = 1.0            # x span of a bucket
+        self.origin = None          # x of the first point
+        # per bucket: x and y of the minimum, x and y of the maximum
+        self.buckets = np.empty((budget, 4))
+        self.used = 0
+        self.length = 0
+        self.low = self.high = None     # y bounds of the whole series
+
+    def append(self, x, y):
+        if self.origin is None:
+            self.origin = x
+        bucket = int((x - self.origin)//self.width)
+        while bucket >= self.budget:
+            self._merge()
+            bucket = int((x - self.origin)//self.width)
+        buckets = self.buckets
+        if bucket >= self.used:
+            buckets[self.used:bucket+1] = np.nan
+            buckets[bucket] = (x, y, x, y)
+            self.used = bucket + 1
+        else:
+            row = buckets[bucket]
+            if not y >= row[1]:     # also when the bucket is still empty (nan)
+                row[0], row[1] = x, y
+            if not y <= row[3]:
+                row[2], row[3] = x, y
+        self.low = y if self.low is None else min(self.low, y)
+        self.high = y if self.high is None else max(self.high, y)
+        self.length += 1
+
+    def _merge(self):
+        '''
+        merge neighbouring buckets in pairs and double the width
+        '''
+        half = (self.used + 1)//2
+        pairs = np.full((2*half, 4), np.nan)
+        pairs[:self.used] = self.buckets[:self.used]
+        left, right = pairs[0::2], pairs[1::2]
+        merged = left.copy()
+        take = np.isnan(left[:, 1]) | (right[:, 1] < left[:, 1])
+        merged[take, 0:2] = right[take, 0:2]
+        take = np.isnan(left[:, 3]) | (right[:, 3] > left[:, 3])
+        merged[take, 2:4] = right[take, 2:4]
+        self.buckets[:half] = merged
+        self.used = half
+        self.width *= 2
+
+    def points(self):
+        '''
+        (x, y) arrays of the points to draw, in x order
+        '''
+        buckets = self.buckets[:self.used]
+        buckets = buckets[~np.isnan(buckets[:, 1])]
+        first_min = buckets[:, 0] <= buckets[:, 2]
+        x = np.empty(2*len(buckets))
+        y = np.empty(2*len(buckets))
+        x[0::2] = np.where(first_min, buckets[:, 0], buckets[:, 2])
+        y[0::2] = np.where(first_min, buckets[:, 1], buckets[:, 3])
+        x[1::2] = np.where(first_min, buckets[:, 2], buckets[:, 0])
+        y[1::2] = np.where(first_min, buckets[:, 3], buckets[:, 1])
+        return x, y
+
+    def __len__(self):
+        return self.length
+
+
+class SessionTraces(object):
+    '''
+    Rolling performance of a session, one point per trial
+    '''
+    NAMES = ['goAccuracy', 'stopAccuracy', 'rt', 'ssd']
+
+    def __init__(self, direction='l', window=WINDOW, budget=BUDGET):
+        # RT from leaving one side to entering the other, as in trialEndUpdate
+        self.columns = ('pokeOutR', 'pokeInL') if direction == 'l' else ('pokeOutL', 'pokeInR')
+        self.rolling = dict((name, RollingMean(window)) for name in self.NAMES[:3])
+        self.traces = dict((name, MinMaxTrace(budget)) for name in self.NAMES)
+        self.trials = 0         # trials folded
+        self.stops = 0          # stop trials folded (index into SSDs)
+
+    def update(self, data):
+        '''
+        fold the trials completed in data (a snapshot or Data.get()) since
+        the last update; return their number
+        '''
+        trial_type, is_rewarded = data['trialType'], data['isRewarded']
+        poke_out, poke_in = data[self.columns[0]], data[self.columns[1]]
+        ssds = data['SSDs']
+        complete = min(len(trial_type), len(is_rewarded))
+        start = self.trials
+        for trial in range(start, complete):
+            x = trial + 1
+            rewarded = is_rewarded[trial] == 1
+            if trial_type[trial] == 1:
+                self._add('goAccuracy', x, 1.0 if rewarded else 0.0)
+                if rewarded and trial < len(poke_out) and trial < len(poke_in) and \
+                        poke_out[trial] != 0 and poke_in[trial] != 0:
+                    self._add('rt', x, abs(poke_in[trial] - poke_out[trial]))
+            else:
+                self._add('stopAccuracy', x, 1.0 if rewarded else 0.0)
+                if self.stops < len(ssds):
+                    self.traces['ssd'].append(x, ssds[self.stops])
+                    self.stops += 1
+        self.trials = max(complete, start)
+        return self.trials - start
+
+    def _add(self, name, x, value):
+        self.traces[name].append(x, self.rolling[name].add(value))
+
+
+class TracePlot(object):
+    '''
+    Lines of SessionTraces in three axes of a matplotlib figure
+    '''
+    def __init__(self, figure, traces):
+        self.figure = figure
+        self.traces = traces
+        self.accuracyAxes = figure.add_subplot(311)
+        self.rtAxes = figure.add_subplot(312, sharex=self.accuracyAxes)
+        self.ssdAxes = figure.add_subplot(313, sharex=self.accuracyAxes)
+        self.lines = {'goAccuracy': self.accuracyAxes.plot([], [], color='c', label='go')[0],
+                      'stopAccuracy': self.accuracyAxes.plot([], [], color='m', label='stop')[0],
+                      'rt': self.rtAxes.plot([], [], color='g')[0],
+                      'ssd': self.ssdAxes.plot([], [], color='k', drawstyle='steps-post')[0]}
+        self.accuracyAxes.set_ylim(-0.05, 1.05)
+        self.accuracyAxes.set_ylabel('correct')
+        self.accuracyAxes.legend(loc='lower right', fontsize='small')
+        self.rtAxes.set_ylabel('RT (ms)')
+        self.ssdAxes.set_ylabel('SSD (ms)')
+        self.ssdAxes.set_xlabel('trial')
+
+    def setTraces(self, traces):
+        self.traces = traces
+        self.update()
+
+    def update(self):
+        '''
+        new data for the lines and limits; the caller draws the canvas
+        '''
+        for name, line in self.lines.items():
+            line.set_data(*self.traces.traces[name].points())
+        self.accuracyAxes.set_xlim(0, max(self.traces.trials, 10))
+        for axes, name in [(self.rtAxes, 'rt'), (self.ssdAxes, 'ssd')]:
+            trace = self.traces.traces[name]
+            if trace.low is not None:
+                margin = max(0.05*(trace.high - trace.low), 1.0)
+                axes.set_ylim(trace.low - margin, trace.high + margin)